@@ -1,6 +1,128 @@
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
 from django.apps import AppConfig
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # no cross-worker lock, every worker warms up on its own
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Top-level SNOMED CT hierarchies, the children of 138875005 |SNOMED CT Concept|
+TOP_LEVEL_CONCEPTS = [
+    "123037004",  # Body structure
+    "404684003",  # Clinical finding
+    "308916002",  # Environment or geographical location
+    "272379006",  # Event
+    "363787002",  # Observable entity
+    "410607006",  # Organism
+    "373873005",  # Pharmaceutical / biologic product
+    "78621006",  # Physical force
+    "260787004",  # Physical object
+    "71388002",  # Procedure
+    "362981000",  # Qualifier value
+    "419891008",  # Record artifact
+    "243796009",  # Situation with explicit context
+    "900000000000441003",  # SNOMED CT Model Component
+    "48176007",  # Social context
+    "370115009",  # Special concept
+    "123038009",  # Specimen
+    "254291000",  # Staging and scales
+    "105590001",  # Substance
+]
 
 
 class TerminologyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'terminology'
+
+
+_warmup_started = False
+
+
+def start_descendant_warmup():
+    """
+    Start warm_descendant_cache in a daemon thread, once per process. Called by
+    the WSGI and ASGI entry points only, so management commands and the test
+    runner never query ES at startup; under runserver only the serving child
+    loads the WSGI application.
+    """
+    global _warmup_started
+    if not settings.DESCENDANT_WARMUP or _warmup_started:
+        return
+    _warmup_started = True
+    threading.Thread(target=warm_descendant_cache, name='descendant-warmup', daemon=True).start()
+
+
+def warmup_path(suffix):
+    """Lock and marker files of the warmup, per index version, shared by the workers of a host"""
+    directory = settings.DESCENDANT_CACHE_DIR or tempfile.gettempdir()
+    return os.path.join(directory, f"descendant-warmup-{settings.TERMINOLOGY_INDEX_VERSION}.{suffix}")
+
+
+@contextmanager
+def warmup_lock():
+    """Exclusive file lock, so the workers of a host warm up one after the other"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(warmup_path("lock")), exist_ok=True)
+    with open(warmup_path("lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def warm_descendant_cache():
+    """
+    Fill the descendant cache for the top-level hierarchies in the background,
+    then for each further level down to DESCENDANT_WARMUP_DEPTH.
+    Workers take turns under warmup_lock. Once one has warmed every root, the
+    others skip the warmup when the sets live in a cache they share
+    (DESCENDANT_SHARED_CACHE or DESCENDANT_CACHE_DIR); with only the in-process
+    memo each worker still fills its own.
+    """
+    from terminology.views.expand.expand import (
+        _descendant_cache, find_descendants_many, get_children_composite, memo_lookup
+    )
+
+    shared = settings.DESCENDANT_SHARED_CACHE or bool(settings.DESCENDANT_CACHE_DIR)
+    try:
+        with warmup_lock():
+            if shared and os.path.exists(warmup_path("done")):
+                logger.info("Descendant cache already warmed by another worker")
+                return
+
+            roots = TOP_LEVEL_CONCEPTS
+            complete = True
+            for depth in range(1, settings.DESCENDANT_WARMUP_DEPTH + 1):
+                find_descendants_many(roots)
+                # find_descendants_many logs failed walks and leaves them out of the memo
+                _, unresolved = memo_lookup(_descendant_cache, roots)
+                logger.info(
+                    "Warmed descendants of %d of %d concepts at depth %d",
+                    len(roots) - len(unresolved), len(roots), depth
+                )
+                if unresolved:
+                    complete = False
+                    logger.warning("Descendant cache warmup failed for %d concepts at depth %d", len(unresolved), depth)
+
+                if depth < settings.DESCENDANT_WARMUP_DEPTH:
+                    roots = [str(concept_id) for concept_id in sorted(get_children_composite(roots))]
+
+            if not complete:
+                logger.warning("Descendant cache warmup finished incomplete")
+                return
+            if shared:
+                open(warmup_path("done"), "a").close()
+            logger.info("Descendant cache warmup complete")
+    except Exception as e:
+        logger.error("Descendant cache warmup failed: %s", e, exc_info=True)
@@ -1,18 +1,130 @@
+from django.conf import settings
+from django.core.cache import cache, caches
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from terminology_api.ES.es_client import es
+from terminology_api.ES.executor import search_executor
+from terminology_api.ES.mappings import forget_index, index_field_type, index_has_field, index_sort_fields
+from terminology_api.ES.pagination import iter_hits, iter_hits_sliced, iter_pages_pit
 from terminology_api.LOINC.query_engine import LoincQueryEngine
-from datetime import datetime
+from terminology_api.renderers import EncodedJSON, encode_json
+from terminology_api.text import STRIP_MARKS_TABLE, WHITESPACE_RE
+from array import array
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+import hashlib
+import threading
+import heapq
+import json
+import time
 import uuid
 import logging
-import re
+import os
 import unicodedata
 
+try:
+    import numpy as np
+except ImportError:  # scoring falls back to the per-hit Python loop
+    np = None
+
 logger = logging.getLogger(__name__)
 
 # Maximum terms per Elasticsearch query (safe limit)
 MAX_TERMS_PER_QUERY = 60000
 
+# Batched text queries sent per msearch request
+MSEARCH_WINDOW = 8
+
+# Elasticsearch index.max_result_window, the deepest page reachable with from/size
+MAX_RESULT_WINDOW = 10000
+
+# Descendant sets kept in memory, keyed by root and index version
+DESCENDANT_CACHE_SIZE = 1024
+
+# Smallest descendant set written to DESCENDANT_CACHE_DIR, smaller ones are cheap to refetch
+DISK_CACHE_MIN_DESCENDANTS = 5000
+
+# Concept existence checks kept in memory, keyed by concept and index version
+EXISTENCE_CACHE_SIZE = 16384
+
+# Resolved compose concept sets kept in memory, keyed by compose digest and index version
+COMPOSE_CACHE_SIZE = 32
+
+# Scratch index holding staged concept id lists, referenced by terms lookups
+SCRATCH_INDEX = "expand_scratch"
+
+# Id lists at least this long are staged once instead of sent inline with every search
+STAGE_MIN_IDS = 5000
+
+# Seconds a staged id list is kept after it was last (re)staged; a process reuses its
+# staging for half of that, then stages the list again, which renews the doc
+STAGED_DOC_TTL = 3600
+
+# Seconds between sweeps of expired and other index versions' docs out of SCRATCH_INDEX
+SCRATCH_SWEEP_INTERVAL = 300
+
+# Staged doc ids remembered in memory, with when they were staged
+STAGED_IDS_SIZE = 1024
+
+# Page size of the per-root descendant searches batched into one msearch, most
+# subtrees fit in one page and larger ones follow with prefetching search_after
+DESCENDANT_PAGE_SIZE = 1000
+
+# Subtrees at least this large are read by DESCENDANT_SLICES parallel search_after
+# cursors over one point in time instead of a single sequential cursor
+SLICED_DESCENDANTS_MIN = 20000
+DESCENDANT_SLICES = 4
+
+# Stand-ins for the per-response ids and timestamp in an encoded expansion, which is
+# cached without them and stamped afresh for every response that serves it
+RESOURCE_ID_STAMP = b"@resource-id@"
+EXPANSION_ID_STAMP = b"@expansion-id@"
+TIMESTAMP_STAMP = b"@timestamp@"
+
+# Descendant sets hold SNOMED ids as ints, far smaller and cheaper to hash than strings
+_descendant_cache = OrderedDict()
+_existence_cache = OrderedDict()
+_compose_cache = OrderedDict()
+_staged_ids = OrderedDict()
+_memo_lock = threading.Lock()
+_last_scratch_sweep = 0.0
+
+# Hit count above which filtered scoring is done with NumPy arrays
+VECTORIZE_MIN_HITS = 2000
+
+# Descriptions fetched per concept up front, concepts with more are paged in
+DESCRIPTIONS_PER_CONCEPT = 5
+
+# Doc values read from scored filter hits, their _source is never loaded
+SCORED_DESCRIPTION_FIELDS = ["concept_id.keyword", "type_id.keyword", "term.keyword"]
+
+# Description fields read for concept details; preferred_in resolves preferred terms on indices that have it
+DETAIL_DESCRIPTION_FIELDS = ["concept_id", "type_id", "term", "language_code", "preferred_in"]
+
+# Parts of a descriptions search response that are read, ES drops the rest before sending it
+DESCRIPTION_FILTER_PATH = "hits.total,hits.hits._id,hits.hits._source"
+
+# Language reference set holding the preferred terms for each display language
+LANGUAGE_REFSETS = {
+    'en': '900000000000509007',  # US English
+    'en-us': '900000000000509007',  # US English
+    'en-gb': '900000000000508004',  # GB English
+}
+
+# Fixed parts of every expansion response, shared rather than rebuilt per request
+SNOMED_COPYRIGHT = "This value set includes content from SNOMED CT, which is copyright © 2002+ International Health Terminology Standards Development Organisation (SNOMED International), and distributed by agreement between SNOMED International and HL7. Implementer use of SNOMED CT is not covered by this agreement."
+SNOMED_VERSION_PARAMETER = {
+    "name": "version",
+    "valueUri": "http://snomed.info/sct|http://snomed.info/sct/900000000000207008/version/20240731"
+}
+
+# Counts every matching concept on the scoring search itself, not just the ones in the returned hits
+MATCHING_CONCEPTS_AGGS = {
+    "matching_concepts": {
+        "cardinality": {"field": "concept_id.keyword", "precision_threshold": 40000}
+    }
+}
+
 @api_view(['POST'])
 def expand_view(request):
     """
@@ -48,7 +160,15 @@ def expand_view(request):
         if display_language in ['en-gb', 'en-us']:
             display_language = 'en'
         
-        print(f"Expand request - Language: {display_language}, Count: {count}, Filter: '{filter_text}'")
+        logger.debug("Expand request - Language: %s, Count: %s, Filter: '%s'", display_language, count, filter_text)
+        
+        # Identical expansions are served from cache until the index version changes
+        cache_key = expansion_cache_key(
+            value_set.get('compose', {}), filter_text, display_language, include_designations, count, offset
+        )
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            return Response(stamp_expansion(cached_response))
         
         # Validate required parameters
         if not value_set:
@@ -76,9 +196,30 @@ def expand_view(request):
                 }]
             }, status=400)
         
+        # Details and preferred terms already fetched during this request, by concept id
+        request_cache = {}
+        
         # Get all concept IDs from includes
         all_concept_ids = set()
         include_entire_codesystem = False
+        scan_all_concepts = False
+        include_roots = []
+        
+        # Composes of is-a filters, whole-code-system includes and excludes are paged
+        # by ES on the concepts index, without resolving any subtree in Python
+        paged_query = None
+        page_start = None
+        if not filter_text and can_page_concepts_in_es():
+            paged_query = compose_concepts_query(includes, excludes)
+            page_start = concepts_page_start(paged_query, count, offset) if paged_query else None
+            if page_start is None:
+                paged_query = None
+        
+        # Filtered composes, explicit codes included, are matched on the descriptions' ancestors
+        # instead, one search rather than a terms filter over every descendant id
+        filtered_query = None
+        if filter_text and can_filter_descriptions_in_es():
+            filtered_query = compose_concepts_query(includes, excludes, concept_field="concept_id")
         
         for include in includes:
             system = include.get('system')
@@ -101,9 +242,7 @@ def expand_view(request):
                 
             # Handle direct concept codes
             if 'concept' in include:
-                codes = include['concept']
-                for code_entry in codes:
-                    all_concept_ids.add(code_entry['code'])
+                all_concept_ids.update(sctid(code_entry['code']) for code_entry in include['concept'])
             
             # Handle filters
             filters = include.get('filter', [])
@@ -113,33 +252,22 @@ def expand_view(request):
                 value = filter_def.get('value')
                 
                 if property_name == 'concept' and op == 'is-a':
-                    # Validate root concept exists
-                    if not concept_exists(value):
-                        logger.warning(f"Root concept {value} not found")
-                        continue
-                    
-                    # Get descendants using optimized batch query
-                    descendants = find_descendants(value)
-                    all_concept_ids.update(descendants)
-                    all_concept_ids.add(value)  # Include the concept itself
-                    logger.info(f"Found {len(descendants)} descendants for {value}")
+                    include_roots.append(value)
         
         # Handle entire code system expansion
         if include_entire_codesystem:
             if filter_text:
                 # For filtered searches on entire code system, use direct search approach
                 expansion_contains, total_count = get_entire_codesystem_filtered_expansion(
-                    filter_text, display_language, include_designations, count, offset
+                    filter_text, display_language, include_designations, count, offset, request_cache
                 )
-            else:
-                # For unfiltered entire code system, get all active concepts
-                all_concept_ids = get_all_active_concepts()
-                logger.info(f"Retrieved {len(all_concept_ids)} active concepts from entire code system")
-        
-        logger.info(f"Total concept IDs before exclusions: {len(all_concept_ids)}")
+            elif not paged_query:
+                # For unfiltered entire code system, get all active concepts once the excludes are known
+                scan_all_concepts = True
         
         # Process excludes
         exclude_concept_ids = set()
+        exclude_roots = []
         for exclude in excludes:
             system = exclude.get('system')
             if system != 'http://snomed.info/sct':
@@ -147,9 +275,7 @@ def expand_view(request):
                 
             # Handle direct concept codes
             if 'concept' in exclude:
-                codes = exclude['concept']
-                for code_entry in codes:
-                    exclude_concept_ids.add(code_entry['code'])
+                exclude_concept_ids.update(sctid(code_entry['code']) for code_entry in exclude['concept'])
             
             # Handle filters
             exclude_filters = exclude.get('filter', [])
@@ -159,38 +285,75 @@ def expand_view(request):
                 value = filter_def.get('value')
                 
                 if property_name == 'concept' and op == 'is-a':
-                    if concept_exists(value):
-                        descendants = find_descendants(value)
-                        exclude_concept_ids.update(descendants)
-                        exclude_concept_ids.add(value)
-        
-        # Remove excluded concepts
-        all_concept_ids -= exclude_concept_ids
-        
-        logger.info(f"Concept IDs after exclusions: {len(all_concept_ids)}")
+                    exclude_roots.append(value)
+        
+        # Queries paged or filtered by ES already apply the is-a filters themselves
+        if paged_query or filtered_query:
+            exclude_roots = []
+        if include_entire_codesystem or paged_query or filtered_query:
+            include_roots = []
+        
+        # The concept set of a compose resolved in Python is the same for every filter and page
+        # it is expanded with, so it is memoized by compose for the index version
+        # Only a complete concept set is staged for terms lookups, under its compose digest
+        stage_key = None
+        cacheable = True
+        if paged_query or filtered_query or (include_entire_codesystem and filter_text):
+            all_concept_ids = frozenset()
+        else:
+            compose_key = compose_cache_key(compose)
+            known, _ = memo_lookup(_compose_cache, [compose_key])
+            if compose_key in known:
+                all_concept_ids = known[compose_key]
+                stage_key = compose_key
+            else:
+                all_concept_ids, complete = resolve_compose_concepts(
+                    all_concept_ids, include_roots, exclude_concept_ids, exclude_roots,
+                    include_entire_codesystem, scan_all_concepts
+                )
+                if complete:
+                    memo_store(_compose_cache, {compose_key: all_concept_ids}, COMPOSE_CACHE_SIZE)
+                    stage_key = compose_key
+                else:
+                    # Concepts may be missing after a failed ES call, so this response is not cached
+                    cacheable = False
         
         # Get expansion with efficient filtering and pagination
         if include_entire_codesystem and filter_text:
             # Already handled above in get_entire_codesystem_filtered_expansion
             pass
+        elif filtered_query:
+            expansion_contains, total_count = get_filtered_expansion_for_query(
+                filtered_query, filter_text, display_language, include_designations, count, offset, request_cache
+            )
         elif filter_text:
             expansion_contains, total_count = get_filtered_expansion(
-                all_concept_ids, filter_text, display_language, include_designations, count, offset
+                all_concept_ids, filter_text, display_language, include_designations, count, offset, request_cache,
+                stage_key=stage_key
+            )
+        elif paged_query:
+            expansion_contains, total_count = get_concepts_page(
+                paged_query, page_start, display_language, include_designations, count, offset, request_cache
             )
         else:
             expansion_contains, total_count = get_expansion(
-                all_concept_ids, display_language, include_designations, count, offset
+                all_concept_ids, display_language, include_designations, count, offset, request_cache
             )
         
         # Build response
         response = build_expansion_response(
             expansion_contains, total_count, offset, display_language
         )
+        # Cached encoded, so neither this response nor the cache hits after it encode the expansion again.
+        # ES errors in the expansion helpers propagate to the handler below, so only successes get here
+        encoded = encode_json(response)
+        if cacheable:
+            cache.set(cache_key, encoded, settings.EXPANSION_CACHE_TIMEOUT)
         
-        return Response(response)
+        return Response(stamp_expansion(encoded))
         
     except Exception as e:
-        logger.error(f"ValueSet expand error: {str(e)}", exc_info=True)
+        logger.error("ValueSet expand error: %s", e, exc_info=True)
         return Response({
             "resourceType": "OperationOutcome",
             "issue": [{
@@ -200,93 +363,466 @@ def expand_view(request):
             }]
         }, status=500)
 
-def concept_exists(concept_id):
-    """Check if a concept exists in the concepts index"""
+def sctid(code):
+    """
+    A SNOMED code as held in expansion sets: an int for SCTIDs, which always
+    fit in int64, and the code string itself for anything non-numeric
+    """
     try:
-        result = es.get(index="concepts", id=concept_id, ignore=[404])
-        return result.get('found', False)
-    except Exception as e:
-        logger.error(f"Error checking concept existence for {concept_id}: {str(e)}")
-        return False
+        return int(code)
+    except (TypeError, ValueError):
+        return code
+
+def expansion_cache_key(compose, filter_text, display_language, include_designations, count, offset):
+    """Cache key for an expansion from its normalized parameters and the index version"""
+    params = json.dumps(
+        [compose, filter_text, display_language, include_designations, count, offset],
+        sort_keys=True, separators=(',', ':')
+    )
+    digest = hashlib.sha1(params.encode('utf-8')).hexdigest()
+    return f"expand:{settings.TERMINOLOGY_INDEX_VERSION}:{digest}"
+
+def compose_cache_key(compose):
+    """Digest of a compose alone, shared by every filter, page and language it is expanded with"""
+    return hashlib.sha1(
+        json.dumps(compose, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+def resolve_compose_concepts(all_concept_ids, include_roots, exclude_concept_ids, exclude_roots, include_entire_codesystem, scan_all_concepts):
+    """
+    The concept ids of a compose: the explicit codes and is-a subtrees included,
+    minus those excluded. Returns (ids, complete), complete being False when a
+    failed ES call may have left concepts out, so the ids are not memoized.
+    The ids are packed by compact_concept_ids.
+    """
+    # With the ancestors field, excluded roots are matched against the included ids only
+    # instead of resolving their whole subtrees
+    scoped_excludes = bool(exclude_roots) and not include_entire_codesystem and index_has_field("concepts", "ancestors")
+    
+    # Included and excluded is-a roots are resolved together, so a root on both sides
+    # is walked once and every root shares one existence check and descendant round trip.
+    # The whole code system scan needs nothing from the roots, so it runs alongside them on
+    # the shared pool; its prefetching iter_hits uses a thread of its own, never this pool
+    all_concepts_future = search_executor.submit(get_all_active_concepts) if scan_all_concepts else None
+    resolved_roots = find_descendants_for_roots(include_roots + ([] if scoped_excludes else exclude_roots))
+    
+    if all_concepts_future is not None:
+        all_concept_ids = all_concepts_future.result()
+        logger.info("Retrieved %d active concepts from entire code system", len(all_concept_ids))
+    
+    # Every included and excluded part is kept apart and combined in one go at the end
+    include_parts = [all_concept_ids]
+    for value in dict.fromkeys(include_roots):
+        descendants = resolved_roots[value]
+        if descendants is None:
+            logger.warning("Root concept %s not found", value)
+            continue
+        
+        include_parts.append(descendants)
+        include_parts.append((sctid(value),))  # Include the concept itself
+        logger.info("Found %d descendants for %s", len(descendants), value)
+    
+    included = union_concept_ids(include_parts)
+    logger.info("Total concept IDs before exclusions: %d", len(included))
+    
+    exclude_parts = [exclude_concept_ids]
+    if scoped_excludes:
+        exclude_parts.append([sctid(value) for value in exclude_roots])
+        exclude_parts.append(find_descendants_in_scope(included, exclude_roots))
+    else:
+        for value in dict.fromkeys(exclude_roots):
+            descendants = resolved_roots[value]
+            if descendants is not None:
+                exclude_parts.append(descendants)
+                exclude_parts.append((sctid(value),))
+    
+    # Remove excluded concepts
+    concept_ids = difference_concept_ids(included, union_concept_ids(exclude_parts))
+    
+    logger.info("Concept IDs after exclusions: %d", len(concept_ids))
+    
+    # Failed descendant walks are never memoized, and a failed scan comes back empty
+    _, unresolved = memo_lookup(_descendant_cache, list(resolved_roots))
+    complete = not unresolved and not (scan_all_concepts and not all_concept_ids)
+    return compact_concept_ids(concept_ids), complete
+
+def union_concept_ids(parts):
+    """
+    Union of several id collections. With NumPy and numeric ids it is one
+    sorted unique int64 array, built from the concatenated parts instead of
+    hashing every id into a Python set; otherwise a set.
+    """
+    if np is not None:
+        try:
+            arrays = [np.fromiter(part, dtype=np.int64, count=len(part)) for part in parts]
+            return np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int64)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return set().union(*parts)
+
+def difference_concept_ids(included, excluded):
+    """included minus excluded, both as returned by union_concept_ids"""
+    if np is not None and isinstance(included, np.ndarray) and isinstance(excluded, np.ndarray):
+        return included[np.isin(included, excluded, assume_unique=True, invert=True)]
+    if np is not None and isinstance(included, np.ndarray):
+        included = included.tolist()
+    if np is not None and isinstance(excluded, np.ndarray):
+        excluded = excluded.tolist()
+    return set(included).difference(excluded)
+
+def compact_concept_ids(concept_ids):
+    """
+    A resolved concept set in its most compact form: a sorted int64 NumPy
+    array, 8 bytes an id against several times that for a set of ints, which
+    page_of_sorted_concept_ids slices without sorting. A frozenset without
+    NumPy or when the set holds non-numeric codes.
+    """
+    if np is not None:
+        if isinstance(concept_ids, np.ndarray):
+            return concept_ids
+        try:
+            return np.unique(np.fromiter(concept_ids, dtype=np.int64, count=len(concept_ids)))
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return frozenset(concept_ids)
+
+def memo_lookup(memo, concept_ids):
+    """Split concept_ids into ({id: value} found in an LRU memo for this index version, missing ids)"""
+    index_version = settings.TERMINOLOGY_INDEX_VERSION
+    found = {}
+    missing = []
+    with _memo_lock:
+        for concept_id in concept_ids:
+            key = (concept_id, index_version)
+            if key in memo:
+                memo.move_to_end(key)
+                found[concept_id] = memo[key]
+            else:
+                missing.append(concept_id)
+    return found, missing
+
+def memo_store(memo, values, max_size):
+    """Record {id: value} in an LRU memo for this index version, evicting the oldest entries"""
+    index_version = settings.TERMINOLOGY_INDEX_VERSION
+    with _memo_lock:
+        for concept_id, value in values.items():
+            memo[(concept_id, index_version)] = value
+            memo.move_to_end((concept_id, index_version))
+        while len(memo) > max_size:
+            memo.popitem(last=False)
+
+def existing_concepts(concept_ids):
+    """
+    Ids from concept_ids present in the concepts index. Answers are memoized
+    per index version, the rest are checked with a single mget.
+    """
+    if not concept_ids:
+        return set()
+    
+    known, missing = memo_lookup(_existence_cache, concept_ids)
+    if missing:
+        resp = es.mget(index="concepts", body={"ids": missing}, _source=False)
+        checked = {doc["_id"]: doc.get("found", False) for doc in resp["docs"]}
+        memo_store(_existence_cache, checked, EXISTENCE_CACHE_SIZE)
+        known.update(checked)
+    return {concept_id for concept_id, exists in known.items() if exists}
 
 def find_descendants(concept_id):
+    """Descendants of a single concept, see find_descendants_many"""
+    return find_descendants_many([concept_id]).get(concept_id, frozenset())
+
+def find_descendants_many(concept_ids):
+    """
+    Descendants of several concepts, memoized per index version so repeated
+    expansions of the same root skip the hierarchy walk. With
+    DESCENDANT_SHARED_CACHE the sets are also kept in the 'descendants' cache,
+    shared across processes once that points at Redis or memcached, and with
+    DESCENDANT_CACHE_DIR large sets survive restarts
+    on disk. Roots cached nowhere are resolved together, one msearch per round
+    trip for all of them.
+    A failed walk is logged, left out of the cache and returned empty.
+    """
+    results, missing = memo_lookup(_descendant_cache, concept_ids)
+    if not missing:
+        return results
+    
+    if settings.DESCENDANT_SHARED_CACHE:
+        shared = caches['descendants'].get_many([descendant_cache_key(concept_id) for concept_id in missing])
+        from_shared = {
+            concept_id: frozenset(array('q', shared[descendant_cache_key(concept_id)]))
+            for concept_id in missing
+            if descendant_cache_key(concept_id) in shared
+        }
+        memo_store(_descendant_cache, from_shared, DESCENDANT_CACHE_SIZE)
+        results.update(from_shared)
+        missing = [concept_id for concept_id in missing if concept_id not in from_shared]
+        if not missing:
+            return results
+    
+    if settings.DESCENDANT_CACHE_DIR:
+        from_disk = load_descendants_from_disk(missing)
+        memo_store(_descendant_cache, from_disk, DESCENDANT_CACHE_SIZE)
+        results.update(from_disk)
+        missing = [concept_id for concept_id in missing if concept_id not in from_disk]
+        if not missing:
+            return results
+    
+    try:
+        if index_has_field("concepts", "ancestors"):
+            fetched = find_descendants_by_ancestors(missing)
+        else:
+            fetched = walk_descendants(missing)
+    except Exception as e:
+        logger.error("Error finding descendants for %s: %s", missing, e, exc_info=True)
+        fetched = {}
+    
+    memo_store(_descendant_cache, fetched, DESCENDANT_CACHE_SIZE)
+    if settings.DESCENDANT_SHARED_CACHE and fetched:
+        # Packed as int64 bytes like the disk cache, a hit decodes without unpickling a list;
+        # the index version is in the key, so entries never need to expire
+        caches['descendants'].set_many(
+            {
+                descendant_cache_key(concept_id): array('q', sorted(descendants)).tobytes()
+                for concept_id, descendants in fetched.items()
+            },
+            timeout=None
+        )
+    if settings.DESCENDANT_CACHE_DIR and fetched:
+        save_descendants_to_disk(fetched)
+    
+    for concept_id in missing:
+        results[concept_id] = fetched.get(concept_id, frozenset())
+    return results
+
+def descendant_cache_key(concept_id):
+    """Django cache key of a root's descendant set for the current index version"""
+    return f"snomed:desc-int:{settings.TERMINOLOGY_INDEX_VERSION}:{concept_id}"
+
+def descendant_cache_path(concept_id):
+    """
+    File of a root's descendant set under DESCENDANT_CACHE_DIR. Files live in
+    a directory per index version, so a new release never reads stale sets.
+    None for anything but a numeric SCTID, which keeps request input out of paths.
     """
-    Optimized descendant finding using composite aggregation approach
-    Similar to File 1's get_all_concepts_in_valueset but for relationships
+    if not str(concept_id).isdigit():
+        return None
+    return os.path.join(settings.DESCENDANT_CACHE_DIR, settings.TERMINOLOGY_INDEX_VERSION, f"{concept_id}.i64")
+
+def load_descendants_from_disk(concept_ids):
+    """Descendant sets of the roots that have a file, read as packed int64 arrays"""
+    loaded = {}
+    for concept_id in concept_ids:
+        path = descendant_cache_path(concept_id)
+        if path is None:
+            continue
+        try:
+            with open(path, 'rb') as f:
+                loaded[concept_id] = frozenset(array('q', f.read()))
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read descendant cache file %s: %s", path, e, exc_info=True)
+    return loaded
+
+def save_descendants_to_disk(descendant_sets):
+    """
+    Write the large descendant sets as packed int64 arrays. Each file is
+    written next to its final path and renamed into place, so concurrent
+    workers never read a partial file.
+    """
+    for concept_id, descendants in descendant_sets.items():
+        path = descendant_cache_path(concept_id)
+        if path is None or len(descendants) < DISK_CACHE_MIN_DESCENDANTS:
+            continue
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(array('q', sorted(descendants)).tobytes())
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, OverflowError) as e:
+            logger.warning("Could not write descendant cache file %s: %s", path, e, exc_info=True)
+
+def find_descendants_by_ancestors(concept_ids):
+    """
+    Descendants are the concepts whose ancestors field contains the root.
+    The first page of every root's subtree comes back from one msearch,
+    larger subtrees continue with search_after, and the largest are read
+    whole by sliced cursors over a point in time, one consistent view
+    fetched in parallel.
+    """
+    searches = []
+    for concept_id in concept_ids:
+        searches.append({"index": "concepts"})
+        searches.append({
+            "query": {"term": {"ancestors": concept_id}},
+            "_source": False,
+            "size": DESCENDANT_PAGE_SIZE,
+            "sort": [{"_doc": "asc"}],
+            # The subtree size picks how the rest of it is read
+            "track_total_hits": True
+        })
+    
+    responses = es.msearch(body=searches)["responses"]
+    
+    results = {}
+    for concept_id, resp in zip(concept_ids, responses):
+        if "error" in resp:
+            raise Exception(resp["error"])
+        
+        hits = resp["hits"]["hits"]
+        descendants = {int(hit["_id"]) for hit in hits}
+        if resp["hits"]["total"]["value"] >= SLICED_DESCENDANTS_MIN:
+            # The first page is read again by its slice, a small price next to the whole subtree
+            descendants.update(int(hit["_id"]) for hit in iter_hits_sliced(
+                "concepts", {"term": {"ancestors": concept_id}}, source=False,
+                slices=DESCENDANT_SLICES, page_size=MAX_RESULT_WINDOW
+            ))
+        elif len(hits) == DESCENDANT_PAGE_SIZE:
+            descendants.update(int(hit["_id"]) for hit in iter_hits(
+                "concepts", {"term": {"ancestors": concept_id}}, source=False,
+                page_size=DESCENDANT_PAGE_SIZE, prefetch=True, search_after=hits[-1]["sort"]
+            ))
+        
+        logger.info("Total descendants for %s: %d", concept_id, len(descendants))
+        results[concept_id] = frozenset(descendants)
+    return results
+
+def walk_descendants(concept_ids):
     """
-    all_descendants = set()
-    current_level = {concept_id}
+    Breadth-first walk over IS-A relationships for several roots at once.
+    Each depth level is one msearch with a composite aggregation per root frontier.
+    """
+    all_descendants = {concept_id: set() for concept_id in concept_ids}
+    frontiers = {concept_id: {sctid(concept_id)} for concept_id in concept_ids}
     depth = 0
     max_depth = 10  # Prevent infinite loops
-
-    try:
-        while current_level and depth < max_depth:
-            # Use composite aggregation for efficient pagination
-            next_level = get_children_composite(list(current_level))
+    
+    while frontiers and depth < max_depth:
+        roots = list(frontiers)
+        searches = []
+        for root_id in roots:
+            searches.append({"index": "relationships"})
+            searches.append(children_composite_query([str(parent_id) for parent_id in frontiers[root_id]]))
+        
+        responses = es.msearch(body=searches)["responses"]
+        
+        next_frontiers = {}
+        for root_id, resp in zip(roots, responses):
+            if "error" in resp:
+                raise Exception(resp["error"])
             
-            # Filter out already processed concepts
-            new_descendants = next_level - all_descendants - {concept_id}
+            children_agg = resp.get("aggregations", {}).get("unique_children", {})
+            buckets = children_agg.get("buckets", [])
+            children = {int(bucket["key"]["source_id"]) for bucket in buckets}
             
-            if not new_descendants:
-                break
-                
-            all_descendants.update(new_descendants)
-            current_level = new_descendants
-            depth += 1
+            # Frontiers with more children than one composite page continue on their own
+            if len(buckets) == DESCENDANT_PAGE_SIZE and children_agg.get("after_key"):
+                children |= get_children_composite(
+                    [str(parent_id) for parent_id in frontiers[root_id]], children_agg["after_key"]
+                )
             
-            logger.info(f"Depth {depth}: Found {len(new_descendants)} new descendants")
-
-        logger.info(f"Total descendants for {concept_id}: {len(all_descendants)}")
-        return all_descendants
-
-    except Exception as e:
-        logger.error(f"Error finding descendants for {concept_id}: {str(e)}", exc_info=True)
-        return all_descendants
+            new_descendants = children - all_descendants[root_id] - {sctid(root_id)}
+            if new_descendants:
+                all_descendants[root_id].update(new_descendants)
+                next_frontiers[root_id] = new_descendants
+        
+        frontiers = next_frontiers
+        depth += 1
+        logger.info("Depth %d: expanding %d roots", depth, len(frontiers))
+    
+    for root_id, descendants in all_descendants.items():
+        logger.info("Total descendants for %s: %d", root_id, len(descendants))
+    return {root_id: frozenset(descendants) for root_id, descendants in all_descendants.items()}
 
-def get_children_composite(parent_concept_ids):
+def find_descendants_for_roots(root_ids):
     """
-    Get direct children using composite aggregation for efficiency
+    Check and expand several is-a roots together.
+    Returns {root_id: descendants}, with None for roots that do not exist.
     """
-    children = set()
-    after_key = None
+    root_ids = list(dict.fromkeys(root_ids))
+    if not root_ids:
+        return {}
     
-    while True:
+    # The mget validating the roots runs alongside the descendant searches rather than
+    # before them; a missing root simply has no descendants. It is a leaf call on the
+    # shared pool, and the request thread waiting on it is not a pool worker
+    found_future = search_executor.submit(existing_concepts, root_ids)
+    descendants = find_descendants_many(root_ids)
+    found = found_future.result()
+    
+    return {root_id: descendants[root_id] if root_id in found else None for root_id in root_ids}
+
+def find_descendants_in_scope(concept_ids, root_ids):
+    """
+    The concepts among concept_ids that descend from any of the roots, read
+    from the ancestors field of just those concepts. Cheaper than resolving
+    each root's subtree when the roots are large and the scope is small; a
+    root with nothing in scope costs a single empty page.
+    """
+    concept_ids = [str(concept_id) for concept_id in concept_ids]
+    in_scope = set()
+    for start in range(0, len(concept_ids), MAX_TERMS_PER_QUERY):
         query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"destination_id": parent_concept_ids}},
-                        {"term": {"type_id": "116680003"}},  # IS-A relationship
-                        {"term": {"active": True}}
-                    ]
-                }
-            },
-            "size": 0,
-            "aggs": {
-                "unique_children": {
-                    "composite": {
-                        "size": 10000,
-                        "sources": [
-                            {
-                                "source_id": {
-                                    "terms": {
-                                        "field": "source_id.keyword",
-                                        "order": "asc"
-                                    }
+            "bool": {
+                "filter": [
+                    concept_ids_clause(concept_ids[start:start + MAX_TERMS_PER_QUERY]),
+                    {"terms": {"ancestors": list(root_ids)}}
+                ]
+            }
+        }
+        in_scope.update(
+            sctid(hit["_id"]) for hit in iter_hits("concepts", query, source=False, page_size=MAX_RESULT_WINDOW)
+        )
+    return in_scope
+
+def children_composite_query(parent_concept_ids, after_key=None):
+    """Composite aggregation over the distinct IS-A children of the given parents"""
+    query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"destination_id": parent_concept_ids}},
+                    {"term": {"type_id": "116680003"}},  # IS-A relationship
+                    {"term": {"active": True}}
+                ]
+            }
+        },
+        "size": 0,
+        "track_total_hits": False,
+        "aggs": {
+            "unique_children": {
+                "composite": {
+                    "size": DESCENDANT_PAGE_SIZE,
+                    "sources": [
+                        {
+                            "source_id": {
+                                "terms": {
+                                    "field": "source_id.keyword",
+                                    "order": "asc"
                                 }
                             }
-                        ]
-                    }
+                        }
+                    ]
                 }
             }
         }
-        
-        if after_key:
-            query["aggs"]["unique_children"]["composite"]["after"] = after_key
-        
+    }
+    
+    if after_key:
+        query["aggs"]["unique_children"]["composite"]["after"] = after_key
+    return query
+
+def get_children_composite(parent_concept_ids, after_key=None):
+    """
+    Get direct children using composite aggregation for efficiency
+    """
+    children = set()
+    
+    while True:
         resp = es.search(
             index="relationships",
-            body=query,
+            body=children_composite_query(parent_concept_ids, after_key),
             timeout='30s'
         )
         
@@ -295,7 +831,7 @@ def get_children_composite(parent_concept_ids):
         if not buckets:
             break
             
-        batch_children = {bucket["key"]["source_id"] for bucket in buckets}
+        batch_children = {int(bucket["key"]["source_id"]) for bucket in buckets}
         children.update(batch_children)
         
         after_key = resp.get("aggregations", {}).get("unique_children", {}).get("after_key")
@@ -306,510 +842,975 @@ def get_children_composite(parent_concept_ids):
 
 def get_all_active_concepts():
     """
-    Get all active concept IDs from the concepts index using composite aggregation
+    Get all active concept IDs from the concepts index, streamed in _doc order
     """
-    all_concept_ids = set()
-    after_key = None
-    
     try:
-        while True:
-            query = {
-                "query": {
-                    "term": {"active": True}
-                },
-                "size": 0,
-                "aggs": {
-                    "unique_concepts": {
-                        "composite": {
-                            "size": 10000,
-                            "sources": [
-                                {
-                                    "concept_id": {
-                                        "terms": {
-                                            "field": "_id",
-                                            "order": "asc"
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    }
-                }
-            }
-            
-            if after_key:
-                query["aggs"]["unique_concepts"]["composite"]["after"] = after_key
-            
-            resp = es.search(
-                index="concepts",
-                body=query,
-                timeout='30s'
+        all_concept_ids = {
+            int(hit["_id"]) for hit in iter_hits(
+                "concepts", {"term": {"active": True}}, source=False, page_size=MAX_RESULT_WINDOW, prefetch=True
             )
-            
-            buckets = resp.get("aggregations", {}).get("unique_concepts", {}).get("buckets", [])
-            
-            if not buckets:
-                break
-                
-            batch_concepts = {bucket["key"]["concept_id"] for bucket in buckets}
-            all_concept_ids.update(batch_concepts)
-            
-            after_key = resp.get("aggregations", {}).get("unique_concepts", {}).get("after_key")
-            if not after_key:
-                break
-                
-        logger.info(f"Retrieved {len(all_concept_ids)} active concepts")
+        }
+        logger.info("Retrieved %d active concepts", len(all_concept_ids))
         return all_concept_ids
         
     except Exception as e:
-        logger.error(f"Error getting all active concepts: {str(e)}")
+        logger.error("Error getting all active concepts: %s", e, exc_info=True)
         return set()
 
-def get_entire_codesystem_filtered_expansion(filter_text, display_language, include_designations, count, offset):
+def get_entire_codesystem_filtered_expansion(filter_text, display_language, include_designations, count, offset, request_cache=None):
     """
     Handle filtered expansion across the entire SNOMED CT code system without pre-filtering by concept IDs
     """
-    try:
-        # Normalize search text
-        normalized_filter = normalize_search_text(filter_text)
-        
-        # Build query for entire code system with text filtering
-        query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}}
-                    ],
-                    "should": [
-                        # Exact phrase (highest priority)
-                        {"match_phrase": {"term": {"query": normalized_filter, "boost": 10}}},
-                        # Prefix match
-                        {"prefix": {"term": {"value": normalized_filter, "boost": 5}}},
-                    ],
-                    "minimum_should_match": 1
-                }
-            },
-            "_source": ["concept_id", "type_id", "term", "language_code"],
-            "size": 10000,  # Get matching descriptions
-            "sort": [
-                {"_score": {"order": "desc"}},
-                {"term.keyword": {"order": "asc"}}
-            ]
-        }
-        
-        # Execute search
-        resp = es.search(
-            index="descriptions",
-            body=query,
-            timeout='30s'
-        )
-        
-        return process_filtered_results(resp, normalized_filter, display_language, include_designations, count, offset)
-        
-    except Exception as e:
-        logger.error(f"Error getting entire code system filtered expansion: {str(e)}")
-        return [], 0
+    # Normalize search text, the analyzed term subfields fold in ES instead
+    normalized_filter = filter_text if analyzed_term_fields() else normalize_search_text(filter_text)
+    
+    # Build query for entire code system with text filtering
+    query = {
+        "query": build_filter_query([
+            {"term": {"active": True}},
+            {"term": {"language_code": display_language}}
+        ], normalized_filter),
+        "_source": False,
+        "docvalue_fields": SCORED_DESCRIPTION_FIELDS,
+        "size": 10000,  # Get matching descriptions
+        "aggs": MATCHING_CONCEPTS_AGGS,
+        # Nothing reads hits.total, the count comes from the scored hits or the agg
+        "track_total_hits": False,
+        "sort": [
+            {"_score": {"order": "desc"}},
+            {"term.keyword": {"order": "asc"}}
+        ]
+    }
+    
+    collapse_to_top_concepts(query, count, offset)
+    
+    # Execute search
+    resp = es.search(
+        index="descriptions",
+        body=query,
+        timeout='30s'
+    )
+    
+    return process_filtered_results(
+        resp, query, normalized_filter, display_language, include_designations, count, offset, request_cache
+    )
 
-def get_expansion(concept_ids, display_language, include_designations, count, offset):
+def collapse_to_top_concepts(query, count, offset):
     """
-    Get expansion without text filtering - optimized like File 1
+    When ES scores the filter itself, collapse a filter search on concept_id
+    so the top offset + count concepts come back with their best description
+    each, rather than a full window of descriptions folded per concept here.
+    Pages past the result window keep the uncollapsed search.
     """
-    try:
-        total_count = len(concept_ids)
-        print(f"Found {total_count} unique concepts")
-        
-        # Convert to sorted list for consistent pagination
-        concept_ids_list = sorted(list(concept_ids))
-        
-        # Apply pagination
-        paginated_concept_ids = concept_ids_list[offset:offset + count]
-        
-        # Get detailed descriptions for paginated concepts
-        expansion_contains = get_concepts_details_for_expansion(
-            paginated_concept_ids, display_language, include_designations
-        )
-        
-        return expansion_contains, total_count
-        
-    except Exception as e:
-        logger.error(f"Error getting expansion: {str(e)}")
-        return [], 0
+    if analyzed_term_fields() and offset + count <= MAX_RESULT_WINDOW:
+        query["collapse"] = {"field": "concept_id.keyword"}
+        query["size"] = offset + count
+    return query
 
-def chunk_list(lst, chunk_size):
-    """Split a list into chunks of specified size"""
-    for i in range(0, len(lst), chunk_size):
-        yield lst[i:i + chunk_size]
+def analyzed_term_fields():
+    """Whether descriptions were indexed with the folded/prefix/exact term subfields"""
+    return index_has_field("descriptions", "term.folded")
 
-def get_filtered_expansion(concept_ids, filter_text, display_language, include_designations, count, offset):
+def starts_with_field():
     """
-    Get expansion with text filtering - optimized with batch processing for large concept sets
+    Field for the whole-term starts-with clause. term.starts indexes every
+    leading prefix, so the clause is a single term lookup instead of a scan
+    over the keyword terms dictionary.
     """
-    try:
-        # Normalize search text
-        normalized_filter = normalize_search_text(filter_text)
-        concept_ids_list = list(concept_ids)
-        
-        print(f"Processing {len(concept_ids_list)} concepts with filter '{filter_text}'")
-        
-        # If concept set is small enough, use original approach
-        if len(concept_ids_list) <= MAX_TERMS_PER_QUERY:
-            return get_filtered_expansion_single_query(
-                concept_ids_list, normalized_filter, display_language, include_designations, count, offset
-            )
-        
-        # For large concept sets, use batch processing approach
-        return get_filtered_expansion_batched(
-            concept_ids_list, normalized_filter, display_language, include_designations, count, offset
-        )
-        
-    except Exception as e:
-        logger.error(f"Error getting filtered expansion: {str(e)}")
-        return [], 0
+    return "term.starts" if index_has_field("descriptions", "term.starts") else "term.exact"
 
-def get_filtered_expansion_single_query(concept_ids_list, normalized_filter, display_language, include_designations, count, offset):
+def build_filter_query(filters, filter_text):
     """
-    Handle filtered expansion with a single query for smaller concept sets
+    Bool query for a text filter over descriptions. The static clauses in
+    filters run in filter context, unscored and cacheable. With the analyzed term
+    subfields ES does the case/diacritic folding and applies the exact,
+    starts-with, whole-word and synonym/FSN bonuses as boosts; older indices get
+    the phrase/prefix clauses and are re-scored in Python.
     """
-    # Build query with text filtering
-    query = {
-        "query": {
+    if not analyzed_term_fields():
+        return {
             "bool": {
-                "must": [
-                    {"terms": {"concept_id": concept_ids_list}},
-                    {"term": {"active": True}},
-                    {"term": {"language_code": display_language}}
-                ],
+                "filter": filters,
                 "should": [
                     # Exact phrase (highest priority)
-                    {"match_phrase": {"term": {"query": normalized_filter, "boost": 10}}},
+                    {"match_phrase": {"term": {"query": filter_text, "boost": 10}}},
                     # Prefix match
-                    {"prefix": {"term": {"value": normalized_filter, "boost": 5}}},
+                    {"prefix": {"term": {"value": filter_text, "boost": 5}}},
                 ],
                 "minimum_should_match": 1
             }
-        },
-        "_source": ["concept_id", "type_id", "term", "language_code"],
-        "size": 10000,  # Get all matching descriptions
-        "sort": [
-            {"_score": {"order": "desc"}},
-            {"term.keyword": {"order": "asc"}}
-        ]
-    }
+        }
     
-    # Execute search
-    resp = es.search(
-        index="descriptions",
-        body=query,
+    return {
+        "bool": {
+            "filter": filters,
+            "must": [{
+                "bool": {
+                    "should": [
+                        # Whole term equal / starting with the filter
+                        {"constant_score": {"filter": {"term": {"term.exact": filter_text}}, "boost": 50}},
+                        {"constant_score": {"filter": {"prefix": {starts_with_field(): filter_text}}, "boost": 30}},
+                        # Every filter word is a prefix of some term word, whole-word hits score higher
+                        {"multi_match": {
+                            "query": filter_text,
+                            "type": "most_fields",
+                            "fields": ["term.folded^4", "term.prefix"],
+                            "operator": "and",
+                            "boost": 5
+                        }}
+                    ],
+                    "minimum_should_match": 1
+                }
+            }],
+            "should": [
+                # Prefer synonyms over FSNs
+                {"constant_score": {"filter": {"term": {"type_id": "900000000000013009"}}, "boost": 10}},
+                {"constant_score": {"filter": {"term": {"type_id": "900000000000003001"}}, "boost": 5}}
+            ]
+        }
+    }
+
+def get_expansion(concept_ids, display_language, include_designations, count, offset, request_cache=None):
+    """
+    Get expansion without text filtering - optimized like File 1
+    """
+    total_count = len(concept_ids)
+    logger.debug("Found %d unique concepts", total_count)
+    
+    # Only the requested page is ordered, not the whole set
+    paginated_concept_ids = page_of_sorted_concept_ids(concept_ids, count, offset)
+    
+    # Get detailed descriptions for paginated concepts
+    expansion_contains = get_concepts_details_for_expansion(
+        paginated_concept_ids, display_language, include_designations, request_cache
+    )
+    
+    return expansion_contains, total_count
+
+def compose_concepts_query(includes, excludes, concept_field=None):
+    """
+    Concepts index query selecting the members of a compose built only from
+    SNOMED is-a filters, whole-code-system includes and excludes, else None.
+    With concept_field the query runs on another index carrying the concept id
+    in that field and the concept's ancestors. Explicit include codes are only
+    taken there: a description search never matches a code missing from the
+    index anyway, while paging concepts would drop it.
+    """
+    should = []
+    for include in includes:
+        if include.get('system') != 'http://snomed.info/sct':
+            return None
+        
+        codes = [code_entry['code'] for code_entry in include.get('concept', [])]
+        if codes:
+            if concept_field is None:
+                return None
+            should.append(concept_ids_clause(codes, concept_field))
+        
+        filters = include.get('filter', [])
+        if not filters:
+            if not codes:
+                should.append({"term": {"active": True}})  # Entire code system
+            continue
+        
+        for filter_def in filters:
+            if filter_def.get('property') != 'concept' or filter_def.get('op') != 'is-a':
+                return None
+            value = filter_def.get('value')
+            should.append(concept_ids_clause([value], concept_field))
+            should.append({"term": {"ancestors": value}})
+    
+    excluded_ids = []
+    excluded_roots = []
+    for exclude in excludes:
+        if exclude.get('system') != 'http://snomed.info/sct':
+            continue
+        excluded_ids.extend(code_entry['code'] for code_entry in exclude.get('concept', []))
+        for filter_def in exclude.get('filter', []):
+            if filter_def.get('property') == 'concept' and filter_def.get('op') == 'is-a':
+                excluded_ids.append(filter_def.get('value'))
+                excluded_roots.append(filter_def.get('value'))
+    
+    query = {"bool": {"should": should, "minimum_should_match": 1}}
+    must_not = []
+    if excluded_ids:
+        must_not.append(concept_ids_clause(excluded_ids, concept_field))
+    if excluded_roots:
+        must_not.append({"terms": {"ancestors": excluded_roots}})
+    if must_not:
+        query["bool"]["must_not"] = must_not
+    return query
+
+def concept_ids_clause(concept_ids, concept_field=None):
+    """Clause matching the given concepts, by _id on the concepts index or by concept_field elsewhere"""
+    if concept_field is None:
+        return {"ids": {"values": concept_ids}}
+    return {"terms": {concept_field: concept_ids}}
+
+def concept_terms_clause(concept_ids, field, stage_key=None):
+    """
+    Terms clause for concept_ids on field. Long lists with a stage_key are
+    indexed once into SCRATCH_INDEX and referenced with a terms lookup, so
+    repeated filters over the same concept set stop sending every id inline.
+    The lookup reads the doc with a realtime get, no refresh is needed.
+    """
+    if stage_key is None or len(concept_ids) < STAGE_MIN_IDS:
+        return grouped_terms_clause(field, concept_ids)
+    
+    doc_id = f"{settings.TERMINOLOGY_INDEX_VERSION}:{stage_key}"
+    try:
+        stage_concept_ids(doc_id, concept_ids)
+    except Exception as e:
+        logger.warning("Could not stage concept ids as %s, sending them inline: %s", doc_id, e, exc_info=True)
+        return grouped_terms_clause(field, concept_ids)
+    return {"terms": {field: {"index": SCRATCH_INDEX, "id": doc_id, "path": "ids"}}}
+
+def grouped_terms_clause(field, values):
+    """
+    Terms clause on field. Past TERMS_GROUP_SIZE values it becomes OR'd terms
+    queries of that many values each, as Lucene unions several small term
+    sets faster than it builds one very large one.
+    """
+    group_size = settings.TERMS_GROUP_SIZE
+    if group_size <= 0 or len(values) <= group_size:
+        return {"terms": {field: values}}
+    return {
+        "bool": {
+            "should": [{"terms": {field: group}} for group in chunk_list(values, group_size)],
+            "minimum_should_match": 1
+        }
+    }
+
+def stage_concept_ids(doc_id, concept_ids):
+    """
+    Index an id list as doc_id in SCRATCH_INDEX. Doc ids carry the index
+    version and the concept set digest, so a staged list never changes; a
+    process restages it once half of STAGED_DOC_TTL has passed, which keeps
+    it clear of sweep_scratch_index.
+    """
+    now = time.time()
+    staged, _ = memo_lookup(_staged_ids, [doc_id])
+    if doc_id in staged and now - staged[doc_id] < STAGED_DOC_TTL / 2:
+        return
+    
+    ensure_scratch_index()
+    es.index(index=SCRATCH_INDEX, id=doc_id, document={
+        "ids": concept_ids,
+        "index_version": settings.TERMINOLOGY_INDEX_VERSION,
+        "staged_at": int(now)
+    })
+    memo_store(_staged_ids, {doc_id: now}, STAGED_IDS_SIZE)
+    sweep_scratch_index(now)
+
+def ensure_scratch_index():
+    """
+    Create SCRATCH_INDEX, with only the fields sweep_scratch_index filters on
+    mapped. A scratch index from before they existed cannot be swept and is
+    recreated; its lists are staged again on their next use.
+    """
+    if es.indices.exists(index=SCRATCH_INDEX):
+        if index_has_field(SCRATCH_INDEX, "staged_at"):
+            return
+        es.indices.delete(index=SCRATCH_INDEX, ignore_unavailable=True)
+        forget_index(SCRATCH_INDEX)
+        with _memo_lock:
+            _staged_ids.clear()
+    # The id lists are only ever read back from _source, nothing else is indexed
+    es.indices.create(index=SCRATCH_INDEX, mappings={
+        "dynamic": False,
+        "properties": {
+            "index_version": {"type": "keyword"},
+            "staged_at": {"type": "date", "format": "epoch_second"}
+        }
+    }, ignore=[400])
+
+def sweep_scratch_index(now):
+    """
+    Delete staged lists of other index versions and those not restaged within
+    STAGED_DOC_TTL, at most once per SCRATCH_SWEEP_INTERVAL per process. ES runs
+    the delete as a background task, the request does not wait for it.
+    """
+    global _last_scratch_sweep
+    with _memo_lock:
+        if now - _last_scratch_sweep < SCRATCH_SWEEP_INTERVAL:
+            return
+        _last_scratch_sweep = now
+    
+    try:
+        es.delete_by_query(
+            index=SCRATCH_INDEX,
+            query={"bool": {"should": [
+                {"range": {"staged_at": {"lt": int(now - STAGED_DOC_TTL)}}},
+                {"bool": {"must_not": {"term": {"index_version": settings.TERMINOLOGY_INDEX_VERSION}}}}
+            ]}},
+            conflicts="proceed",
+            wait_for_completion=False
+        )
+    except Exception as e:
+        # The list is staged either way, the next sweep catches up
+        logger.warning("Could not sweep %s: %s", SCRATCH_INDEX, e, exc_info=True)
+
+def can_filter_descriptions_in_es():
+    """Whether descriptions carry their concept's ancestors, see compose_concepts_query"""
+    return index_has_field("descriptions", "ancestors")
+
+def can_page_concepts_in_es():
+    """
+    Whether the concepts index supports paging a compose, see concepts_page_start.
+    concept_id has to be numeric for the sort to follow page_of_sorted_concept_ids.
+    """
+    if not index_has_field("concepts", "ancestors") or index_field_type("concepts", "concept_id") != "long":
+        return False
+    concepts_index_sorted()
+    return True
+
+@lru_cache(maxsize=None)
+def concepts_index_sorted():
+    """
+    Whether the concepts index is sorted on concept_id. Paging is still correct
+    without it, but ES can no longer stop a page early and visits every match,
+    so an index created before the sort is reported once per process.
+    """
+    if index_sort_fields("concepts") == ("concept_id",):
+        return True
+    logger.warning(
+        "The concepts index is not sorted on concept_id, rerun the SNOMED indexer to rebuild it "
+        "so $expand pages stop early"
+    )
+    return False
+
+def concepts_query_digest(concepts_query):
+    """Stable digest of a compose query, for cache keys"""
+    return hashlib.sha1(
+        json.dumps(concepts_query, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+def page_cursor_key(concepts_query, offset):
+    """Cache key of the search_after cursor where a compose's page at offset begins"""
+    return f"expand-cursor:{settings.TERMINOLOGY_INDEX_VERSION}:{concepts_query_digest(concepts_query)}:{offset}"
+
+def page_total_key(concepts_query):
+    """Cache key of the number of concepts matching a compose query"""
+    return f"expand-total:{settings.TERMINOLOGY_INDEX_VERSION}:{concepts_query_digest(concepts_query)}"
+
+def concepts_page_start(concepts_query, count, offset):
+    """
+    Where get_concepts_page starts a page: (None, offset) for from/size within
+    the result window, (search_after, 0) past it when an earlier page left a
+    cursor at this offset, None when ES cannot reach the page.
+    """
+    if offset + count <= MAX_RESULT_WINDOW:
+        return None, offset
+    cursor = caches['cursors'].get(page_cursor_key(concepts_query, offset))
+    if cursor is not None:
+        return cursor, 0
+    return None
+
+def get_concepts_page(concepts_query, page_start, display_language, include_designations, count, offset, request_cache=None):
+    """
+    Page through the concepts matching a compose query on the concepts index,
+    in the same numeric order as page_of_sorted_concept_ids. Pages start with
+    from/size or a search_after cursor as given by concepts_page_start, and
+    every page leaves the cursor for the next one, so sequential paging keeps
+    going past the result window. The total is counted by the first page
+    requested and cached; later pages skip counting, which lets ES stop
+    collecting once no remaining concept id can make the page.
+    """
+    search_after, skip = page_start
+    total_count = caches['cursors'].get(page_total_key(concepts_query))
+    query = {
+        "query": concepts_query,
+        "_source": False,
+        "sort": [{"concept_id": {"order": "asc"}}],
+        "size": count,
+        "track_total_hits": total_count is None
+    }
+    if search_after is None:
+        query["from"] = skip
+    else:
+        query["search_after"] = search_after
+    
+    resp = es.search(
+        index="concepts",
+        body=query,
         timeout='30s'
     )
     
-    return process_filtered_results(resp, normalized_filter, display_language, include_designations, count, offset)
+    hits = resp["hits"]["hits"]
+    if hits:
+        caches['cursors'].set(page_cursor_key(concepts_query, offset + len(hits)), hits[-1]["sort"], settings.EXPANSION_CACHE_TIMEOUT)
+    
+    if total_count is None:
+        total_count = resp["hits"]["total"]["value"]
+        caches['cursors'].set(page_total_key(concepts_query), total_count, settings.EXPANSION_CACHE_TIMEOUT)
+    paginated_concept_ids = [hit["_id"] for hit in hits]
+    logger.debug("Found %d concepts for the compose", total_count)
+    
+    expansion_contains = get_concepts_details_for_expansion(
+        paginated_concept_ids, display_language, include_designations, request_cache
+    )
+    
+    return expansion_contains, total_count
 
-def get_filtered_expansion_batched(concept_ids_list, normalized_filter, display_language, include_designations, count, offset):
+def page_of_sorted_concept_ids(concept_ids, count, offset):
     """
-    Handle filtered expansion with batch processing for large concept sets
+    Return concept_ids[offset:offset + count] in ascending numeric order, as
+    code strings. The sctid ints are partitioned as a NumPy array when
+    available instead of sorting the whole set.
     """
-    all_concept_descriptions = {}
+    end = offset + count
+    if end <= 0 or offset >= len(concept_ids):
+        return []
     
-    # Process in batches
-    batch_count = 0
-    total_batches = (len(concept_ids_list) + MAX_TERMS_PER_QUERY - 1) // MAX_TERMS_PER_QUERY
+    # Arrays from compact_concept_ids are sorted already
+    if np is not None and isinstance(concept_ids, np.ndarray):
+        return [str(concept_id) for concept_id in concept_ids[offset:end].tolist()]
     
-    for batch_concept_ids in chunk_list(concept_ids_list, MAX_TERMS_PER_QUERY):
-        batch_count += 1
-        print(f"Processing batch {batch_count}/{total_batches} with {len(batch_concept_ids)} concepts")
-        
-        # Build query for this batch
+    try:
+        if np is None:
+            page = heapq.nsmallest(end, concept_ids)[offset:]
+        else:
+            ids = np.fromiter(concept_ids, dtype=np.int64, count=len(concept_ids))
+            if end < len(ids):
+                ids = np.partition(ids, end - 1)[:end]
+            page = np.sort(ids)[offset:end].tolist()
+        return [str(concept_id) for concept_id in page]
+    except (TypeError, ValueError):
+        # Non-numeric codes (e.g. from explicit concept lists) keep string order
+        return sorted(map(str, concept_ids))[offset:end]
+
+def chunk_list(lst, chunk_size):
+    """Split a list into chunks of specified size"""
+    for i in range(0, len(lst), chunk_size):
+        yield lst[i:i + chunk_size]
+
+def get_filtered_expansion(concept_ids, filter_text, display_language, include_designations, count, offset, request_cache=None, stage_key=None):
+    """
+    Get expansion with text filtering - optimized with batch processing for large concept sets.
+    With a stage_key naming the concept set, long id lists are staged for terms lookups.
+    """
+    # Normalize search text, the analyzed term subfields fold in ES instead
+    normalized_filter = filter_text if analyzed_term_fields() else normalize_search_text(filter_text)
+    concept_ids_list = [str(concept_id) for concept_id in concept_ids]
+    
+    logger.debug("Processing %d concepts with filter '%s'", len(concept_ids_list), filter_text)
+    
+    # If concept set is small enough, use original approach
+    if len(concept_ids_list) <= MAX_TERMS_PER_QUERY:
+        return get_filtered_expansion_single_query(
+            concept_terms_clause(concept_ids_list, "concept_id", stage_key),
+            normalized_filter, display_language, include_designations, count, offset, request_cache
+        )
+    
+    # For large concept sets, use batch processing approach
+    return get_filtered_expansion_batched(
+        concept_ids_list, normalized_filter, display_language, include_designations, count, offset, request_cache,
+        stage_key=stage_key
+    )
+
+def get_filtered_expansion_for_query(concepts_query, filter_text, display_language, include_designations, count, offset, request_cache=None):
+    """
+    Get expansion with text filtering for a compose selected by a descriptions
+    query, a single search however many concepts the compose holds
+    """
+    normalized_filter = filter_text if analyzed_term_fields() else normalize_search_text(filter_text)
+    return get_filtered_expansion_single_query(
+        concepts_query, normalized_filter, display_language, include_designations, count, offset, request_cache
+    )
+
+def get_filtered_expansion_single_query(concepts_filter, normalized_filter, display_language, include_designations, count, offset, request_cache=None):
+    """
+    Handle filtered expansion with a single query for smaller concept sets,
+    concepts_filter being the descriptions clause selecting the candidates
+    """
+    # Build query with text filtering
+    query = {
+        "query": build_filter_query([
+            concepts_filter,
+            {"term": {"active": True}},
+            {"term": {"language_code": display_language}}
+        ], normalized_filter),
+        "_source": False,
+        "docvalue_fields": SCORED_DESCRIPTION_FIELDS,
+        "size": 10000,  # Get all matching descriptions
+        "aggs": MATCHING_CONCEPTS_AGGS,
+        # Nothing reads hits.total, the count comes from the scored hits or the agg
+        "track_total_hits": False,
+        "sort": [
+            {"_score": {"order": "desc"}},
+            {"term.keyword": {"order": "asc"}}
+        ]
+    }
+    
+    collapse_to_top_concepts(query, count, offset)
+    
+    # Execute search
+    resp = es.search(
+        index="descriptions",
+        body=query,
+        timeout='30s'
+    )
+    
+    return process_filtered_results(
+        resp, query, normalized_filter, display_language, include_designations, count, offset, request_cache
+    )
+
+def get_filtered_expansion_batched(concept_ids_list, normalized_filter, display_language, include_designations, count, offset, request_cache=None, stage_key=None):
+    """
+    Handle filtered expansion with batch processing for large concept sets,
+    each batch staged under its own key when a stage_key is given
+    """
+    best_scores = {}
+    matching_count = 0
+    
+    # Build one query per batch of concept ids
+    searches = []
+    for batch_number, batch_concept_ids in enumerate(chunk_list(concept_ids_list, MAX_TERMS_PER_QUERY)):
+        batch_stage_key = f"{stage_key}:{batch_number}" if stage_key is not None else None
         query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"concept_id": batch_concept_ids}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}}
-                    ],
-                    "should": [
-                        # Exact phrase (highest priority)
-                        {"match_phrase": {"term": {"query": normalized_filter, "boost": 10}}},
-                        # Prefix match
-                        {"prefix": {"term": {"value": normalized_filter, "boost": 5}}},
-                    ],
-                    "minimum_should_match": 1
-                }
-            },
-            "_source": ["concept_id", "type_id", "term", "language_code"],
+            "query": build_filter_query([
+                concept_terms_clause(batch_concept_ids, "concept_id", batch_stage_key),
+                {"term": {"active": True}},
+                {"term": {"language_code": display_language}}
+            ], normalized_filter),
+            "_source": False,
+            "docvalue_fields": SCORED_DESCRIPTION_FIELDS,
             "size": 10000,  # Get all matching descriptions
+            "aggs": MATCHING_CONCEPTS_AGGS,
+            # Nothing reads hits.total, the count comes from the scored hits or the agg
+            "track_total_hits": False,
             "sort": [
                 {"_score": {"order": "desc"}},
                 {"term.keyword": {"order": "asc"}}
-            ]
+            ],
+            "timeout": "30s"
         }
+        # Each batch's top concepts are enough, the overall top ones are among them
+        searches.append(collapse_to_top_concepts(query, count, offset))
+    
+    total_batches = len(searches)
+    batch_count = 0
+    
+    # Send the batches as msearch windows so ES runs them concurrently,
+    # with several windows in flight and merged back in batch order
+    windows = list(chunk_list(searches, MSEARCH_WINDOW))
+    futures = [search_executor.submit(send_msearch_window, "descriptions", window) for window in windows]
+    
+    # A failed batch fails the expansion, rather than leaving its concepts out of a response that gets cached
+    for window, future in zip(windows, futures):
+        logger.debug("Processing batches %d-%d/%d", batch_count + 1, batch_count + len(window), total_batches)
         
-        # Execute search for this batch
-        try:
-            resp = es.search(
-                index="descriptions",
-                body=query,
-                timeout='30s'
-            )
+        responses = future.result()
+        
+        for resp in responses:
+            batch_count += 1
+            if "error" in resp:
+                raise RuntimeError(f"Error processing batch {batch_count}: {resp['error']}")
             
-            # Process results and merge with overall results
-            for hit in resp["hits"]["hits"]:
-                source = hit["_source"]
-                concept_id = source["concept_id"]
-                score = hit["_score"]
-                
-                # Calculate additional scoring
-                additional_score = calculate_additional_score(
-                    source["term"], normalized_filter, source["type_id"]
-                )
-                final_score = score + additional_score
-                
-                # Group by concept and keep best scoring description
-                if concept_id not in all_concept_descriptions:
-                    all_concept_descriptions[concept_id] = []
-                
-                all_concept_descriptions[concept_id].append({
-                    "description": source,
-                    "score": final_score
-                })
-                
-        except Exception as e:
-            logger.error(f"Error processing batch {batch_count}: {str(e)}")
-            continue
+            # Merge this batch's hits into the overall best scores
+            scored_before = len(best_scores)
+            collect_best_scores(resp["hits"]["hits"], normalized_filter, best_scores)
+            
+            # Batches hold disjoint concepts, so their counts add up
+            matching_count += count_matching_concepts(
+                resp, len(best_scores) - scored_before, searches[batch_count - 1]["size"]
+            )
     
-    # Sort concepts by their best description score
-    concept_scores = {}
-    for concept_id, descriptions in all_concept_descriptions.items():
-        best_desc = max(descriptions, key=lambda x: x["score"])
-        concept_scores[concept_id] = {
-            "concept_id": concept_id,
-            "score": best_desc["score"],
-            "best_term": best_desc["description"]["term"]
-        }
+    page_concept_ids, total_count = paginate_scored_concepts(best_scores, count, offset)
+    total_count = max(matching_count, total_count)
     
-    # Sort by score then alphabetically
-    sorted_concepts = sorted(
-        concept_scores.values(),
-        key=lambda x: (-x["score"], x["best_term"].lower())
+    # One details fetch for the whole page, across all batches
+    expansion_contains = get_concepts_details_for_expansion(
+        page_concept_ids, display_language, include_designations, request_cache
     )
     
-    total_count = len(sorted_concepts)
-    
-    # Apply pagination
-    paginated_concepts = sorted_concepts[offset:offset + count]
-    concept_ids_for_details = [c["concept_id"] for c in paginated_concepts]
+    logger.debug("Found %d matching concepts for filter '%s' across %d batches", total_count, normalized_filter, batch_count)
+    return expansion_contains, total_count
+
+def send_msearch_window(index, window):
+    """Responses for one window of searches against index, sent as a single msearch"""
+    body = []
+    for query in window:
+        body.append({"index": index})
+        body.append(query)
+    return es.msearch(body=body)["responses"]
+
+def process_filtered_results(resp, query, normalized_filter, display_language, include_designations, count, offset, request_cache=None):
+    """
+    Process filtered search results and return paginated expansion
+    """
+    hits = resp["hits"]["hits"]
+    best_scores = collect_best_scores(hits, normalized_filter, {})
+    if len(hits) == query["size"] and len(best_scores) < offset + count:
+        # The page lies past the concepts in the first window of hits, follow the ranking further
+        best_scores = collect_ranked_concepts(query, normalized_filter, offset + count)
+    page_concept_ids, total_count = paginate_scored_concepts(best_scores, count, offset)
+    total_count = count_matching_concepts(resp, total_count, query["size"])
     
-    # Get detailed descriptions for paginated concepts
+    # Get detailed descriptions for the page in a single batched call
     expansion_contains = get_concepts_details_for_expansion(
-        concept_ids_for_details, display_language, include_designations
+        page_concept_ids, display_language, include_designations, request_cache
     )
     
-    print(f"Found {total_count} matching concepts for filter '{normalized_filter}' across {batch_count} batches")
     return expansion_contains, total_count
 
-def process_filtered_results(resp, normalized_filter, display_language, include_designations, count, offset):
+def collect_ranked_concepts(query, normalized_filter, needed):
     """
-    Process filtered search results and return paginated expansion
+    Best scores of at least `needed` concepts for a filter search, paging
+    through its ranking on a point in time until that many are scored
     """
-    # Process results and group by concept
-    concept_descriptions = {}
-    for hit in resp["hits"]["hits"]:
-        source = hit["_source"]
-        concept_id = source["concept_id"]
-        score = hit["_score"]
+    best_scores = {}
+    pages = iter_pages_pit("descriptions", query, page_size=MAX_RESULT_WINDOW)
+    try:
+        for hits in pages:
+            collect_best_scores(hits, normalized_filter, best_scores)
+            if len(best_scores) >= needed:
+                break
+    finally:
+        pages.close()
+    return best_scores
+
+def count_matching_concepts(resp, scored_count, window_size):
+    """
+    Total matching concepts. A search that returned fewer than window_size
+    hits had every match scored, so scored_count is exact; past that the
+    approximate cardinality agg is used, never less than what was scored.
+    """
+    if len(resp["hits"]["hits"]) < window_size:
+        return scored_count
+    matching = resp.get("aggregations", {}).get("matching_concepts", {}).get("value", 0)
+    return max(matching, scored_count)
+
+def collect_best_scores(hits, normalized_filter, best_scores):
+    """
+    Fold description hits into {concept_id: (score, best_term)}, keeping only
+    the best scoring description per concept instead of every description
+    """
+    # Analyzed term subfields already apply the additional scoring as ES boosts
+    rescore = not analyzed_term_fields()
+    
+    if rescore and np is not None and len(hits) >= VECTORIZE_MIN_HITS:
+        return collect_best_scores_vectorized(hits, normalized_filter, best_scores)
+    
+    if not rescore:
+        # Hits arrive in final score order, a concept's first hit is its best
+        for hit in hits:
+            concept_id, _, term = scored_description(hit)
+            if concept_id not in best_scores:
+                best_scores[concept_id] = (hit["_score"], term)
+        return best_scores
+    
+    additional_score = additional_scorer(normalized_filter)
+    for hit in hits:
+        concept_id, type_id, term = scored_description(hit)
         
         # Calculate additional scoring
-        additional_score = calculate_additional_score(
-            source["term"], normalized_filter, source["type_id"]
-        )
-        final_score = score + additional_score
-        
-        # Group by concept and keep best scoring description
-        if concept_id not in concept_descriptions:
-            concept_descriptions[concept_id] = []
+        final_score = hit["_score"] + additional_score(term, type_id)
         
-        concept_descriptions[concept_id].append({
-            "description": source,
-            "score": final_score
-        })
+        best = best_scores.get(concept_id)
+        if best is None or final_score > best[0]:
+            best_scores[concept_id] = (final_score, term)
     
-    # Sort concepts by their best description score
-    concept_scores = {}
-    for concept_id, descriptions in concept_descriptions.items():
-        best_desc = max(descriptions, key=lambda x: x["score"])
-        concept_scores[concept_id] = {
-            "concept_id": concept_id,
-            "score": best_desc["score"],
-            "best_term": best_desc["description"]["term"]
-        }
+    return best_scores
+
+def scored_description(hit):
+    """(concept_id, type_id, term) of a filter search hit, from its doc values"""
+    fields = hit["fields"]
+    return fields["concept_id.keyword"][0], fields["type_id.keyword"][0], fields["term.keyword"][0]
+
+def collect_best_scores_vectorized(hits, normalized_filter, best_scores):
+    """
+    NumPy version of collect_best_scores for wide result sets: the
+    calculate_additional_score bonuses are computed over whole term arrays
+    """
+    concept_ids, type_ids, terms = (np.array(column) for column in zip(*map(scored_description, hits)))
+    scores = np.array([hit["_score"] or 0.0 for hit in hits], dtype=float)
     
-    # Sort by score then alphabetically
-    sorted_concepts = sorted(
-        concept_scores.values(),
-        key=lambda x: (-x["score"], x["best_term"].lower())
-    )
+    final_scores = scores + calculate_additional_scores_batch(terms, type_ids, normalized_filter)
     
-    total_count = len(sorted_concepts)
+    # Best description per concept: first occurrence after a stable sort on score
+    order = np.argsort(-final_scores, kind="stable")
+    _, first = np.unique(concept_ids[order], return_index=True)
     
-    # Apply pagination
-    paginated_concepts = sorted_concepts[offset:offset + count]
-    concept_ids_for_details = [c["concept_id"] for c in paginated_concepts]
+    # Converted back to Python values in bulk rather than one NumPy scalar at a time
+    picked = order[first]
+    picked_ids = concept_ids[picked].tolist()
+    picked_best = zip(final_scores[picked].tolist(), terms[picked].tolist())
     
-    # Get detailed descriptions for paginated concepts
-    expansion_contains = get_concepts_details_for_expansion(
-        concept_ids_for_details, display_language, include_designations
-    )
+    if not best_scores:
+        best_scores.update(zip(picked_ids, picked_best))
+        return best_scores
     
-    return expansion_contains, total_count
+    for concept_id, candidate in zip(picked_ids, picked_best):
+        best = best_scores.get(concept_id)
+        if best is None or candidate[0] > best[0]:
+            best_scores[concept_id] = candidate
+    
+    return best_scores
+
+def paginate_scored_concepts(best_scores, count, offset):
+    """
+    Order concepts by best score then term and return (page_concept_ids, total_count).
+    Only the first offset + count concepts are ordered, on precomputed tuple keys
+    where the insertion index keeps ties in their original order.
+    """
+    ranked = heapq.nsmallest(offset + count, (
+        (-score, term.lower(), i, concept_id)
+        for i, (concept_id, (score, term)) in enumerate(best_scores.items())
+    ))
+    page_concept_ids = [concept_id for _, _, _, concept_id in ranked[offset:]]
+    return page_concept_ids, len(best_scores)
 
-def get_concepts_details_for_expansion(concept_ids, display_language, include_designations):
+def get_concepts_details_for_expansion(concept_ids, display_language, include_designations, request_cache=None):
     """
-    Get detailed concept information with batch processing for large concept sets
+    Get detailed concept information with batch processing for large concept sets.
+    With a request_cache, concepts already built earlier in the request are not fetched again.
     """
     if not concept_ids:
         return []
     
-    try:
-        # If concept set is small, use single query
-        if len(concept_ids) <= MAX_TERMS_PER_QUERY:
-            return get_concepts_details_single_query(concept_ids, display_language, include_designations)
-        
-        # For large sets, use batch processing
-        return get_concepts_details_batched(concept_ids, display_language, include_designations)
-        
-    except Exception as e:
-        logger.error(f"Error getting concept details: {str(e)}")
-        return []
+    if request_cache is None:
+        return fetch_cached_concepts_details(concept_ids, display_language, include_designations)
+    
+    details = request_cache.setdefault("details", {})
+    missing_ids = [concept_id for concept_id in concept_ids if concept_id not in details]
+    if missing_ids:
+        fetched = {
+            entry["code"]: entry
+            for entry in fetch_cached_concepts_details(missing_ids, display_language, include_designations)
+        }
+        for concept_id in missing_ids:
+            details[concept_id] = fetched.get(concept_id)
+    
+    return [details[concept_id] for concept_id in concept_ids if details[concept_id]]
 
-def get_concepts_details_single_query(concept_ids, display_language, include_designations):
+def fetch_cached_concepts_details(concept_ids, display_language, include_designations):
     """
-    Get concept details with single query for smaller sets
+    fetch_concepts_details behind the 'concepts' cache, so the concepts every
+    expansion keeps showing skip the descriptions and preferred terms lookup.
+    Entries are fixed for an index version, which is part of their keys.
+    A failed lookup raises before anything is cached, rather than caching
+    entries that fell back to the FSN for a day.
     """
-    # Query descriptions for the specific concepts
-    query = {
+    keys = {
+        concept_id: concept_entry_cache_key(concept_id, display_language, include_designations)
+        for concept_id in concept_ids
+    }
+    concept_cache = caches['concepts']
+    cached = concept_cache.get_many(list(keys.values()))
+    
+    missing_ids = [concept_id for concept_id in concept_ids if keys[concept_id] not in cached]
+    fetched = {}
+    if missing_ids:
+        fetched = {
+            entry["code"]: entry
+            for entry in fetch_concepts_details(missing_ids, display_language, include_designations)
+        }
+        concept_cache.set_many({keys[concept_id]: entry for concept_id, entry in fetched.items() if concept_id in keys})
+    
+    entries = (cached.get(keys[concept_id]) or fetched.get(concept_id) for concept_id in concept_ids)
+    return [entry for entry in entries if entry]
+
+def concept_entry_cache_key(concept_id, display_language, include_designations):
+    """Cache key of a concept's expansion entry for the current index version"""
+    return f"snomed:entry:{settings.TERMINOLOGY_INDEX_VERSION}:{display_language}:{int(bool(include_designations))}:{concept_id}"
+
+def fetch_concepts_details(concept_ids, display_language, include_designations):
+    """Query ES for concept details, a single query for small sets and batches for large ones"""
+    # If concept set is small, use single query
+    if len(concept_ids) <= MAX_TERMS_PER_QUERY:
+        return get_concepts_details_single_query(concept_ids, display_language, include_designations)
+    
+    # For large sets, use batch processing
+    return get_concepts_details_batched(concept_ids, display_language, include_designations)
+
+def concept_descriptions_query(concept_ids, display_language):
+    """Active descriptions of the given concepts in display_language, with English as fallback"""
+    return {
+        "bool": {
+            "filter": [
+                grouped_terms_clause("concept_id", concept_ids),
+                {"term": {"active": True}},
+                {"terms": {"language_code": list(dict.fromkeys([display_language, "en"]))}}
+            ]
+        }
+    }
+
+def concept_descriptions_search(query, concept_count, source):
+    """Search body sized for the usual handful of descriptions per concept"""
+    return {
+        "query": query,
+        "_source": source,
+        "size": min(concept_count * DESCRIPTIONS_PER_CONCEPT, MAX_RESULT_WINDOW),
+        "track_total_hits": True
+    }
+
+def display_descriptions_search(query, concept_count, source):
+    """
+    Search body for the one description per concept that build_concept_entries
+    falls back to for the display: the alphabetically first synonym, else FSN.
+    Collapsed on the concept, so a page costs one hit per concept.
+    """
+    return {
         "query": {
             "bool": {
-                "must": [
-                    {"terms": {"concept_id": concept_ids}},
-                    {"term": {"active": True}},
-                    {"term": {"language_code": display_language}}
+                "filter": [
+                    query,
+                    {"terms": {"type_id": ["900000000000013009", "900000000000003001"]}}
                 ]
             }
         },
-        "_source": ["concept_id", "type_id", "term", "language_code"],
-        "size": len(concept_ids) * 20,  # Allow multiple descriptions per concept
+        "_source": source,
+        "collapse": {"field": "concept_id.keyword"},
+        # The synonym type id sorts after the FSN one
+        "sort": [{"type_id.keyword": "desc"}, {"term.keyword": "asc"}],
+        "size": concept_count,
+        "track_total_hits": False
     }
+
+def complete_description_hits(resp, query, source, display_language):
+    """Hits of a concept descriptions search, paging in the full set with search_after when truncated"""
+    # filter_path leaves out hits.hits altogether when nothing matched
+    hits = resp["hits"].get("hits", [])
+    if resp["hits"]["total"]["value"] > len(hits):
+        hits = list(iter_hits("descriptions", query, source=source))
+    return prefer_display_language(hits, display_language)
+
+def prefer_display_language(hits, display_language):
+    """Drop the English fallback hits of concepts that have descriptions in display_language"""
+    if display_language == "en":
+        return hits
+    
+    covered = {hit["_source"]["concept_id"] for hit in hits if hit["_source"].get("language_code") == display_language}
+    return [
+        hit for hit in hits
+        if hit["_source"].get("language_code") == display_language or hit["_source"]["concept_id"] not in covered
+    ]
+
+def msearch_filter_path(filter_path):
+    """A search filter_path applied to every response of an msearch"""
+    return ",".join(f"responses.{path}" for path in filter_path.split(","))
+
+def search_concept_descriptions(concept_ids, display_language, source):
+    """
+    Active descriptions of the given concepts in display_language. Sized for
+    the usual handful of descriptions per concept; when that truncates, the
+    full set is paged in with search_after.
+    """
+    query = concept_descriptions_query(concept_ids, display_language)
     
     resp = es.search(
         index="descriptions",
-        body=query,
+        body=concept_descriptions_search(query, len(concept_ids), source),
+        filter_path=DESCRIPTION_FILTER_PATH,
         timeout='30s'
     )
     
-    # Group descriptions by concept
-    descriptions_by_concept = {}
-    for hit in resp["hits"]["hits"]:
-        source = hit["_source"]
-        concept_id = source["concept_id"]
-        
-        if concept_id not in descriptions_by_concept:
-            descriptions_by_concept[concept_id] = []
-        
-        descriptions_by_concept[concept_id].append(source)
-    
-    # Get preferred terms from language refsets
-    preferred_terms = get_preferred_terms(concept_ids, display_language)
+    return complete_description_hits(resp, query, source, display_language)
+
+def get_concepts_details_single_query(concept_ids, display_language, include_designations):
+    """
+    Get concept details with single query for smaller sets
+    """
+    description_fields = DETAIL_DESCRIPTION_FIELDS
     
-    # Build concept entries
-    expansion_contains = []
-    for concept_id in concept_ids:
-        descriptions = descriptions_by_concept.get(concept_id, [])
-        preferred_term = preferred_terms.get(concept_id)
-        
-        concept_entry = build_concept_entry_from_descriptions(
-            concept_id, descriptions, include_designations, preferred_term
-        )
+    if denormalized_language_refsets():
+        # Without designations, descriptions only stand in for missing preferred terms and
+        # one per concept is enough; other languages still need the English fallback
+        display_only = not include_designations and display_language == "en"
+        
+        # Preferred terms no longer depend on the description ids, fetch both in one round trip
+        query = concept_descriptions_query(concept_ids, display_language)
+        if display_only:
+            descriptions_search = display_descriptions_search(query, len(concept_ids), description_fields)
+        else:
+            descriptions_search = concept_descriptions_search(query, len(concept_ids), description_fields)
+        descriptions_resp, preferred_resp = es.msearch(body=[
+            {"index": "descriptions"},
+            descriptions_search,
+            {"index": "language_refsets"},
+            preferred_terms_search(concept_ids, display_language)
+        ], filter_path=f"responses.error,{msearch_filter_path(DESCRIPTION_FILTER_PATH)}")["responses"]
+        for resp in (descriptions_resp, preferred_resp):
+            if "error" in resp:
+                raise Exception(resp["error"])
+        
+        if display_only:
+            # One collapsed hit per concept, nothing is ever truncated
+            hits = descriptions_resp["hits"].get("hits", [])
+        else:
+            hits = complete_description_hits(descriptions_resp, query, description_fields, display_language)
+        preferred_terms = preferred_terms_from_members(preferred_resp["hits"].get("hits", []), concept_ids)
+    else:
+        # Query descriptions for the specific concepts
+        hits = search_concept_descriptions(concept_ids, display_language, description_fields)
         
-        if concept_entry:
-            expansion_contains.append(concept_entry)
+        # Resolve preferred terms against the descriptions already fetched, saving a second descriptions search
+        preferred_terms = get_preferred_terms_from_hits(hits, concept_ids, display_language)
     
-    return expansion_contains
+    # Group descriptions by concept
+    descriptions_by_concept = defaultdict(list)
+    for hit in hits:
+        source = hit["_source"]
+        descriptions_by_concept[source["concept_id"]].append(source)
+    
+    return build_concept_entries(concept_ids, descriptions_by_concept, preferred_terms, include_designations)
 
 def get_concepts_details_batched(concept_ids, display_language, include_designations):
     """
-    Get concept details with batch processing for large sets
+    Get concept details with batch processing for large sets, the batches
+    searched concurrently and merged back in order
     """
-    all_descriptions_by_concept = {}
+    all_descriptions_by_concept = defaultdict(list)
+    preferred_terms = {}
     
-    # Process in batches
-    batch_count = 0
-    total_batches = (len(concept_ids) + MAX_TERMS_PER_QUERY - 1) // MAX_TERMS_PER_QUERY
+    batches = list(chunk_list(concept_ids, MAX_TERMS_PER_QUERY))
+    total_batches = len(batches)
     
-    for batch_concept_ids in chunk_list(concept_ids, MAX_TERMS_PER_QUERY):
-        batch_count += 1
-        print(f"Getting details for batch {batch_count}/{total_batches} with {len(batch_concept_ids)} concepts")
-        
-        # Query descriptions for this batch
-        query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"concept_id": batch_concept_ids}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}}
-                    ]
-                }
-            },
-            "_source": ["concept_id", "type_id", "term", "language_code"],
-            "size": len(batch_concept_ids) * 20,  # Allow multiple descriptions per concept
-        }
-        
-        try:
-            resp = es.search(
-                index="descriptions",
-                body=query,
-                timeout='30s'
-            )
-            
-            # Group descriptions by concept
-            for hit in resp["hits"]["hits"]:
-                source = hit["_source"]
-                concept_id = source["concept_id"]
-                
-                if concept_id not in all_descriptions_by_concept:
-                    all_descriptions_by_concept[concept_id] = []
-                
-                all_descriptions_by_concept[concept_id].append(source)
-                
-        except Exception as e:
-            logger.error(f"Error getting descriptions for batch {batch_count}: {str(e)}")
-            continue
-    
-    # Get preferred terms from language refsets (this also needs batching)
-    preferred_terms = get_preferred_terms_batched(concept_ids, display_language)
+    futures = [
+        search_executor.submit(search_details_batch, batch_concept_ids, display_language)
+        for batch_concept_ids in batches
+    ]
     
-    # Build concept entries
-    expansion_contains = []
-    for concept_id in concept_ids:
-        descriptions = all_descriptions_by_concept.get(concept_id, [])
-        preferred_term = preferred_terms.get(concept_id)
+    for batch_count, future in enumerate(futures, 1):
+        logger.debug("Getting details for batch %d/%d with %d concepts", batch_count, total_batches, len(batches[batch_count - 1]))
         
-        concept_entry = build_concept_entry_from_descriptions(
-            concept_id, descriptions, include_designations, preferred_term
-        )
+        hits, batch_preferred_terms = future.result()
         
-        if concept_entry:
-            expansion_contains.append(concept_entry)
+        # Group descriptions by concept
+        for hit in hits:
+            source = hit["_source"]
+            all_descriptions_by_concept[source["concept_id"]].append(source)
+        preferred_terms.update(batch_preferred_terms)
+    
+    expansion_contains = build_concept_entries(
+        concept_ids, all_descriptions_by_concept, preferred_terms, include_designations
+    )
     
-    print(f"Built {len(expansion_contains)} concept entries from {batch_count} batches")
+    logger.debug("Built %d concept entries from %d batches", len(expansion_contains), total_batches)
     return expansion_contains
 
-def get_preferred_terms(concept_ids, display_language):
+def search_details_batch(batch_concept_ids, display_language):
+    """Description hits of one details batch and the preferred terms resolved from them"""
+    hits = search_concept_descriptions(
+        batch_concept_ids, display_language, DETAIL_DESCRIPTION_FIELDS
+    )
+    return hits, get_preferred_terms_from_hits(hits, batch_concept_ids, display_language)
+
+def get_preferred_terms(concept_ids, display_language, request_cache=None):
     """
-    Get preferred terms with batching if needed
+    Get preferred terms with batching if needed, skipping concepts already
+    resolved earlier in the request when a request_cache is given
     """
+    if request_cache is not None:
+        known_terms = request_cache.setdefault("preferred_terms", {})
+        missing_ids = [concept_id for concept_id in concept_ids if concept_id not in known_terms]
+        if missing_ids:
+            fetched = get_preferred_terms(missing_ids, display_language)
+            for concept_id in missing_ids:
+                known_terms[concept_id] = fetched.get(concept_id)
+        return {concept_id: known_terms[concept_id] for concept_id in concept_ids if known_terms[concept_id]}
+    
     if len(concept_ids) <= MAX_TERMS_PER_QUERY:
         return get_preferred_terms_single_query(concept_ids, display_language)
     else:
@@ -822,202 +1823,241 @@ def get_preferred_terms_single_query(concept_ids, display_language):
     if not concept_ids:
         return {}
     
-    try:
-        # Map language codes to refset IDs
-        refset_map = {
-            'en': '900000000000509007',  # US English
-            'en-us': '900000000000509007',  # US English
-            'en-gb': '900000000000508004',  # GB English
-        }
-        
-        refset_id = refset_map.get(display_language, '900000000000509007')
-        
-        # First get all description IDs for the concepts
-        desc_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"concept_id": concept_ids}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}},
-                        {"terms": {"type_id": ["900000000000013009", "900000000000003001"]}}
-                    ]
-                }
-            },
-            "_source": ["concept_id", "type_id", "term"],
-            "size": len(concept_ids) * 10
-        }
-        
-        desc_resp = es.search(
-            index="descriptions",
-            body=desc_query,
-            timeout='30s'
-        )
-        
-        # Build mapping
-        desc_to_concept = {}
-        description_ids = []
-        for hit in desc_resp['hits']['hits']:
-            desc_id = hit['_id']
-            source = hit['_source']
-            desc_to_concept[desc_id] = source
-            description_ids.append(desc_id)
-        
-        if not description_ids:
-            return {}
-        
-        # Get preferred terms using batch query
-        preferred_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"referenced_component_id": description_ids}},
-                        {"term": {"refset_id": refset_id}},
-                        {"term": {"active": True}},
-                        {"term": {"acceptability_id": "900000000000548007"}}  # Preferred
-                    ]
-                }
-            },
-            "_source": ["referenced_component_id"],
-            "size": len(description_ids)
-        }
-        
+    # Refset members carrying their description need no descriptions lookup first
+    if denormalized_language_refsets():
         pref_resp = es.search(
             index="language_refsets",
-            body=preferred_query,
+            body=preferred_terms_search(concept_ids, display_language),
             timeout='30s'
         )
-        
-        # Build preferred terms mapping - prioritize synonyms
-        preferred_terms = {}
-        preferred_synonyms = {}
-        preferred_fsns = {}
-        
-        for hit in pref_resp['hits']['hits']:
-            desc_id = hit['_source']['referenced_component_id']
-            
-            if desc_id in desc_to_concept:
-                concept_info = desc_to_concept[desc_id]
-                concept_id = concept_info['concept_id']
-                term = concept_info['term']
-                type_id = concept_info['type_id']
-                
-                if type_id == "900000000000013009":  # Synonym
-                    if concept_id not in preferred_synonyms:
-                        preferred_synonyms[concept_id] = term
-                elif type_id == "900000000000003001":  # FSN
-                    if concept_id not in preferred_fsns:
-                        preferred_fsns[concept_id] = term
-        
-        # Build final mapping - synonyms first
-        for concept_id in concept_ids:
-            if concept_id in preferred_synonyms:
-                preferred_terms[concept_id] = preferred_synonyms[concept_id]
-            elif concept_id in preferred_fsns:
-                preferred_terms[concept_id] = preferred_fsns[concept_id]
-        
-        return preferred_terms
-        
-    except Exception as e:
-        logger.error(f"Error getting preferred terms: {str(e)}")
+        return preferred_terms_from_members(pref_resp["hits"]["hits"], concept_ids)
+    
+    # First get all description IDs for the concepts
+    desc_query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    grouped_terms_clause("concept_id", concept_ids),
+                    {"term": {"active": True}},
+                    {"term": {"language_code": display_language}},
+                    {"terms": {"type_id": ["900000000000013009", "900000000000003001"]}}
+                ]
+            }
+        },
+        "_source": ["concept_id", "type_id", "term", "language_code", "preferred_in"],
+        "size": len(concept_ids) * 10
+    }
+    
+    desc_resp = es.search(
+        index="descriptions",
+        body=desc_query,
+        timeout='30s'
+    )
+    
+    return get_preferred_terms_from_hits(desc_resp['hits']['hits'], concept_ids, display_language)
+
+def denormalized_language_refsets():
+    """Whether language_refsets members carry their description's concept, type and term"""
+    return index_has_field("language_refsets", "concept_id")
+
+def preferred_terms_search(concept_ids, display_language):
+    """language_refsets search for the preferred synonym and FSN members of the given concepts"""
+    return {
+        "query": {
+            "bool": {
+                "filter": [
+                    grouped_terms_clause("concept_id", concept_ids),
+                    {"term": {"refset_id": LANGUAGE_REFSETS.get(display_language, '900000000000509007')}},
+                    {"term": {"active": True}},
+                    {"term": {"acceptability_id": "900000000000548007"}},  # Preferred
+                    {"term": {"description_active": True}},
+                    {"term": {"language_code": display_language}},
+                    {"terms": {"type_id": ["900000000000013009", "900000000000003001"]}}
+                ]
+            }
+        },
+        "_source": ["concept_id", "type_id", "term"],
+        "size": min(len(concept_ids) * 2, MAX_RESULT_WINDOW)  # One preferred synonym and FSN each
+    }
+
+def preferred_terms_from_members(member_hits, concept_ids):
+    """Preferred term per concept from denormalized refset members, synonyms before FSNs"""
+    preferred_synonyms = {}
+    preferred_fsns = {}
+    for hit in member_hits:
+        source = hit["_source"]
+        if source["type_id"] == "900000000000013009":  # Synonym
+            preferred_synonyms.setdefault(source["concept_id"], source["term"])
+        else:
+            preferred_fsns.setdefault(source["concept_id"], source["term"])
+    
+    preferred_terms = {}
+    for concept_id in concept_ids:
+        term = preferred_synonyms.get(concept_id) or preferred_fsns.get(concept_id)
+        if term:
+            preferred_terms[concept_id] = term
+    return preferred_terms
+
+def descriptions_carry_acceptability():
+    """Whether descriptions list the language refsets they are preferred in"""
+    return index_has_field("descriptions", "preferred_in")
+
+def get_preferred_terms_from_hits(desc_hits, concept_ids, display_language):
+    """
+    Resolve preferred terms for already fetched description hits, from their
+    preferred_in field when indexed, else with a single language_refsets query
+    """
+    refset_id = LANGUAGE_REFSETS.get(display_language, '900000000000509007')
+    
+    if descriptions_carry_acceptability():
+        return preferred_terms_from_members([
+            hit for hit in desc_hits
+            if refset_id in hit["_source"].get("preferred_in", ())
+            and hit["_source"]["type_id"] in ("900000000000013009", "900000000000003001")
+            and hit["_source"].get("language_code", display_language) == display_language
+        ], concept_ids)
+    
+    # Build mapping, only synonyms and FSNs can be preferred terms
+    desc_to_concept = {}
+    description_ids = []
+    for hit in desc_hits:
+        desc_id = hit['_id']
+        source = hit['_source']
+        if source['type_id'] not in ("900000000000013009", "900000000000003001"):
+            continue
+        desc_to_concept[desc_id] = source
+        description_ids.append(desc_id)
+    
+    if not description_ids:
         return {}
+    
+    # Get preferred terms using batch query
+    preferred_query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"referenced_component_id": description_ids}},
+                    {"term": {"refset_id": refset_id}},
+                    {"term": {"active": True}},
+                    {"term": {"acceptability_id": "900000000000548007"}}  # Preferred
+                ]
+            }
+        },
+        "_source": False,
+        "docvalue_fields": ["referenced_component_id.keyword"],
+        "size": len(description_ids)
+    }
+    
+    pref_resp = es.search(
+        index="language_refsets",
+        body=preferred_query,
+        timeout='30s'
+    )
+    
+    # Build preferred terms mapping - prioritize synonyms
+    preferred_terms = {}
+    preferred_synonyms = {}
+    preferred_fsns = {}
+    
+    for hit in pref_resp['hits']['hits']:
+        desc_id = hit['fields']['referenced_component_id.keyword'][0]
+        
+        if desc_id in desc_to_concept:
+            concept_info = desc_to_concept[desc_id]
+            concept_id = concept_info['concept_id']
+            term = concept_info['term']
+            type_id = concept_info['type_id']
+            
+            if type_id == "900000000000013009":  # Synonym
+                if concept_id not in preferred_synonyms:
+                    preferred_synonyms[concept_id] = term
+            elif type_id == "900000000000003001":  # FSN
+                if concept_id not in preferred_fsns:
+                    preferred_fsns[concept_id] = term
+    
+    # Build final mapping - synonyms first
+    for concept_id in concept_ids:
+        if concept_id in preferred_synonyms:
+            preferred_terms[concept_id] = preferred_synonyms[concept_id]
+        elif concept_id in preferred_fsns:
+            preferred_terms[concept_id] = preferred_fsns[concept_id]
+    
+    return preferred_terms
 
 def get_preferred_terms_batched(concept_ids, display_language):
     """
-    Get preferred terms with batch processing for large sets
+    Get preferred terms with batch processing for large sets, the batches
+    searched concurrently and merged back in order
     """
     all_preferred_terms = {}
     
-    # Process in batches
-    batch_count = 0
-    total_batches = (len(concept_ids) + MAX_TERMS_PER_QUERY - 1) // MAX_TERMS_PER_QUERY
+    batches = list(chunk_list(concept_ids, MAX_TERMS_PER_QUERY))
+    total_batches = len(batches)
+    
+    futures = [
+        search_executor.submit(get_preferred_terms_single_query, batch_concept_ids, display_language)
+        for batch_concept_ids in batches
+    ]
     
-    for batch_concept_ids in chunk_list(concept_ids, MAX_TERMS_PER_QUERY):
-        batch_count += 1
-        print(f"Getting preferred terms for batch {batch_count}/{total_batches}")
+    for batch_count, future in enumerate(futures, 1):
+        logger.debug("Getting preferred terms for batch %d/%d", batch_count, total_batches)
         
-        try:
-            batch_preferred = get_preferred_terms_single_query(batch_concept_ids, display_language)
-            all_preferred_terms.update(batch_preferred)
-        except Exception as e:
-            logger.error(f"Error getting preferred terms for batch {batch_count}: {str(e)}")
-            continue
+        all_preferred_terms.update(future.result())
     
-    logger.info(f"Found {len(all_preferred_terms)} preferred terms across {batch_count} batches")
+    logger.info("Found %d preferred terms across %d batches", len(all_preferred_terms), total_batches)
     return all_preferred_terms
 
-def build_concept_entry_from_descriptions(concept_id, descriptions, include_designations, preferred_term=None):
+def build_concept_entries(concept_ids, descriptions_by_concept, preferred_terms, include_designations):
     """
-    Build individual concept entry from descriptions - same as File 1 logic
+    Build the expansion.contains entries for concept_ids, in order.
+    Runs once per concept on every page, so lookups are bound to locals up front.
     """
-    if not descriptions:
-        return {
-            "system": "http://snomed.info/sct",
-            "code": concept_id,
-            "display": preferred_term or concept_id
-        }
-    
-    # Use preferred term if available, otherwise find best description
-    display_term = preferred_term
-    
-    if not display_term:
-        # Sort to prioritize synonyms over FSNs
-        sorted_descriptions = sorted(descriptions, key=lambda x: (
-            0 if x["type_id"] == "900000000000013009" else 1,  # Synonym first
-            x["term"]
-        ))
-        
-        if sorted_descriptions:
-            display_term = sorted_descriptions[0]["term"]
-    
-    # Build concept entry
-    concept_entry = {
-        "system": "http://snomed.info/sct",
-        "code": concept_id,
-        "display": display_term or concept_id
+    sct = "http://snomed.info/sct"
+    synonym_id = "900000000000013009"
+    fsn_id = "900000000000003001"
+    display_use = {
+        "system": "http://terminology.hl7.org/CodeSystem/designation-usage",
+        "code": "display"
     }
+    no_descriptions = ()
+    get_descriptions = descriptions_by_concept.get
+    get_preferred_term = preferred_terms.get
     
-    # Add designations if requested
-    if include_designations:
-        designations = []
+    expansion_contains = []
+    append = expansion_contains.append
+    for concept_id in concept_ids:
+        descriptions = get_descriptions(concept_id, no_descriptions)
+        display_term = get_preferred_term(concept_id)
         
-        # Add display designation first
-        display_designation = {
-            "language": "en",
-            "use": {
-                "system": "http://terminology.hl7.org/CodeSystem/designation-usage",
-                "code": "display"
-            },
-            "value": display_term or concept_id
-        }
-        designations.append(display_designation)
+        if not display_term and descriptions:
+            # Synonyms before FSNs, then alphabetical; only the best one is needed so scan instead of sorting
+            synonym_terms = [d["term"] for d in descriptions if d["type_id"] == synonym_id]
+            display_term = min(synonym_terms) if synonym_terms else min(d["term"] for d in descriptions)
+        display = display_term or concept_id
         
-        # Add other designations from descriptions
-        for desc in descriptions:
-            use_system = "http://snomed.info/sct"
-            use_code = desc["type_id"]
-            use_display = "Synonym"
-            
-            if desc["type_id"] == "900000000000003001":  # FSN
-                use_display = "Fully specified name"
-            elif desc["type_id"] == "900000000000013009":  # Synonym
-                use_display = "Synonym"
-            
-            designation = {
+        if not include_designations or not descriptions:
+            append({"system": sct, "code": concept_id, "display": display})
+            continue
+        
+        # Display designation first, then one per description
+        designations = [{"language": "en", "use": display_use, "value": display}]
+        designations.extend(
+            {
                 "language": desc.get("language_code", "en"),
                 "use": {
-                    "system": use_system,
-                    "code": use_code,
-                    "display": use_display
+                    "system": sct,
+                    "code": desc["type_id"],
+                    "display": "Fully specified name" if desc["type_id"] == fsn_id else "Synonym"
                 },
                 "value": desc["term"]
             }
-            designations.append(designation)
-        
-        concept_entry["designation"] = designations
+            for desc in descriptions
+        )
+        append({"system": sct, "code": concept_id, "display": display, "designation": designations})
     
-    return concept_entry
+    return expansion_contains
 
+@lru_cache(maxsize=4096)
 def normalize_search_text(text):
     """
     Normalize search text similar to Snowstorm's approach - same as File 1
@@ -1025,12 +2065,13 @@ def normalize_search_text(text):
     # Convert to lowercase
     text = text.lower()
     
-    # Remove diacritics
-    text = unicodedata.normalize('NFD', text)
-    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    # Remove diacritics, plain ASCII has none to strip
+    if not text.isascii():
+        text = unicodedata.normalize('NFD', text)
+        text = text.translate(STRIP_MARKS_TABLE)
     
     # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = WHITESPACE_RE.sub(' ', text.strip())
     
     return text
 
@@ -1038,55 +2079,86 @@ def calculate_additional_score(term, filter_text, type_id):
     """
     Calculate additional scoring factors similar to Snowstorm - same as File 1
     """
-    additional_score = 0
-    term_lower = term.lower()
+    return additional_scorer(filter_text)(term, type_id)
+
+# Bonus by description type, preferring synonyms over FSNs
+TYPE_BONUS = {
+    "900000000000013009": 10,  # Synonym
+    "900000000000003001": 5,  # FSN
+}
+
+def calculate_additional_scores_batch(terms, type_ids, filter_text):
+    """
+    calculate_additional_score over NumPy arrays of terms and type ids at
+    once, the string compares running in numpy.char instead of per hit
+    """
+    terms_lower = np.char.lower(terms)
     filter_lower = filter_text.lower()
     
-    # Exact match bonus
-    if term_lower == filter_lower:
-        additional_score += 50
+    # Exact match, starts with, then word boundary match bonus
+    exact = terms_lower == filter_lower
+    starts = np.char.startswith(terms_lower, filter_lower)
+    word = np.char.find(terms_lower, f" {filter_lower}") >= 0
+    additional = np.select([exact, starts, word], [50, 30, 20], default=0)
     
-    # Starts with bonus
-    elif term_lower.startswith(filter_lower):
-        additional_score += 30
-    
-    # Word boundary match bonus
-    elif f" {filter_lower}" in term_lower or term_lower.startswith(filter_lower):
-        additional_score += 20
-    
-    # Prefer synonyms over FSNs
-    if type_id == "900000000000013009":  # Synonym
-        additional_score += 10
-    elif type_id == "900000000000003001":  # FSN
-        additional_score += 5
+    for type_id, bonus in TYPE_BONUS.items():
+        additional += np.where(type_ids == type_id, bonus, 0)
     
     # Length penalty for very long terms
-    if len(term) > 100:
-        additional_score -= 5
+    additional -= np.where(np.char.str_len(terms) > 100, 5, 0)
+    return additional
+
+@lru_cache(maxsize=256)
+def additional_scorer(filter_text):
+    """
+    calculate_additional_score bound to one filter. The filter is lowercased
+    once per search instead of once per hit, leaving a lower() and a few
+    string compares in the per-hit call.
+    """
+    filter_lower = filter_text.lower()
+    word_start = f" {filter_lower}"
+    type_bonus = TYPE_BONUS.get
     
-    return additional_score
+    def score(term, type_id):
+        term_lower = term.lower()
+        
+        # Exact match, starts with, then word boundary match bonus
+        if term_lower == filter_lower:
+            additional_score = 50
+        elif term_lower.startswith(filter_lower):
+            additional_score = 30
+        elif word_start in term_lower:
+            additional_score = 20
+        else:
+            additional_score = 0
+        
+        additional_score += type_bonus(type_id, 0)
+        
+        # Length penalty for very long terms
+        if len(term) > 100:
+            additional_score -= 5
+        
+        return additional_score
+    
+    return score
 
 def build_expansion_response(expansion_contains, total_count, offset, display_language):
     """
-    Build the final expansion response - same as File 1
+    Build the final expansion response - same as File 1.
+    The ids and timestamp are left as stamps, filled in by stamp_expansion
+    once the response is encoded.
     """
-    expansion_id = str(uuid.uuid4())
-    timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
-    
     response = {
         "resourceType": "ValueSet",
-        "id": str(uuid.uuid4()),
-        "copyright": "This value set includes content from SNOMED CT, which is copyright © 2002+ International Health Terminology Standards Development Organisation (SNOMED International), and distributed by agreement between SNOMED International and HL7. Implementer use of SNOMED CT is not covered by this agreement.",
+        "id": RESOURCE_ID_STAMP.decode(),
+        "copyright": SNOMED_COPYRIGHT,
         "expansion": {
-            "id": expansion_id,
-            "timestamp": timestamp,
+            "id": EXPANSION_ID_STAMP.decode(),
+            "timestamp": TIMESTAMP_STAMP.decode(),
             "total": total_count,
             "offset": offset,
             "parameter": [
-                {
-                    "name": "version",
-                    "valueUri": "http://snomed.info/sct|http://snomed.info/sct/900000000000207008/version/20240731"
-                },
+                SNOMED_VERSION_PARAMETER,
                 {
                     "name": "displayLanguage",
                     "valueString": display_language
@@ -1096,4 +2168,20 @@ def build_expansion_response(expansion_contains, total_count, offset, display_la
         }
     }
     
-    return response
\ No newline at end of file
+    return response
+
+def stamp_expansion(encoded):
+    """
+    An encoded expansion with a fresh resource id, expansion id and timestamp.
+    The stamps all precede "contains", so only the head of the body is searched
+    and the concepts are copied once, whatever their displays contain.
+    """
+    # One uuid4 split into the resource and expansion ids
+    response_uuid = uuid.uuid4().hex
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
+    
+    head, contains, tail = encoded.partition(b'"contains":')
+    head = head.replace(RESOURCE_ID_STAMP, response_uuid[:16].encode(), 1)
+    head = head.replace(EXPANSION_ID_STAMP, response_uuid[16:].encode(), 1)
+    head = head.replace(TIMESTAMP_STAMP, timestamp.encode(), 1)
+    return EncodedJSON(head + contains + tail)
\ No newline at end of file
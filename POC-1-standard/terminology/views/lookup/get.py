@@ -1,6 +1,52 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from terminology_api.ES.es_client import es
+from terminology_api.ES.executor import search_executor
+from terminology_api.ES.pagination import iter_hits
+import json
+
+# Above this many descriptions + relationships the response is streamed
+STREAMING_THRESHOLD = 1000
+
+# Hits per search in a lookup msearch; the rare concept with more is paged in full
+LOOKUP_PAGE_SIZE = 1000
+
+# Designation "use" display computed by ES, so the Python loop only copies strings.
+# type_id is dynamically mapped as text, only its keyword subfield has doc values;
+# descriptions without one emit nothing and fall back to the display computed in Python
+DESCRIPTION_RUNTIME_MAPPINGS = {
+    "use_display": {
+        "type": "keyword",
+        "script": (
+            "if (doc['type_id.keyword'].size() > 0) { "
+            "emit(doc['type_id.keyword'].value == '900000000000003001' ? 'Fully specified name' : 'Synonym') }"
+        )
+    }
+}
+DESCRIPTION_FIELDS = ["use_display"]
+
+# The only fields a lookup reads; denormalized ancestor lists are left on the ES side
+CONCEPT_SOURCE = ["active", "effective_time", "module_id", "preferred_term"]
+DESCRIPTION_SOURCE = ["active", "type_id", "term", "language_code", "pt"]
+
+# Constant name/system/version entries built once per system and shared by every
+# response; they are only ever serialized, never mutated
+_SKELETON_PARAMETERS = {
+    "http://snomed.info/sct": (
+        {"name": "name", "valueString": "International Edition"},
+        {"name": "system", "valueString": "http://snomed.info/sct"},
+        {"name": "version", "valueString": "http://snomed.info/sct/900000000000207008/version/20220630"}
+    )
+}
+
+# Language refset contexts used in every designation-use-context extension
+_CONTEXT_CODINGS = tuple(
+    {"url": "context", "valueCoding": {"system": "http://snomed.info/sct", "code": context_code}}
+    for context_code in ["900000000000509007", "900000000000508004"]
+)
 
 @api_view(['GET'])
 def lookup_get_view(request):
@@ -11,6 +57,12 @@ def lookup_get_view(request):
     system = request.query_params.get("system")
     code = request.query_params.get("code")
     
+    # Optional FHIR "property" params restrict which properties/designations are returned
+    requested_properties = set(request.query_params.getlist("property"))
+    include_designations = not requested_properties or "designation" in requested_properties
+    include_parents = not requested_properties or "parent" in requested_properties
+    include_children = not requested_properties or "child" in requested_properties
+    
     if not system or not code:
         return Response({
             "resourceType": "OperationOutcome",
@@ -32,7 +84,19 @@ def lookup_get_view(request):
         }, status=400)
     
     try:
-        concept_resp = es.get(index="concepts", id=code, ignore=[404])
+        # SNOMED content only changes with a new index version, which is part of the key
+        cache_key = lookup_cache_key(code, requested_properties)
+        cached_response = caches['concepts'].get(cache_key)
+        if cached_response is not None:
+            return Response(cached_response)
+        
+        # The concept GET runs on the shared pool alongside one msearch for the descriptions
+        # and both IS-A directions
+        searches = lookup_searches(code, include_designations, include_parents, include_children)
+        concept_future = search_executor.submit(es.get, index="concepts", id=code, _source=CONCEPT_SOURCE, ignore=[404])
+        results = dict(zip(searches, msearch_complete(list(searches.values()))))
+        concept_resp = concept_future.result()
+        
         if not concept_resp.get("found", False):
             return Response({
                 "resourceType": "OperationOutcome",
@@ -45,88 +109,221 @@ def lookup_get_view(request):
         
         concept = concept_resp['_source']
         
-        descriptions_resp = es.search(
-            index="descriptions", 
-            body={"query": {"term": {"concept_id": code}}}, 
-            size=1000
+        # Display-only lookups can use the preferred term denormalized at index time
+        descriptions = results.get("descriptions", [])
+        if not include_designations and not concept.get("preferred_term"):
+            descriptions = msearch_complete([lookup_searches(code, True, False, False)["descriptions"]])[0]
+        
+        parents = [r['fields']['destination_id.keyword'][0] for r in results.get("parents", [])]
+        children = [r['fields']['source_id.keyword'][0] for r in results.get("children", [])]
+        
+        # Large concepts (e.g. top-level hierarchy roots) are streamed entry by entry
+        if len(descriptions) + len(parents) + len(children) > STREAMING_THRESHOLD:
+            parameters = iter_lookup_parameters(
+                code, system, concept, descriptions, parents, children, requested_properties
+            )
+            return StreamingHttpResponse(
+                stream_lookup_response(parameters), content_type="application/json"
+            )
+        
+        response = build_lookup_response(
+            code, system, concept, descriptions, parents, children, requested_properties
         )
-        descriptions = descriptions_resp["hits"]["hits"]
+        caches['concepts'].set(cache_key, response)
+        
+        return Response(response)
         
-        relationships_resp = es.search(
-            index="relationships",
-            body={"query": {"bool": {"must": [
+    except Exception as e:
+        return Response({
+            "resourceType": "OperationOutcome", 
+            "issue": [{
+                "severity": "error",
+                "code": "exception",
+                "details": {"text": f"Internal server error: {str(e)}"}
+            }]
+        }, status=500)
+
+def lookup_cache_key(code, requested_properties):
+    """Cache key of a SNOMED $lookup response for the current index version"""
+    properties = ",".join(sorted(requested_properties))
+    return f"snomed:lookup:{settings.TERMINOLOGY_INDEX_VERSION}:{code}:{properties}"
+
+def lookup_searches(code, include_descriptions=True, include_parents=True, include_children=True):
+    """(index, body) of the descriptions and IS-A parent/child searches of a $lookup, by name"""
+    searches = {}
+    if include_descriptions:
+        searches["descriptions"] = ("descriptions", {
+            "query": {"term": {"concept_id": code}},
+            "_source": DESCRIPTION_SOURCE,
+            "runtime_mappings": DESCRIPTION_RUNTIME_MAPPINGS,
+            "fields": DESCRIPTION_FIELDS,
+            "size": LOOKUP_PAGE_SIZE
+        })
+    if include_parents:
+        searches["parents"] = ("relationships", {
+            "query": {"bool": {"filter": [
                 {"term": {"source_id": code}},
                 {"term": {"type_id": "116680003"}},
                 {"term": {"active": True}}
-            ]}}},
-            size=1000
-        )
-        parents = [r['_source']['destination_id'] for r in relationships_resp["hits"]["hits"]]
-        
-        children_resp = es.search(
-            index="relationships",
-            body={"query": {"bool": {"must": [
+            ]}},
+            "_source": False,
+            "docvalue_fields": ["destination_id.keyword"],
+            "size": LOOKUP_PAGE_SIZE
+        })
+    if include_children:
+        searches["children"] = ("relationships", {
+            "query": {"bool": {"filter": [
                 {"term": {"destination_id": code}},
                 {"term": {"type_id": "116680003"}},
                 {"term": {"active": True}}
-            ]}}},
-            size=1000
-        )
-        children = [r['_source']['source_id'] for r in children_resp["hits"]["hits"]]
+            ]}},
+            "_source": False,
+            "docvalue_fields": ["source_id.keyword"],
+            "size": LOOKUP_PAGE_SIZE
+        })
+    return searches
+
+def is_truncated(resp):
+    """Whether a search response hit its size cap and more hits remain."""
+    return resp["hits"]["total"]["value"] > len(resp["hits"]["hits"])
+
+def msearch_complete(searches):
+    """
+    Hits of several (index, body) searches sent as one msearch, in order.
+    The first pages are sorted on _doc like iter_hits, so a search whose
+    page was truncated carries on from its last hit with search_after and
+    wide hierarchies are neither cut off nor fetched twice.
+    """
+    if not searches:
+        return []
+    
+    body = []
+    for index, search in searches:
+        body.append({"index": index})
+        body.append({**search, "sort": [{"_doc": "asc"}]})
+    responses = es.msearch(body=body)["responses"]
+    
+    results = []
+    for (index, search), resp in zip(searches, responses):
+        if "error" in resp:
+            raise Exception(resp["error"])
+        hits = resp["hits"]["hits"]
+        if is_truncated(resp):
+            extra_body = {key: value for key, value in search.items() if key not in ("query", "_source", "size")}
+            hits = hits + list(iter_hits(
+                index, search["query"], source=search.get("_source"), prefetch=True,
+                search_after=hits[-1]["sort"], **extra_body
+            ))
+        results.append(hits)
+    return results
+
+def build_lookup_response(code, system, concept, descriptions, parents, children, requested_properties=frozenset()):
+    """
+    Build the FHIR Parameters resource for a $lookup result.
+    Shared by the single and batch lookup views.
+    """
+    return {
+        "resourceType": "Parameters",
+        "parameter": list(iter_lookup_parameters(
+            code, system, concept, descriptions, parents, children, requested_properties
+        ))
+    }
+
+def iter_lookup_parameters(code, system, concept, descriptions, parents, children, requested_properties=frozenset()):
+    """
+    Lazily yield the $lookup parameter entries in response order, so large
+    descriptions/relationship lists never need to be held as built dicts.
+    """
+    include_designations = not requested_properties or "designation" in requested_properties
+    
+    # Resolve the display first, it is emitted before any designation
+    preferred_term = ""
+    fsn_fallback = ""
+    active_descriptions = []
+    
+    for d in descriptions:
+        src = d["_source"]
         
-        designations = []
-        preferred_term = ""
-        fsn_fallback = ""
+        if not src.get("active", True):
+            continue
         
-        for d in descriptions:
-            src = d["_source"]
-            
-            if not src.get("active", True):
-                continue
-            
-            if src["type_id"] == "900000000000003001":
-                fsn_fallback = src["term"]
+        if src["type_id"] == "900000000000003001":
+            fsn_fallback = src["term"]
+        
+        if src.get("pt", 0) == 1:
+            preferred_term = src["term"]
+        
+        use_display = d.get("fields", {}).get("use_display")
+        if use_display:
+            use_display = use_display[0]
+        else:
+            use_display = "Fully specified name" if src["type_id"] == "900000000000003001" else "Synonym"
+        
+        active_descriptions.append((src, use_display))
+    
+    # The preferred term denormalized at index time wins whatever properties were
+    # requested; descriptions are always fetched for concepts indexed without one
+    display_term = concept.get("preferred_term") or preferred_term or fsn_fallback
+    
+    yield {"name": "code", "valueString": code}
+    yield {"name": "display", "valueString": display_term}
+    yield from _SKELETON_PARAMETERS[system]
+    yield {"name": "active", "valueBoolean": concept.get("active", True)}
+    
+    properties = [
+        {
+            "name": "property",
+            "part": [
+                {"name": "code", "valueString": "effectiveTime"},
+                {"name": "valueString", "valueString": concept.get("effective_time", "")}
+            ]
+        },
+        {
+            "name": "property", 
+            "part": [
+                {"name": "code", "valueString": "moduleId"},
+                {"name": "value", "valueCode": concept.get("module_id", "")}
+            ]
+        }
+    ]
+    
+    for prop in properties:
+        if not requested_properties or prop["part"][0]["valueString"] in requested_properties:
+            yield prop
+    
+    if include_designations:
+        for src, use_display in active_descriptions:
+            extensions = []
             
-            if src.get("pt", 0) == 1:
-                preferred_term = src["term"]
+            role_code = "900000000000548007" if src.get("pt", 0) == 1 else "900000000000549004"
+            role_display = "PREFERRED" if src.get("pt", 0) == 1 else "ACCEPTABLE"
             
-            extensions = []
+            # Role and type are the same for both contexts, only the context coding differs
+            role = {
+                "url": "role", 
+                "valueCoding": {
+                    "system": "http://snomed.info/sct",
+                    "code": role_code,
+                    "display": role_display
+                }
+            }
+            type_ = {
+                "url": "type",
+                "valueCoding": {
+                    "system": "http://snomed.info/sct",
+                    "code": src["type_id"],
+                    "display": use_display
+                }
+            }
             
-            for context_code in ["900000000000509007", "900000000000508004"]:
-                role_code = "900000000000548007" if src.get("pt", 0) == 1 else "900000000000549004"
-                role_display = "PREFERRED" if src.get("pt", 0) == 1 else "ACCEPTABLE"
-                
+            for context in _CONTEXT_CODINGS:
                 extension = {
                     "url": "http://snomed.info/fhir/StructureDefinition/designation-use-context",
-                    "extension": [
-                        {
-                            "url": "context",
-                            "valueCoding": {
-                                "system": "http://snomed.info/sct",
-                                "code": context_code
-                            }
-                        },
-                        {
-                            "url": "role", 
-                            "valueCoding": {
-                                "system": "http://snomed.info/sct",
-                                "code": role_code,
-                                "display": role_display
-                            }
-                        },
-                        {
-                            "url": "type",
-                            "valueCoding": {
-                                "system": "http://snomed.info/sct",
-                                "code": src["type_id"],
-                                "display": "Fully specified name" if src["type_id"] == "900000000000003001" else "Synonym"
-                            }
-                        }
-                    ]
+                    "extension": [context, role, type_]
                 }
                 extensions.append(extension)
             
-            designation = {
+            yield {
                 "extension": extensions,
                 "name": "designation",
                 "part": [
@@ -136,76 +333,36 @@ def lookup_get_view(request):
                         "valueCoding": {
                             "system": "http://snomed.info/sct",
                             "code": src["type_id"],
-                            "display": "Fully specified name" if src["type_id"] == "900000000000003001" else "Synonym"
+                            "display": use_display
                         }
                     },
                     {"name": "value", "valueString": src["term"]}
                 ]
             }
-            designations.append(designation)
-        
-        display_term = preferred_term if preferred_term else fsn_fallback
-        
-        parameters = [
-            {"name": "code", "valueString": code},
-            {"name": "display", "valueString": display_term},
-            {"name": "name", "valueString": "International Edition"},
-            {"name": "system", "valueString": system},
-            {"name": "version", "valueString": "http://snomed.info/sct/900000000000207008/version/20220630"},
-            {"name": "active", "valueBoolean": concept.get("active", True)},
-        ]
-        
-        properties = [
-            {
-                "name": "property",
-                "part": [
-                    {"name": "code", "valueString": "effectiveTime"},
-                    {"name": "valueString", "valueString": concept.get("effective_time", "")}
-                ]
-            },
-            {
-                "name": "property", 
-                "part": [
-                    {"name": "code", "valueString": "moduleId"},
-                    {"name": "value", "valueCode": concept.get("module_id", "")}
-                ]
-            }
-        ]
-        
-        parameters.extend(properties)
-        parameters.extend(designations)
-        
-        for parent_id in parents:
-            parameters.append({
-                "name": "property",
-                "part": [
-                    {"name": "code", "valueString": "parent"},
-                    {"name": "value", "valueCode": parent_id}
-                ]
-            })
-        
-        for child_id in children:
-            parameters.append({
-                "name": "property",
-                "part": [
-                    {"name": "code", "valueString": "child"},
-                    {"name": "value", "valueCode": child_id}
-                ]
-            })
-        
-        response = {
-            "resourceType": "Parameters",
-            "parameter": parameters
+    
+    for parent_id in parents:
+        yield {
+            "name": "property",
+            "part": [
+                {"name": "code", "valueString": "parent"},
+                {"name": "value", "valueCode": parent_id}
+            ]
         }
-        
-        return Response(response)
-        
-    except Exception as e:
-        return Response({
-            "resourceType": "OperationOutcome", 
-            "issue": [{
-                "severity": "error",
-                "code": "exception",
-                "details": {"text": f"Internal server error: {str(e)}"}
-            }]
-        }, status=500)
\ No newline at end of file
+    
+    for child_id in children:
+        yield {
+            "name": "property",
+            "part": [
+                {"name": "code", "valueString": "child"},
+                {"name": "value", "valueCode": child_id}
+            ]
+        }
+
+def stream_lookup_response(parameters):
+    """Serialize a Parameters resource entry by entry instead of as one big string"""
+    yield b'{"resourceType": "Parameters", "parameter": ['
+    for i, parameter in enumerate(parameters):
+        if i:
+            yield b','
+        yield json.dumps(parameter).encode('utf-8')
+    yield b']}'
@@ -1,12 +1,22 @@
+from django.conf import settings
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from terminology_api.ES.es_client import es
+from terminology_api.ES.mappings import index_has_field
+from terminology_api.text import STRIP_MARKS_TABLE, WHITESPACE_RE
+from functools import lru_cache
 import logging
 import re
 import unicodedata
 
 logger = logging.getLogger(__name__)
 
+DISPLAY_PUNCTUATION_RE = re.compile(r'[(),-]')
+
+# Concept existence and ancestor sets kept in memory, keyed by concept and index version;
+# value set validations check the same codes and is-a roots over and over
+CONCEPT_CACHE_SIZE = 10000
+
 @api_view(['POST'])
 def validate_code_view(request):
     """
@@ -44,7 +54,7 @@ def validate_code_view(request):
         if display_language in ['en-gb', 'en-us']:
             display_language = 'en'
         
-        logger.info(f"Validate-code request - Code: {code}, System: {system}, Display: {display}")
+        logger.info("Validate-code request - Code: %s, System: %s, Display: %s", code, system, display)
         
         # Validate required parameters
         if not code:
@@ -94,7 +104,7 @@ def validate_code_view(request):
             )
     
     except Exception as e:
-        logger.error(f"ValueSet validate-code error: {str(e)}", exc_info=True)
+        logger.error("ValueSet validate-code error: %s", e, exc_info=True)
         return Response({
             "resourceType": "Parameters",
             "parameter": [
@@ -220,7 +230,7 @@ def validate_code_against_valueset(code, display, display_language, value_set, u
         )
     
     except Exception as e:
-        logger.error(f"Error validating code against ValueSet: {str(e)}")
+        logger.error("Error validating code against ValueSet: %s", e, exc_info=True)
         return build_validation_response(
             result=False,
             message=f"Error validating code: {str(e)}",
@@ -265,7 +275,7 @@ def validate_code_in_codesystem(code, display, display_language, system, version
         )
     
     except Exception as e:
-        logger.error(f"Error validating code in CodeSystem: {str(e)}")
+        logger.error("Error validating code in CodeSystem: %s", e, exc_info=True)
         return build_validation_response(
             result=False,
             message=f"Error validating code: {str(e)}",
@@ -303,7 +313,7 @@ def check_code_against_filter(code, filter_def):
         return False
     
     except Exception as e:
-        logger.error(f"Error checking filter: {str(e)}")
+        logger.error("Error checking filter: %s", e, exc_info=True)
         return False
 
 def get_concept_ancestors(concept_id):
@@ -311,105 +321,120 @@ def get_concept_ancestors(concept_id):
     Get all ancestor concepts for a given concept
     """
     try:
-        ancestors = set()
-        current_level = {concept_id}
-        depth = 0
-        max_depth = 15
-        
-        while current_level and depth < max_depth:
-            # Find parents of current level concepts
-            parents = get_concept_parents(list(current_level))
-            
-            # Filter out already processed concepts
-            new_ancestors = parents - ancestors - {concept_id}
-            
-            if not new_ancestors:
-                break
-                
-            ancestors.update(new_ancestors)
-            current_level = new_ancestors
-            depth += 1
-        
-        return ancestors
+        return cached_concept_ancestors(concept_id, settings.TERMINOLOGY_INDEX_VERSION)
     
     except Exception as e:
-        logger.error(f"Error getting ancestors for {concept_id}: {str(e)}")
+        logger.error("Error getting ancestors for %s: %s", concept_id, e, exc_info=True)
         return set()
 
+@lru_cache(maxsize=CONCEPT_CACHE_SIZE)
+def cached_concept_ancestors(concept_id, index_version):
+    """Ancestors of a concept, memoized per index version; lookups that fail are not cached"""
+    # Precomputed ancestor set on the concept doc, read by the same GET as the active flag
+    if index_has_field("concepts", "ancestors"):
+        source = cached_concept_source(concept_id, index_version) or {}
+        return frozenset(source.get("ancestors", []))
+    
+    ancestors = set()
+    current_level = {concept_id}
+    depth = 0
+    max_depth = 15
+    
+    while current_level and depth < max_depth:
+        # Find parents of current level concepts
+        parents = get_concept_parents(list(current_level))
+        
+        # Filter out already processed concepts
+        new_ancestors = parents - ancestors - {concept_id}
+        
+        if not new_ancestors:
+            break
+            
+        ancestors.update(new_ancestors)
+        current_level = new_ancestors
+        depth += 1
+    
+    return frozenset(ancestors)
+
 def get_concept_parents(concept_ids):
     """
     Get direct parents for given concept IDs
     """
-    try:
-        parents = set()
-        
-        query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"source_id": concept_ids}},
-                        {"term": {"type_id": "116680003"}},  # IS-A relationship
-                        {"term": {"active": True}}
-                    ]
-                }
-            },
-            "_source": ["destination_id"],
-            "size": len(concept_ids) * 20
-        }
-        
-        resp = es.search(
-            index="relationships",
-            body=query,
-            timeout='30s'
-        )
-        
-        for hit in resp["hits"]["hits"]:
-            parent_id = hit["_source"]["destination_id"]
-            parents.add(parent_id)
-        
-        return parents
+    parents = set()
     
-    except Exception as e:
-        logger.error(f"Error getting parents: {str(e)}")
-        return set()
+    query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"source_id": concept_ids}},
+                    {"term": {"type_id": "116680003"}},  # IS-A relationship
+                    {"term": {"active": True}}
+                ]
+            }
+        },
+        "_source": False,
+        "docvalue_fields": ["destination_id.keyword"],
+        "size": len(concept_ids) * 20
+    }
+    
+    resp = es.search(
+        index="relationships",
+        body=query,
+        timeout='30s'
+    )
+    
+    for hit in resp["hits"]["hits"]:
+        parent_id = hit["fields"]["destination_id.keyword"][0]
+        parents.add(parent_id)
+    
+    return parents
 
 def concept_exists(concept_id):
     """Check if a concept exists and is active"""
     try:
-        result = es.get(index="concepts", id=concept_id, ignore=[404])
-        if result.get('found', False):
-            # Check if concept is active
-            source = result.get('_source', {})
-            return source.get('active', False)
-        return False
+        return cached_concept_active(concept_id, settings.TERMINOLOGY_INDEX_VERSION)
     except Exception as e:
-        logger.error(f"Error checking concept existence for {concept_id}: {str(e)}")
+        logger.error("Error checking concept existence for %s: %s", concept_id, e, exc_info=True)
         return False
 
+@lru_cache(maxsize=CONCEPT_CACHE_SIZE)
+def cached_concept_active(concept_id, index_version):
+    """Whether a concept exists and is active, memoized per index version"""
+    source = cached_concept_source(concept_id, index_version)
+    return bool(source and source.get('active', False))
+
+@lru_cache(maxsize=CONCEPT_CACHE_SIZE)
+def cached_concept_source(concept_id, index_version):
+    """
+    The active flag and, where indexed, the ancestors of a concept, or None if
+    it does not exist. Existence and is-a checks on a code share this one GET.
+    """
+    fields = ["active", "ancestors"] if index_has_field("concepts", "ancestors") else ["active"]
+    result = es.get(index="concepts", id=concept_id, _source=fields, ignore=[404])
+    if not result.get('found', False):
+        return None
+    return result.get('_source', {})
+
 def get_concept_display(concept_id, display_language):
     """
     Get the preferred display term for a concept
     """
     try:
-        # First try to get preferred synonym
-        preferred_term = get_preferred_term(concept_id, display_language)
-        if preferred_term:
-            return preferred_term
-        
-        # Fallback to any active synonym
+        # Synonyms and FSNs in the requested language and English come back in one query
+        languages = list(dict.fromkeys([display_language, "en"]))
         query = {
             "query": {
                 "bool": {
-                    "must": [
+                    "filter": [
                         {"term": {"concept_id": concept_id}},
                         {"term": {"active": True}},
-                        {"term": {"language_code": display_language}},
-                        {"term": {"type_id": "900000000000013009"}}  # Synonym
+                        {"terms": {"language_code": languages}},
+                        {"terms": {"type_id": ["900000000000013009", "900000000000003001"]}}
                     ]
                 }
             },
-            "_source": ["term"],
-            "size": 1
+            "_source": ["term", "type_id", "language_code"],
+            "size": 100
         }
         
         resp = es.search(
@@ -418,115 +443,72 @@ def get_concept_display(concept_id, display_language):
             timeout='30s'
         )
         
-        if resp["hits"]["hits"]:
-            return resp["hits"]["hits"][0]["_source"]["term"]
+        hits = resp["hits"]["hits"]
         
-        # Ultimate fallback to FSN
-        fsn_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"concept_id": concept_id}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}},
-                        {"term": {"type_id": "900000000000003001"}}  # FSN
-                    ]
-                }
-            },
-            "_source": ["term"],
-            "size": 1
-        }
+        # Prefer the requested language, fall back to English only when it has nothing
+        requested = [hit for hit in hits if hit["_source"].get("language_code") == display_language]
+        hits = requested or hits
         
-        fsn_resp = es.search(
-            index="descriptions",
-            body=fsn_query,
-            timeout='30s'
-        )
+        synonyms = [hit for hit in hits if hit["_source"]["type_id"] == "900000000000013009"]
+        if synonyms:
+            preferred_term = get_preferred_term(synonyms, display_language)
+            return preferred_term or synonyms[0]["_source"]["term"]
         
-        if fsn_resp["hits"]["hits"]:
-            return fsn_resp["hits"]["hits"][0]["_source"]["term"]
+        # Ultimate fallback to FSN
+        if hits:
+            return hits[0]["_source"]["term"]
         
         return None
     
     except Exception as e:
-        logger.error(f"Error getting display for {concept_id}: {str(e)}")
+        logger.error("Error getting display for %s: %s", concept_id, e, exc_info=True)
         return None
 
-def get_preferred_term(concept_id, display_language):
+def get_preferred_term(synonym_hits, display_language):
     """
-    Get preferred term using language refsets
+    Pick the preferred term among already fetched synonym hits using language refsets
     """
-    try:
-        # Map language to refset ID
-        refset_map = {
-            'en': '900000000000509007',  # US English
-            'en-us': '900000000000509007',  # US English
-            'en-gb': '900000000000508004',  # GB English
-        }
-        
-        refset_id = refset_map.get(display_language, '900000000000509007')
-        
-        # Get all active synonyms for the concept
-        desc_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"concept_id": concept_id}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}},
-                        {"term": {"type_id": "900000000000013009"}}  # Synonym
-                    ]
-                }
-            },
-            "_source": ["term"],
-            "size": 50
-        }
-        
-        desc_resp = es.search(
-            index="descriptions",
-            body=desc_query,
-            timeout='30s'
-        )
-        
-        if not desc_resp["hits"]["hits"]:
-            return None
-        
-        # Get description IDs
-        description_ids = [hit["_id"] for hit in desc_resp["hits"]["hits"]]
-        desc_terms = {hit["_id"]: hit["_source"]["term"] for hit in desc_resp["hits"]["hits"]}
-        
-        # Find preferred description
-        pref_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"referenced_component_id": description_ids}},
-                        {"term": {"refset_id": refset_id}},
-                        {"term": {"active": True}},
-                        {"term": {"acceptability_id": "900000000000548007"}}  # Preferred
-                    ]
-                }
-            },
-            "_source": ["referenced_component_id"],
-            "size": 1
-        }
-        
-        pref_resp = es.search(
-            index="language_refsets",
-            body=pref_query,
-            timeout='30s'
-        )
-        
-        if pref_resp["hits"]["hits"]:
-            preferred_desc_id = pref_resp["hits"]["hits"][0]["_source"]["referenced_component_id"]
-            return desc_terms.get(preferred_desc_id)
-        
-        # If no preferred found, return first synonym
-        return desc_resp["hits"]["hits"][0]["_source"]["term"]
+    # Map language to refset ID
+    refset_map = {
+        'en': '900000000000509007',  # US English
+        'en-us': '900000000000509007',  # US English
+        'en-gb': '900000000000508004',  # GB English
+    }
     
-    except Exception as e:
-        logger.error(f"Error getting preferred term for {concept_id}: {str(e)}")
-        return None
+    refset_id = refset_map.get(display_language, '900000000000509007')
+    
+    # Get description IDs
+    description_ids = [hit["_id"] for hit in synonym_hits]
+    desc_terms = {hit["_id"]: hit["_source"]["term"] for hit in synonym_hits}
+    
+    # Find preferred description
+    pref_query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"referenced_component_id": description_ids}},
+                    {"term": {"refset_id": refset_id}},
+                    {"term": {"active": True}},
+                    {"term": {"acceptability_id": "900000000000548007"}}  # Preferred
+                ]
+            }
+        },
+        "_source": False,
+        "docvalue_fields": ["referenced_component_id.keyword"],
+        "size": 1
+    }
+    
+    pref_resp = es.search(
+        index="language_refsets",
+        body=pref_query,
+        timeout='30s'
+    )
+    
+    if pref_resp["hits"]["hits"]:
+        preferred_desc_id = pref_resp["hits"]["hits"][0]["fields"]["referenced_component_id.keyword"][0]
+        return desc_terms.get(preferred_desc_id)
+    
+    return None
 
 def is_display_match(provided_display, actual_display, language):
     """
@@ -550,6 +532,7 @@ def is_display_match(provided_display, actual_display, language):
     
     return False
 
+@lru_cache(maxsize=4096)
 def normalize_display_text(text):
     """
     Normalize display text for comparison
@@ -557,16 +540,14 @@ def normalize_display_text(text):
     # Convert to lowercase
     text = text.lower()
     
-    # Remove diacritics
-    text = unicodedata.normalize('NFD', text)
-    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
-    
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    # Remove diacritics, plain ASCII has none to strip
+    if not text.isascii():
+        text = unicodedata.normalize('NFD', text)
+        text = text.translate(STRIP_MARKS_TABLE)
     
-    # Remove common punctuation variations
-    text = re.sub(r'[(),-]', ' ', text)
-    text = re.sub(r'\s+', ' ', text.strip())
+    # Remove common punctuation variations and extra whitespace
+    text = DISPLAY_PUNCTUATION_RE.sub(' ', text)
+    text = WHITESPACE_RE.sub(' ', text.strip())
     
     return text
 
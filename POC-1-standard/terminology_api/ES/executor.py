@@ -0,0 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+# Sends the ES calls views fan out for every request: expand msearch windows and detail and
+# preferred term batches, lookup concept GETs. Concurrent requests queue on one bounded pool
+# rather than each starting threads of its own, so threads are not created per request and
+# ES sees at most ES_FANOUT_WORKERS of these at once.
+# Only leaf ES calls are submitted, a task never waits on another task of this pool.
+search_executor = ThreadPoolExecutor(max_workers=settings.ES_FANOUT_WORKERS, thread_name_prefix="es-fanout")
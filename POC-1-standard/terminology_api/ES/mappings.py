@@ -0,0 +1,52 @@
+from terminology_api.ES.es_client import es
+
+# (index, field) -> mapped type or None, filled lazily; a reindex needs a restart to be picked up
+_field_cache = {}
+# index -> tuple of index sort fields, cached the same way
+_sort_cache = {}
+
+def index_field_type(index, field):
+    """
+    The type `field` is mapped as on `index`, None when it is not mapped.
+    Subfields such as term.folded are looked up by their full name.
+    """
+    key = (index, field)
+    if key not in _field_cache:
+        resp = es.indices.get_field_mapping(index=index, fields=field)
+        leaf = field.rsplit(".", 1)[-1]
+        _field_cache[key] = next(
+            (
+                mapping["mappings"][field]["mapping"].get(leaf, {}).get("type")
+                for mapping in resp.values()
+                if mapping.get("mappings", {}).get(field)
+            ),
+            None
+        )
+    return _field_cache[key]
+
+def index_has_field(index, field):
+    """
+    Whether `field` is mapped on `index`. Lets the views use fields added by
+    newer indexer runs while still serving indices built before them.
+    """
+    return index_field_type(index, field) is not None
+
+def index_sort_fields(index):
+    """
+    The fields `index` was sorted on at creation, () when it is unsorted.
+    Index sorting cannot be changed later, only by recreating the index.
+    """
+    if index not in _sort_cache:
+        resp = es.indices.get_settings(index=index, name="index.sort.field", flat_settings=True)
+        sort_field = next(
+            (settings["settings"]["index.sort.field"] for settings in resp.values() if settings.get("settings")),
+            ()
+        )
+        _sort_cache[index] = (sort_field,) if isinstance(sort_field, str) else tuple(sort_field)
+    return _sort_cache[index]
+
+def forget_index(index):
+    """Drop what is cached about `index`, for callers that just recreated it"""
+    for key in [key for key in _field_cache if key[0] == index]:
+        del _field_cache[key]
+    _sort_cache.pop(index, None)
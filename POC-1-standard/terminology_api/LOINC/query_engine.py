@@ -1,7 +1,7 @@
 from elasticsearch import Elasticsearch
 from typing import Dict, List
-from datetime import datetime
 import logging
+import time
 import uuid
 
 # Configure logging
@@ -93,12 +93,14 @@ class LoincQueryEngine:
         response = self.es.search(index=self.indices['concepts'], body=search_body)
         
         # Format as FHIR ValueSet expansion
-        expansion_id = str(uuid.uuid4())
-        timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        # One uuid4 split into the resource and expansion ids
+        response_uuid = uuid.uuid4().hex
+        expansion_id = response_uuid[16:]
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
         
         expansion = {
             "resourceType": "ValueSet",
-            "id": str(uuid.uuid4()),
+            "id": response_uuid[:16],
             "expansion": {
                 "id": expansion_id,
                 "timestamp": timestamp,
@@ -1,30 +1,158 @@
-from elasticsearch.helpers import bulk
+from collections import defaultdict
+from terminology_api.ES.bulk import parallel_index
 from terminology_api.ES.es_client import es
 from terminology_api.SNOMED.reader import RF2PandasReader  
+from terminology_api.SNOMED.ancestors import compute_ancestors
 import pandas as pd
 import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Concepts stored in concept_id order, so a page sorted on concept_id stops after offset + count
+# documents instead of visiting every match; index sorting can only be set at creation
+CONCEPTS_SETTINGS = {
+    "index": {
+        "sort.field": "concept_id",
+        "sort.order": "asc"
+    }
+}
+
+# ancestors must be a keyword field so descendants are a single term query,
+# concept_id is numeric so subtrees can be paged in id order
+CONCEPTS_MAPPINGS = {
+    "properties": {
+        "concept_id": {"type": "long"},
+        "ancestors": {"type": "keyword"}
+    }
+}
+
+# Descriptions index: term gets folded/prefix/exact/starts subfields so $expand filters
+# are matched and scored by ES; everything else keeps dynamic mapping
+DESCRIPTIONS_SETTINGS = {
+    "analysis": {
+        "filter": {
+            "prefix_ngram": {"type": "edge_ngram", "min_gram": 1, "max_gram": 20},
+            # Longer query words are cut to the largest indexed gram so they still match as prefixes
+            "prefix_truncate": {"type": "truncate", "length": 20}
+        },
+        "analyzer": {
+            "folding": {"tokenizer": "standard", "filter": ["lowercase", "asciifolding"]},
+            "folding_prefix": {"tokenizer": "standard", "filter": ["lowercase", "asciifolding", "prefix_ngram"]},
+            "folding_prefix_search": {"tokenizer": "standard", "filter": ["lowercase", "asciifolding", "prefix_truncate"]},
+            "folding_whole": {"tokenizer": "keyword", "filter": ["lowercase", "asciifolding"]}
+        },
+        "normalizer": {
+            "folding": {"type": "custom", "filter": ["lowercase", "asciifolding"]}
+        }
+    }
+}
+DESCRIPTIONS_MAPPINGS = {
+    "properties": {
+        "term": {
+            "type": "text",
+            "fields": {
+                "keyword": {"type": "keyword", "ignore_above": 256},
+                "exact": {"type": "keyword", "normalizer": "folding", "ignore_above": 256},
+                "folded": {"type": "text", "analyzer": "folding"},
+                "prefix": {"type": "text", "analyzer": "folding_prefix", "search_analyzer": "folding_prefix_search"},
+                # Whole folded term with its leading prefixes indexed, for starts-with matching
+                "starts": {
+                    "type": "text",
+                    "analyzer": "folding_whole",
+                    "index_prefixes": {"min_chars": 1, "max_chars": 19}
+                }
+            }
+        },
+        # The concept's IS-A ancestors, so a filtered is-a expansion is one descriptions search
+        "ancestors": {"type": "keyword"},
+        # Language refsets this description is the preferred term in, so preferred terms need no refset query
+        "preferred_in": {"type": "keyword"}
+    }
+}
+
+# === Helpers ===
+def build_preferred_terms(reader):
+    """Map concept_id -> US English preferred synonym, denormalized onto concept docs"""
+    preferred = reader.get_preferred_descriptions_df()
+    if preferred.empty:
+        return {}
+    synonyms = preferred[preferred['typeId'] == "900000000000013009"]
+    return dict(zip(synonyms['conceptId'], synonyms['term']))
+
+def build_preferred_refsets(reader):
+    """Map description_id -> language refsets where it is an active preferred member"""
+    preferred_in = defaultdict(list)
+    for lang_ref in reader.language_refsets:
+        if lang_ref.active and lang_ref.acceptability_id == "900000000000548007":
+            preferred_in[lang_ref.referenced_component_id].append(lang_ref.refset_id)
+    return preferred_in
+
+def build_ancestors(reader):
+    """Map concept_id -> transitive set of IS-A ancestors from active inferred relationships"""
+    rels = reader.relationships_df
+    if rels is None or rels.empty:
+        return {}
+    is_a = rels[(rels['active'] == True) & (rels['typeId'] == "116680003")]
+    parents = is_a.groupby('sourceId')['destinationId'].apply(set).to_dict()
+    return compute_ancestors(parents)
+
+def concepts_index_outdated():
+    """
+    Whether the existing concepts index maps a CONCEPTS_MAPPINGS field as another
+    type, or is not sorted as CONCEPTS_SETTINGS asks
+    """
+    resp = es.indices.get_mapping(index="concepts")
+    properties = next(iter(resp.values()))["mappings"].get("properties", {})
+    if any(
+        properties.get(field, {}).get("type") != mapping["type"]
+        for field, mapping in CONCEPTS_MAPPINGS["properties"].items()
+    ):
+        return True
+    resp = es.indices.get_settings(index="concepts", name="index.sort.*", flat_settings=True)
+    settings = next(iter(resp.values())).get("settings", {})
+    return any(
+        settings.get(f"index.{name}") not in (value, [value])
+        for name, value in CONCEPTS_SETTINGS["index"].items()
+    )
+
 # === Indexing Functions ===
-def index_concepts(reader):
+def index_concepts(reader, ancestors=None):
+    preferred_terms = build_preferred_terms(reader)
+    if ancestors is None:
+        ancestors = build_ancestors(reader)
+    # Neither mapped types nor index sorting can change in place; an index built before them,
+    # e.g. with concept_id dynamically mapped as text, is dropped and rebuilt since every
+    # concept is indexed below anyway
+    if es.indices.exists(index="concepts") and concepts_index_outdated():
+        print("Recreating the concepts index, its mappings or sort differ from CONCEPTS_MAPPINGS/CONCEPTS_SETTINGS")
+        es.indices.delete(index="concepts")
+    if not es.indices.exists(index="concepts"):
+        es.indices.create(index="concepts", settings=CONCEPTS_SETTINGS, mappings=CONCEPTS_MAPPINGS)
     actions = [
         {
             "_index": "concepts",
             "_id": concept.id,
             "_source": {
+                "concept_id": concept.id,
                 "effective_time": concept.effective_time,
                 "active": concept.active,
                 "module_id": concept.module_id,
-                "definition_status": concept.definition_status
+                "definition_status": concept.definition_status,
+                "preferred_term": preferred_terms.get(concept.id, ""),
+                "ancestors": sorted(ancestors.get(concept.id, ()))
             }
         }
         for concept in reader.concepts.values()
     ]
-    bulk(es, actions)
+    parallel_index(actions)
     print(f"✅ Indexed {len(actions)} concepts")
 
-def index_descriptions(reader):
+def index_descriptions(reader, ancestors=None):
+    if ancestors is None:
+        ancestors = build_ancestors(reader)
+    if not es.indices.exists(index="descriptions"):
+        es.indices.create(index="descriptions", settings=DESCRIPTIONS_SETTINGS, mappings=DESCRIPTIONS_MAPPINGS)
+    preferred_in = build_preferred_refsets(reader)
     actions = []
     skipped = 0
     for desc in reader.descriptions:
@@ -40,12 +168,14 @@ def index_descriptions(reader):
                 "language_code": desc.language_code,
                 "active": desc.active,
                 "type_id": desc.type_id,
-                "case_significance": desc.case_significance
+                "case_significance": desc.case_significance,
+                "ancestors": sorted(ancestors.get(desc.concept_id, ())),
+                "preferred_in": preferred_in.get(desc.id, [])
             }
         })
 
     print(f"Skipping {skipped} descriptions with invalid 'term'...")
-    success, _ = bulk(es, actions, raise_on_error=True)
+    success, _ = parallel_index(actions)
     print(f"✅ Indexed {success} descriptions")
 
 def index_relationships(reader):
@@ -65,26 +195,37 @@ def index_relationships(reader):
         }
         for rel in reader.relationships
     ]
-    bulk(es, actions)
+    parallel_index(actions)
     print(f"✅ Indexed {len(actions)} relationships")
 
 def index_language_refset(reader):
-    actions = [
-        {
+    # Description fields are copied onto each member so preferred terms are one refset query
+    descriptions = {desc.id: desc for desc in reader.descriptions}
+    actions = []
+    for lang_ref in reader.language_refsets:
+        source = {
+            "effective_time": lang_ref.effective_time,
+            "active": lang_ref.active,
+            "module_id": lang_ref.module_id,
+            "refset_id": lang_ref.refset_id,
+            "referenced_component_id": lang_ref.referenced_component_id,
+            "acceptability_id": lang_ref.acceptability_id
+        }
+        desc = descriptions.get(lang_ref.referenced_component_id)
+        if desc is not None and not pd.isna(desc.term):
+            source.update({
+                "concept_id": desc.concept_id,
+                "type_id": desc.type_id,
+                "term": desc.term,
+                "language_code": desc.language_code,
+                "description_active": desc.active
+            })
+        actions.append({
             "_index": "language_refsets",
             "_id": lang_ref.id,
-            "_source": {
-                "effective_time": lang_ref.effective_time,
-                "active": lang_ref.active,
-                "module_id": lang_ref.module_id,
-                "refset_id": lang_ref.refset_id,
-                "referenced_component_id": lang_ref.referenced_component_id,
-                "acceptability_id": lang_ref.acceptability_id
-            }
-        }
-        for lang_ref in reader.language_refsets
-    ]
-    bulk(es, actions)
+            "_source": source
+        })
+    parallel_index(actions)
     print(f"✅ Indexed {len(actions)} language refsets")
 
 # === Main runner ===
@@ -92,7 +233,9 @@ if __name__ == "__main__":
     reader = RF2PandasReader()
     reader.load_rf2_release("SnomedCT_InternationalRF2_PRODUCTION_20250501T120000Z/Snapshot")
 
-    index_concepts(reader)
-    index_descriptions(reader)
+    # The IS-A closure is denormalized onto both concepts and descriptions
+    ancestors = build_ancestors(reader)
+    index_concepts(reader, ancestors)
+    index_descriptions(reader, ancestors)
     index_relationships(reader)
     index_language_refset(reader)
\ No newline at end of file
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'terminology_api.settings')
 
 application = get_asgi_application()
+
+# Serving processes only; management commands and tests never load this module
+from terminology.apps import start_descendant_warmup
+
+start_descendant_warmup()
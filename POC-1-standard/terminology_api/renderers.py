@@ -0,0 +1,55 @@
+import json
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # responses fall back to DRF's json encoder
+    orjson = None
+
+# numpy scalars reach the response from the vectorized scoring path, and maps
+# keyed by integer SCTIDs are encoded with string keys as the json module does
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+class EncodedJSON(bytes):
+    """
+    A response body encoded once by encode_json, e.g. to be cached. The JSON
+    renderers write it out as is rather than encoding the data again.
+    """
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer encoding with orjson when it is installed. Large $expand
+    pages spend much of their time in json.dumps; orjson encodes them in C.
+    Indented output requests and anything orjson cannot encode go through the
+    regular JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, EncodedJSON):
+            if not self.get_indent(accepted_media_type, renderer_context or {}):
+                return bytes(data)
+            data = json.loads(data)
+
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            return orjson.dumps(data, option=ORJSON_OPTIONS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class FHIRJSONRenderer(ORJSONRenderer):
+    """ORJSONRenderer under the FHIR media type, so Accept: application/fhir+json is not a 406"""
+    media_type = 'application/fhir+json'
+    format = 'fhir+json'
+
+
+def encode_json(data):
+    """data encoded as ORJSONRenderer renders it without indentation"""
+    return EncodedJSON(ORJSONRenderer().render(data))
@@ -1,3 +1,365 @@
-from django.test import TestCase
+import importlib.util
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+from elastic_transport import TransportError
+from elasticsearch import ApiError
+from rest_framework.test import APIRequestFactory
+
+from terminology_api.ES.es_client import es
+from terminology_api.SNOMED.ancestors import compute_ancestors
+from terminology_api.SNOMED.Cache import pt_cache
+from terminology.views.expand.expand_cache import normalize_search_text
+from terminology.views.lookup.batch import MAX_BATCH_CODES, lookup_batch_view
+from terminology.views.lookup.get import (
+    DESCRIPTION_FIELDS, DESCRIPTION_RUNTIME_MAPPINGS, lookup_cache_key, lookup_get_view
+)
+from terminology.views.validate_code import normalize_display_text
+
+
+def elasticsearch_available():
+    """Whether the configured ES_HOST answers; the ES-backed tests are skipped otherwise"""
+    try:
+        return es.ping()
+    except (ApiError, TransportError, ValueError):
+        return False
+
+
+class DescriptionRuntimeMappingTests(SimpleTestCase):
+    """The lookup runtime field against a dynamically mapped index, as the descriptions index is"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not elasticsearch_available():
+            raise unittest.SkipTest("Elasticsearch is not reachable")
+        cls.index = f"test-descriptions-{uuid.uuid4().hex}"
+        es.index(index=cls.index, id="1", document={"concept_id": "22298006", "type_id": "900000000000003001"})
+        es.index(index=cls.index, id="2", document={"concept_id": "22298006", "type_id": "900000000000013009"})
+        es.index(index=cls.index, id="3", document={"concept_id": "22298006"}, refresh=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        es.indices.delete(index=cls.index, ignore_unavailable=True)
+        super().tearDownClass()
+
+    def test_use_display_is_computed_from_type_id(self):
+        resp = es.search(index=self.index, body={
+            "query": {"term": {"concept_id": "22298006"}},
+            "runtime_mappings": DESCRIPTION_RUNTIME_MAPPINGS,
+            "fields": DESCRIPTION_FIELDS
+        })
+        use_display = {hit["_id"]: hit.get("fields", {}).get("use_display") for hit in resp["hits"]["hits"]}
+
+        self.assertEqual(use_display["1"], ["Fully specified name"])
+        self.assertEqual(use_display["2"], ["Synonym"])
+        # No type_id, nothing emitted; the view falls back to its own display
+        self.assertIsNone(use_display["3"])
+
+
+class BatchLookupTests(SimpleTestCase):
+    """CodeSystem/$lookup/batch against a mocked Elasticsearch client"""
+
+    concept = {"active": True, "effective_time": "20020131", "module_id": "900000000000207008", "preferred_term": ""}
+    fsn_hit = {
+        "_source": {
+            "active": True,
+            "type_id": "900000000000003001",
+            "term": "Myocardial infarction (disorder)",
+            "language_code": "en"
+        },
+        "fields": {"use_display": ["Fully specified name"]}
+    }
+    parent_hit = {"fields": {"destination_id.keyword": ["414545008"]}}
+    child_hit = {"fields": {"source_id.keyword": ["1755008"]}}
+
+    def post(self, data):
+        request = APIRequestFactory().post("/CodeSystem/$lookup/batch", data, format="json")
+        return lookup_batch_view(request)
+
+    def mock_es(self, found_codes, concept=None):
+        """Patch the mget and msearch of the view, the msearch answering each search by index"""
+        es_patch = mock.patch("terminology.views.lookup.batch.es")
+        msearch_patch = mock.patch("terminology.views.lookup.batch.msearch_complete")
+        mock_es = es_patch.start()
+        mock_msearch = msearch_patch.start()
+        self.addCleanup(es_patch.stop)
+        self.addCleanup(msearch_patch.stop)
+
+        mock_es.mget.side_effect = lambda index, body, _source: {"docs": [
+            {"_id": code, "found": True, "_source": concept or self.concept} if code in found_codes
+            else {"_id": code, "found": False}
+            for code in body["ids"]
+        ]}
+
+        def msearch(searches):
+            hits = []
+            for index, search in searches:
+                if index == "descriptions":
+                    hits.append([self.fsn_hit])
+                elif "destination_id.keyword" in search["docvalue_fields"]:
+                    hits.append([self.parent_hit])
+                else:
+                    hits.append([self.child_hit])
+            return hits
+        mock_msearch.side_effect = msearch
+        return mock_es, mock_msearch
+
+    def test_returns_a_batch_response_bundle_in_request_order(self):
+        self.mock_es(found_codes={"22298006"})
+
+        response = self.post({"system": "http://snomed.info/sct", "codes": ["999", "22298006"]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["resourceType"], "Bundle")
+        self.assertEqual(response.data["type"], "batch-response")
+        not_found, found = response.data["entry"]
+        self.assertEqual(not_found["response"], {"status": "404"})
+        self.assertEqual(not_found["resource"]["issue"][0]["code"], "not-found")
+        self.assertEqual(found["response"], {"status": "200"})
+
+        parameters = found["resource"]["parameter"]
+        self.assertEqual(found["resource"]["resourceType"], "Parameters")
+        self.assertIn({"name": "code", "valueString": "22298006"}, parameters)
+        self.assertIn({"name": "display", "valueString": "Myocardial infarction (disorder)"}, parameters)
+        names = [param["name"] for param in parameters]
+        self.assertIn("designation", names)
+        property_codes = [param["part"][0]["valueString"] for param in parameters if param["name"] == "property"]
+        self.assertIn("parent", property_codes)
+        self.assertIn("child", property_codes)
+
+    def test_only_sends_the_searches_the_requested_properties_need(self):
+        concept = {**self.concept, "preferred_term": "Heart attack"}
+        _, mock_msearch = self.mock_es(found_codes={"22298006", "1755008"}, concept=concept)
+
+        response = self.post({"codes": ["22298006", "1755008"], "property": ["parent"]})
+
+        self.assertEqual(response.status_code, 200)
+        searches = mock_msearch.call_args.args[0]
+        self.assertEqual([index for index, _ in searches], ["relationships", "relationships"])
+        for entry in response.data["entry"]:
+            parameters = entry["resource"]["parameter"]
+            self.assertIn({"name": "display", "valueString": "Heart attack"}, parameters)
+            self.assertNotIn("designation", [param["name"] for param in parameters])
+
+    def test_display_does_not_depend_on_the_requested_properties(self):
+        concept = {**self.concept, "preferred_term": "Heart attack"}
+        self.mock_es(found_codes={"22298006"}, concept=concept)
+
+        for data in ({"codes": ["22298006"]}, {"codes": ["22298006"], "property": ["parent"]}):
+            response = self.post(data)
+
+            parameters = response.data["entry"][0]["resource"]["parameter"]
+            self.assertIn({"name": "display", "valueString": "Heart attack"}, parameters)
+
+    def test_rejects_a_property_that_is_not_a_list(self):
+        mock_es, mock_msearch = self.mock_es(found_codes={"22298006"})
+
+        response = self.post({"codes": ["22298006"], "property": "parent"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["issue"][0]["code"], "invalid")
+        mock_es.mget.assert_not_called()
+        mock_msearch.assert_not_called()
+
+    def test_rejects_codes_that_are_not_strings(self):
+        mock_es, mock_msearch = self.mock_es(found_codes={"22298006"})
+
+        for codes in ([22298006], ["22298006", {"code": "1755008"}], [["22298006"]]):
+            response = self.post({"codes": codes})
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data["issue"][0]["code"], "invalid")
+        mock_es.mget.assert_not_called()
+        mock_msearch.assert_not_called()
+
+    def test_rejects_more_than_max_batch_codes(self):
+        mock_es, _ = self.mock_es(found_codes=set())
+
+        response = self.post({"codes": [str(code) for code in range(MAX_BATCH_CODES + 1)]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["issue"][0]["code"], "too-costly")
+        mock_es.mget.assert_not_called()
+
+    def test_accepts_max_batch_codes(self):
+        self.mock_es(found_codes=set())
+
+        response = self.post({"codes": [str(code) for code in range(MAX_BATCH_CODES)]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["entry"]), MAX_BATCH_CODES)
+
+
+class LookupCacheTests(SimpleTestCase):
+    """GET $lookup responses cached in the 'concepts' cache, against a mocked Elasticsearch client"""
+
+    concept = {"active": True, "effective_time": "20020131", "module_id": "900000000000207008", "preferred_term": "Heart attack"}
+
+    def setUp(self):
+        caches['concepts'].clear()
+        es_patch = mock.patch("terminology.views.lookup.get.es")
+        msearch_patch = mock.patch("terminology.views.lookup.get.msearch_complete")
+        self.es = es_patch.start()
+        self.msearch = msearch_patch.start()
+        self.addCleanup(es_patch.stop)
+        self.addCleanup(msearch_patch.stop)
+        self.es.get.return_value = {"found": True, "_source": self.concept}
+        self.msearch.side_effect = lambda searches: [[] for _ in searches]
+
+    def get(self, **params):
+        request = APIRequestFactory().get("/CodeSystem/$lookup", {"system": "http://snomed.info/sct", **params})
+        return lookup_get_view(request)
+
+    def test_repeated_lookup_is_served_from_the_cache(self):
+        first = self.get(code="22298006")
+        second = self.get(code="22298006")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.es.get.call_count, 1)
+        self.assertEqual(self.msearch.call_count, 1)
+
+    def test_requested_properties_are_cached_separately(self):
+        self.get(code="22298006")
+        response = self.get(code="22298006", property="parent")
+
+        self.assertEqual(self.es.get.call_count, 2)
+        self.assertNotIn("designation", [param["name"] for param in response.data["parameter"]])
+
+    def test_cache_key_ignores_property_order_and_follows_the_index_version(self):
+        key = lookup_cache_key("22298006", {"parent", "child"})
+
+        self.assertEqual(key, lookup_cache_key("22298006", {"child", "parent"}))
+        self.assertNotEqual(key, lookup_cache_key("22298006", {"parent"}))
+        with override_settings(TERMINOLOGY_INDEX_VERSION="next"):
+            self.assertNotEqual(key, lookup_cache_key("22298006", {"parent", "child"}))
+
+    def test_unknown_codes_and_errors_are_not_cached(self):
+        self.es.get.return_value = {"found": False}
+        self.assertEqual(self.get(code="999").status_code, 404)
+        self.es.get.side_effect = ApiError("unavailable", mock.Mock(status=503), None)
+        self.assertEqual(self.get(code="22298006").status_code, 500)
+
+        self.es.get.side_effect = None
+        self.es.get.return_value = {"found": True, "_source": self.concept}
+        self.assertEqual(self.get(code="999").status_code, 200)
+        self.assertEqual(self.get(code="22298006").status_code, 200)
+        self.assertEqual(self.es.get.call_count, 4)
+
+
+class ComputeAncestorsTests(SimpleTestCase):
+    """Transitive IS-A closure backfilled onto concept and description docs"""
+
+    def test_closure_follows_every_parent(self):
+        parents = {"4": {"2", "3"}, "2": {"1"}, "3": {"1"}, "1": {"138875005"}}
+
+        ancestors = compute_ancestors(parents)
+
+        self.assertEqual(ancestors["4"], {"1", "2", "3", "138875005"})
+        self.assertEqual(ancestors["2"], {"1", "138875005"})
+        self.assertEqual(ancestors["138875005"], set())
+
+    def test_deep_hierarchy_does_not_recurse(self):
+        depth = 5000
+        parents = {str(level): {str(level - 1)} for level in range(1, depth)}
+
+        ancestors = compute_ancestors(parents)
+
+        self.assertEqual(len(ancestors[str(depth - 1)]), depth - 1)
+
+
+class NormalizeDisplayTextTests(SimpleTestCase):
+    """Display comparison in $validate-code"""
+
+    def test_folds_case_diacritics_punctuation_and_whitespace(self):
+        self.assertEqual(normalize_display_text("  Ménière's   disease (Disorder) "), "meniere's disease disorder")
+        self.assertEqual(normalize_display_text("Heart-attack,acute"), "heart attack acute")
+
+    def test_ascii_text_is_left_as_is_apart_from_case(self):
+        self.assertEqual(normalize_display_text("Myocardial infarction"), "myocardial infarction")
+
+
+@unittest.skipUnless(importlib.util.find_spec("pandas"), "pandas is not installed")
+class ConceptsIndexRebuildTests(SimpleTestCase):
+    """The concepts index is recreated when its mappings or sort predate CONCEPTS_MAPPINGS/CONCEPTS_SETTINGS"""
+
+    def setUp(self):
+        from terminology_api.SNOMED import indexer
+        self.indexer = indexer
+        es_patch = mock.patch.object(indexer, "es")
+        self.es = es_patch.start()
+        self.addCleanup(es_patch.stop)
+
+    def mock_index(self, properties, sort_settings):
+        self.es.indices.get_mapping.return_value = {"concepts-v1": {"mappings": {"properties": properties}}}
+        self.es.indices.get_settings.return_value = {"concepts-v1": {"settings": sort_settings}}
+
+    def test_current_index_is_kept(self):
+        self.mock_index(
+            {"concept_id": {"type": "long"}, "ancestors": {"type": "keyword"}},
+            {"index.sort.field": "concept_id", "index.sort.order": "asc"}
+        )
+        self.assertFalse(self.indexer.concepts_index_outdated())
+
+    def test_dynamically_mapped_concept_id_is_outdated(self):
+        self.mock_index(
+            {"concept_id": {"type": "text"}, "ancestors": {"type": "keyword"}},
+            {"index.sort.field": "concept_id", "index.sort.order": "asc"}
+        )
+        self.assertTrue(self.indexer.concepts_index_outdated())
+
+    def test_unsorted_index_is_outdated(self):
+        self.mock_index({"concept_id": {"type": "long"}, "ancestors": {"type": "keyword"}}, {})
+        self.assertTrue(self.indexer.concepts_index_outdated())
+
+    def test_outdated_index_is_recreated_before_indexing(self):
+        self.es.indices.exists.side_effect = [True, False]
+        reader = mock.Mock(concepts={})
+        with mock.patch.object(self.indexer, "concepts_index_outdated", return_value=True), \
+                mock.patch.object(self.indexer, "build_preferred_terms", return_value={}), \
+                mock.patch.object(self.indexer, "parallel_index") as parallel_index:
+            self.indexer.index_concepts(reader, ancestors={})
+
+        self.es.indices.delete.assert_called_once_with(index="concepts")
+        self.es.indices.create.assert_called_once_with(
+            index="concepts", settings=self.indexer.CONCEPTS_SETTINGS, mappings=self.indexer.CONCEPTS_MAPPINGS
+        )
+        parallel_index.assert_called_once_with([])
+
+
+
+class CachedDescendantsTests(SimpleTestCase):
+    """Descendant walks memoized per root while the pt column is built"""
+
+    def setUp(self):
+        pt_cache.cached_descendants.cache_clear()
+        self.addCleanup(pt_cache.cached_descendants.cache_clear)
+
+    def test_finished_walks_are_memoized(self):
+        with mock.patch.object(pt_cache, "find_descendants_batch", return_value={"1755008"}) as find_descendants_batch:
+            self.assertEqual(pt_cache.cached_descendants("22298006"), frozenset({"1755008"}))
+            self.assertEqual(pt_cache.cached_descendants("22298006"), frozenset({"1755008"}))
+
+        find_descendants_batch.assert_called_once_with("22298006")
+
+    def test_failed_walks_are_not_memoized(self):
+        error = ApiError("unavailable", mock.Mock(status=503), None)
+        with mock.patch.object(pt_cache, "index_has_field", return_value=False), \
+                mock.patch.object(pt_cache, "iter_hits", side_effect=error), \
+                self.assertLogs(pt_cache.logger, "ERROR"), self.assertRaises(ApiError):
+            pt_cache.cached_descendants("22298006")
+
+        with mock.patch.object(pt_cache, "find_descendants_batch", return_value={"1755008"}):
+            self.assertEqual(pt_cache.cached_descendants("22298006"), frozenset({"1755008"}))
+
+
+class ExpandTextTests(SimpleTestCase):
+    """Filter text normalization of $expand"""
+
+    def test_normalize_search_text(self):
+        self.assertEqual(normalize_search_text("  Café   au\tLAIT "), "cafe au lait")
+        self.assertEqual(normalize_search_text("Heart attack"), "heart attack")
@@ -1,15 +1,54 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from terminology_api.ES.es_client import es
+from terminology_api.ES.mappings import index_has_field
+from terminology_api.ES.pagination import iter_hits
 from terminology_api.LOINC.query_engine import LoincQueryEngine
-from datetime import datetime
+from terminology_api.text import STRIP_MARKS_TABLE, WHITESPACE_RE
+from collections import defaultdict
+from functools import lru_cache
+import heapq
+import time
 import uuid
 import logging
-import re
 import unicodedata
 
+try:
+    import numpy as np
+except ImportError:  # scoring falls back to the per-hit Python loop
+    np = None
+
 logger = logging.getLogger(__name__)
 
+# Fixed parts of every expansion response, shared rather than rebuilt per request
+SNOMED_COPYRIGHT = "This value set includes content from SNOMED CT, which is copyright © 2002+ International Health Terminology Standards Development Organisation (SNOMED International), and distributed by agreement between SNOMED International and HL7. Implementer use of SNOMED CT is not covered by this agreement."
+SNOMED_VERSION_PARAMETER = {
+    "name": "version",
+    "valueUri": "http://snomed.info/sct|http://snomed.info/sct/900000000000207008/version/20240731"
+}
+
+# Doc values read from scored filter hits, their _source is never loaded
+SCORED_DESCRIPTION_FIELDS = ["concept_id.keyword", "type_id.keyword", "term.keyword"]
+
+# Parts of a descriptions search response that are read, ES drops the rest before sending it
+DESCRIPTION_FILTER_PATH = "hits.total,hits.hits._id,hits.hits._source"
+
+# Hit count above which filtered scoring is done with NumPy arrays
+VECTORIZE_MIN_HITS = 2000
+
+# Elasticsearch index.max_result_window, the deepest page reachable with from/size
+MAX_RESULT_WINDOW = 10000
+
+# Descriptions fetched per concept up front, concepts with more are paged in
+DESCRIPTIONS_PER_CONCEPT = 5
+
+# Counts every matching concept on the scoring search itself, not just the ones in the returned hits
+MATCHING_CONCEPTS_AGGS = {
+    "matching_concepts": {
+        "cardinality": {"field": "concept_id.keyword", "precision_threshold": 40000}
+    }
+}
+
 @api_view(['POST'])
 def expand_view(request):
     """
@@ -44,7 +83,7 @@ def expand_view(request):
         if display_language in ['en-gb', 'en-us']:
             display_language = 'en'
         
-        print(f"Expand request - ValueSet: {valueset_id}, Language: {display_language}, Count: {count}, Filter: '{filter_text}'")
+        logger.debug("Expand request - ValueSet: %s, Language: %s, Count: %s, Filter: '%s'", valueset_id, display_language, count, filter_text)
         
         
         # Validate required parameters
@@ -76,7 +115,7 @@ def expand_view(request):
         return Response(response)
         
     except Exception as e:
-        logger.error(f"ValueSet expand error: {str(e)}", exc_info=True)
+        logger.error("ValueSet expand error: %s", e, exc_info=True)
         return Response({
             "resourceType": "OperationOutcome",
             "issue": [{
@@ -95,7 +134,7 @@ def get_valueset_expansion(valueset_id, display_language, include_designations,
         all_concept_ids = get_all_concepts_in_valueset(valueset_id, display_language)
         total_count = len(all_concept_ids)
         
-        print(f"Found {total_count} unique concepts in valueset {valueset_id}")
+        logger.debug("Found %d unique concepts in valueset %s", total_count, valueset_id)
         
         # Apply pagination
         paginated_concept_ids = all_concept_ids[offset:offset + count]
@@ -108,7 +147,7 @@ def get_valueset_expansion(valueset_id, display_language, include_designations,
         return expansion_contains, total_count
         
     except Exception as e:
-        logger.error(f"Error getting valueset expansion: {str(e)}")
+        logger.error("Error getting valueset expansion: %s", e, exc_info=True)
         return [], 0
 
 def get_all_concepts_in_valueset(valueset_id, display_language):
@@ -123,7 +162,7 @@ def get_all_concepts_in_valueset(valueset_id, display_language):
         query = {
             "query": {
                 "bool": {
-                    "must": [
+                    "filter": [
                         {"term": {"valuesets": valueset_id}},
                         {"term": {"active": True}},
                         {"term": {"language_code": display_language}}
@@ -189,30 +228,25 @@ def get_filtered_valueset_expansion(valueset_id, filter_text, display_language,
         
         # Build query with text filtering
         query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"valuesets": valueset_id}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}}
-                    ],
-                    "should": [
-                        # Exact phrase (highest priority)
-                        {"match_phrase": {"term": {"query": normalized_filter, "boost": 10}}},
-                        # Prefix match
-                        {"prefix": {"term": {"value": normalized_filter, "boost": 5}}},
-                    ],
-                    "minimum_should_match": 1
-                }
-            },
-            "_source": ["concept_id", "type_id", "term", "language_code", "pt"],
+            "query": build_filter_query([
+                {"term": {"valuesets": valueset_id}},
+                {"term": {"active": True}},
+                {"term": {"language_code": display_language}}
+            ], normalized_filter),
+            "_source": False,
+            "docvalue_fields": SCORED_DESCRIPTION_FIELDS,
             "size": 10000,  # Get all matching descriptions
+            "aggs": MATCHING_CONCEPTS_AGGS,
+            # Nothing reads hits.total, the count comes from the scored hits or the agg
+            "track_total_hits": False,
             "sort": [
                 {"_score": {"order": "desc"}},
                 {"term.keyword": {"order": "asc"}}
             ]
         }
         
+        collapse_to_top_concepts(query, count, offset)
+        
         # Execute search
         resp = es.search(
             index="descriptions",
@@ -220,62 +254,234 @@ def get_filtered_valueset_expansion(valueset_id, filter_text, display_language,
             timeout='30s'
         )
         
-        # Process results and group by concept
-        concept_descriptions = {}
-        for hit in resp["hits"]["hits"]:
-            source = hit["_source"]
-            concept_id = source["concept_id"]
-            score = hit["_score"]
-            
-            # Calculate additional scoring
-            additional_score = calculate_additional_score(
-                source["term"], normalized_filter, source["type_id"]
-            )
-            final_score = score + additional_score
-            
-            # Group by concept and keep best scoring description
-            if concept_id not in concept_descriptions:
-                concept_descriptions[concept_id] = []
-            
-            concept_descriptions[concept_id].append({
-                "description": source,
-                "score": final_score
-            })
-        
-        # Sort concepts by their best description score
-        concept_scores = {}
-        for concept_id, descriptions in concept_descriptions.items():
-            best_desc = max(descriptions, key=lambda x: x["score"])
-            concept_scores[concept_id] = {
-                "concept_id": concept_id,
-                "score": best_desc["score"],
-                "best_term": best_desc["description"]["term"]
-            }
-        
-        # Sort by score then alphabetically
-        sorted_concepts = sorted(
-            concept_scores.values(),
-            key=lambda x: (-x["score"], x["best_term"].lower())
-        )
-        
-        total_count = len(sorted_concepts)
-        
-        # Apply pagination
-        paginated_concepts = sorted_concepts[offset:offset + count]
-        concept_ids_for_details = [c["concept_id"] for c in paginated_concepts]
+        # Keep only the best scoring description per concept
+        best_scores = collect_best_scores(resp["hits"]["hits"], normalized_filter, {})
         
-        # Get detailed descriptions for paginated concepts
+        # Select the page first, then fetch its details in a single batched call
+        page_concept_ids, scored_count = paginate_scored_concepts(best_scores, count, offset)
+        total_count = count_matching_concepts(resp, scored_count, query["size"])
         expansion_contains = get_concepts_details_for_valueset(
-            concept_ids_for_details, valueset_id, display_language, include_designations
+            page_concept_ids, valueset_id, display_language, include_designations
         )
         
-        print(f"Found {total_count} matching concepts for filter '{filter_text}'")
+        logger.debug("Found %d matching concepts for filter '%s'", total_count, filter_text)
         return expansion_contains, total_count
         
     except Exception as e:
-        logger.error(f"Error getting filtered valueset expansion: {str(e)}")
+        logger.error("Error getting filtered valueset expansion: %s", e, exc_info=True)
         return [], 0
 
+def collapse_to_top_concepts(query, count, offset):
+    """
+    When ES scores the filter itself, collapse a filter search on concept_id
+    so the top offset + count concepts come back with their best description
+    each, rather than a full window of descriptions folded per concept here.
+    Pages past the result window keep the uncollapsed search.
+    """
+    if analyzed_term_fields() and offset + count <= MAX_RESULT_WINDOW:
+        query["collapse"] = {"field": "concept_id.keyword"}
+        query["size"] = offset + count
+    return query
+
+def analyzed_term_fields():
+    """Whether descriptions were indexed with the folded/prefix/exact term subfields"""
+    return index_has_field("descriptions", "term.folded")
+
+def starts_with_field():
+    """
+    Field for the whole-term starts-with clause. term.starts indexes every
+    leading prefix, so the clause is a single term lookup instead of a scan
+    over the keyword terms dictionary.
+    """
+    return "term.starts" if index_has_field("descriptions", "term.starts") else "term.exact"
+
+def build_filter_query(filters, filter_text):
+    """
+    Bool query for a text filter over descriptions. The static clauses in
+    filters run in filter context, unscored and cacheable. With the analyzed term
+    subfields ES does the case/diacritic folding and applies the exact,
+    starts-with, whole-word and synonym/FSN bonuses as boosts; older indices get
+    the phrase/prefix clauses and are re-scored in Python.
+    """
+    if not analyzed_term_fields():
+        return {
+            "bool": {
+                "filter": filters,
+                "should": [
+                    # Exact phrase (highest priority)
+                    {"match_phrase": {"term": {"query": filter_text, "boost": 10}}},
+                    # Prefix match
+                    {"prefix": {"term": {"value": filter_text, "boost": 5}}},
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    
+    return {
+        "bool": {
+            "filter": filters,
+            "must": [{
+                "bool": {
+                    "should": [
+                        # Whole term equal / starting with the filter
+                        {"constant_score": {"filter": {"term": {"term.exact": filter_text}}, "boost": 50}},
+                        {"constant_score": {"filter": {"prefix": {starts_with_field(): filter_text}}, "boost": 30}},
+                        # Every filter word is a prefix of some term word, whole-word hits score higher
+                        {"multi_match": {
+                            "query": filter_text,
+                            "type": "most_fields",
+                            "fields": ["term.folded^4", "term.prefix"],
+                            "operator": "and",
+                            "boost": 5
+                        }}
+                    ],
+                    "minimum_should_match": 1
+                }
+            }],
+            "should": [
+                # Prefer synonyms over FSNs
+                {"constant_score": {"filter": {"term": {"type_id": "900000000000013009"}}, "boost": 10}},
+                {"constant_score": {"filter": {"term": {"type_id": "900000000000003001"}}, "boost": 5}}
+            ]
+        }
+    }
+
+def paginate_scored_concepts(best_scores, count, offset):
+    """
+    Order concepts by best score then term and return (page_concept_ids, total_count).
+    Only the first offset + count concepts are ordered, on precomputed tuple keys
+    where the insertion index keeps ties in their original order.
+    """
+    ranked = heapq.nsmallest(offset + count, (
+        (-score, term.lower(), i, concept_id)
+        for i, (concept_id, (score, term)) in enumerate(best_scores.items())
+    ))
+    page_concept_ids = [concept_id for _, _, _, concept_id in ranked[offset:]]
+    return page_concept_ids, len(best_scores)
+
+def count_matching_concepts(resp, scored_count, window_size):
+    """
+    Total matching concepts. A search that returned fewer than window_size
+    hits had every match scored, so scored_count is exact; past that the
+    approximate cardinality agg is used, never less than what was scored.
+    """
+    if len(resp["hits"]["hits"]) < window_size:
+        return scored_count
+    matching = resp.get("aggregations", {}).get("matching_concepts", {}).get("value", 0)
+    return max(matching, scored_count)
+
+def collect_best_scores(hits, normalized_filter, best_scores):
+    """
+    Fold description hits into {concept_id: (score, best_term)}, keeping only
+    the best scoring description per concept instead of every description
+    """
+    # Analyzed term subfields already apply the additional scoring as ES boosts
+    rescore = not analyzed_term_fields()
+    
+    if rescore and np is not None and len(hits) >= VECTORIZE_MIN_HITS:
+        return collect_best_scores_vectorized(hits, normalized_filter, best_scores)
+    
+    if not rescore:
+        # Hits arrive in final score order, a concept's first hit is its best
+        for hit in hits:
+            concept_id, _, term = scored_description(hit)
+            if concept_id not in best_scores:
+                best_scores[concept_id] = (hit["_score"], term)
+        return best_scores
+    
+    additional_score = additional_scorer(normalized_filter)
+    for hit in hits:
+        concept_id, type_id, term = scored_description(hit)
+        
+        # Calculate additional scoring
+        final_score = hit["_score"] + additional_score(term, type_id)
+        
+        best = best_scores.get(concept_id)
+        if best is None or final_score > best[0]:
+            best_scores[concept_id] = (final_score, term)
+    
+    return best_scores
+
+def scored_description(hit):
+    """(concept_id, type_id, term) of a filter search hit, from its doc values"""
+    fields = hit["fields"]
+    return fields["concept_id.keyword"][0], fields["type_id.keyword"][0], fields["term.keyword"][0]
+
+def collect_best_scores_vectorized(hits, normalized_filter, best_scores):
+    """
+    NumPy version of collect_best_scores for wide result sets: the
+    calculate_additional_score bonuses are computed over whole term arrays
+    """
+    concept_ids, type_ids, terms = (np.array(column) for column in zip(*map(scored_description, hits)))
+    scores = np.array([hit["_score"] or 0.0 for hit in hits], dtype=float)
+    
+    final_scores = scores + calculate_additional_scores_batch(terms, type_ids, normalized_filter)
+    
+    # Best description per concept: first occurrence after a stable sort on score
+    order = np.argsort(-final_scores, kind="stable")
+    _, first = np.unique(concept_ids[order], return_index=True)
+    
+    # Converted back to Python values in bulk rather than one NumPy scalar at a time
+    picked = order[first]
+    picked_ids = concept_ids[picked].tolist()
+    picked_best = zip(final_scores[picked].tolist(), terms[picked].tolist())
+    
+    if not best_scores:
+        best_scores.update(zip(picked_ids, picked_best))
+        return best_scores
+    
+    for concept_id, candidate in zip(picked_ids, picked_best):
+        best = best_scores.get(concept_id)
+        if best is None or candidate[0] > best[0]:
+            best_scores[concept_id] = candidate
+    
+    return best_scores
+
+def search_concept_descriptions(concept_ids, display_language, source):
+    """
+    Active descriptions of the given concepts in display_language, English
+    when a concept has none. Sized for the usual handful of descriptions per
+    concept; when that truncates, the full set is paged in with search_after.
+    """
+    query = {
+        "bool": {
+            "filter": [
+                {"terms": {"concept_id": concept_ids}},
+                {"term": {"active": True}},
+                {"terms": {"language_code": list(dict.fromkeys([display_language, "en"]))}}
+            ]
+        }
+    }
+    
+    resp = es.search(
+        index="descriptions",
+        body={
+            "query": query,
+            "_source": source,
+            "size": min(len(concept_ids) * DESCRIPTIONS_PER_CONCEPT, MAX_RESULT_WINDOW),
+            "track_total_hits": True
+        },
+        filter_path=DESCRIPTION_FILTER_PATH,
+        timeout='30s'
+    )
+    
+    # filter_path leaves out hits.hits altogether when nothing matched
+    hits = resp["hits"].get("hits", [])
+    if resp["hits"]["total"]["value"] > len(hits):
+        hits = list(iter_hits("descriptions", query, source=source))
+    return prefer_display_language(hits, display_language)
+
+def prefer_display_language(hits, display_language):
+    """Drop the English fallback hits of concepts that have descriptions in display_language"""
+    if display_language == "en":
+        return hits
+    
+    covered = {hit["_source"]["concept_id"] for hit in hits if hit["_source"].get("language_code") == display_language}
+    return [
+        hit for hit in hits
+        if hit["_source"].get("language_code") == display_language or hit["_source"]["concept_id"] not in covered
+    ]
+
 def get_concepts_details_for_valueset(concept_ids, valueset_id, display_language, include_designations):
     """
     Get detailed concept information for specific concepts in a valueset
@@ -285,59 +491,30 @@ def get_concepts_details_for_valueset(concept_ids, valueset_id, display_language
     
     try:
         # Query descriptions for the specific concepts in the valueset
-        query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"concept_id": concept_ids}},
-                        {"term": {"active": True}},
-                        {"term": {"language_code": display_language}}
-                    ]
-                }
-            },
-            "_source": ["concept_id", "type_id", "term", "language_code", "pt"],
-            "size": len(concept_ids) * 20,  # Allow multiple descriptions per concept
-            # "sort": [
-            #     {"concept_id.keyword": {"order": "asc"}},
-            #     {"pt": {"order": "desc"}},  # Preferred terms first
-            #     {"type_id.keyword": {"order": "asc"}}  # Then by type
-            # ]
-        }
-        
-        resp = es.search(
-            index="descriptions",
-            body=query,
-            timeout='30s'
+        hits = search_concept_descriptions(
+            concept_ids, display_language, ["concept_id", "type_id", "term", "language_code", "pt"]
         )
         
         # Group descriptions by concept
-        descriptions_by_concept = {}
-        for hit in resp["hits"]["hits"]:
+        descriptions_by_concept = defaultdict(list)
+        for hit in hits:
             source = hit["_source"]
-            concept_id = source["concept_id"]
-            
-            if concept_id not in descriptions_by_concept:
-                descriptions_by_concept[concept_id] = []
-            
-            descriptions_by_concept[concept_id].append(source)
+            descriptions_by_concept[source["concept_id"]].append(source)
         
         # Build concept entries
         expansion_contains = []
+        append = expansion_contains.append
+        get_descriptions = descriptions_by_concept.get
         for concept_id in concept_ids:
-            descriptions = descriptions_by_concept.get(concept_id, [])
-            
-            concept_entry = build_concept_entry_from_descriptions(
-                concept_id, descriptions, include_designations
-            )
-            
-            if concept_entry:
-                expansion_contains.append(concept_entry)
+            append(build_concept_entry_from_descriptions(
+                concept_id, get_descriptions(concept_id, []), include_designations
+            ))
         
-        print(f"Built {len(expansion_contains)} concept entries")
+        logger.debug("Built %d concept entries", len(expansion_contains))
         return expansion_contains
         
     except Exception as e:
-        logger.error(f"Error getting concept details: {str(e)}")
+        logger.error("Error getting concept details: %s", e, exc_info=True)
         return []
 
 def build_concept_entry_from_descriptions(concept_id, descriptions, include_designations):
@@ -417,6 +594,7 @@ def build_concept_entry_from_descriptions(concept_id, descriptions, include_desi
     
     return concept_entry
 
+@lru_cache(maxsize=4096)
 def normalize_search_text(text):
     """
     Normalize search text similar to Snowstorm's approach
@@ -424,12 +602,13 @@ def normalize_search_text(text):
     # Convert to lowercase
     text = text.lower()
     
-    # Remove diacritics
-    text = unicodedata.normalize('NFD', text)
-    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    # Remove diacritics, plain ASCII has none to strip
+    if not text.isascii():
+        text = unicodedata.normalize('NFD', text)
+        text = text.translate(STRIP_MARKS_TABLE)
     
     # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = WHITESPACE_RE.sub(' ', text.strip())
     
     return text
 
@@ -437,55 +616,89 @@ def calculate_additional_score(term, filter_text, type_id):
     """
     Calculate additional scoring factors similar to Snowstorm
     """
-    additional_score = 0
-    term_lower = term.lower()
+    return additional_scorer(filter_text)(term, type_id)
+
+# Bonus by description type, preferring synonyms over FSNs
+TYPE_BONUS = {
+    "900000000000013009": 10,  # Synonym
+    "900000000000003001": 5,  # FSN
+}
+
+def calculate_additional_scores_batch(terms, type_ids, filter_text):
+    """
+    calculate_additional_score over NumPy arrays of terms and type ids at
+    once, the string compares running in numpy.char instead of per hit
+    """
+    terms_lower = np.char.lower(terms)
     filter_lower = filter_text.lower()
     
-    # Exact match bonus
-    if term_lower == filter_lower:
-        additional_score += 50
-    
-    # Starts with bonus
-    elif term_lower.startswith(filter_lower):
-        additional_score += 30
-    
-    # Word boundary match bonus
-    elif f" {filter_lower}" in term_lower or term_lower.startswith(filter_lower):
-        additional_score += 20
+    # Exact match, starts with, then word boundary match bonus
+    exact = terms_lower == filter_lower
+    starts = np.char.startswith(terms_lower, filter_lower)
+    word = np.char.find(terms_lower, f" {filter_lower}") >= 0
+    additional = np.select([exact, starts, word], [50, 30, 20], default=0)
     
-    # Prefer synonyms over FSNs
-    if type_id == "900000000000013009":  # Synonym
-        additional_score += 10
-    elif type_id == "900000000000003001":  # FSN
-        additional_score += 5
+    for type_id, bonus in TYPE_BONUS.items():
+        additional += np.where(type_ids == type_id, bonus, 0)
     
     # Length penalty for very long terms
-    if len(term) > 100:
-        additional_score -= 5
+    additional -= np.where(np.char.str_len(terms) > 100, 5, 0)
+    return additional
+
+@lru_cache(maxsize=256)
+def additional_scorer(filter_text):
+    """
+    calculate_additional_score bound to one filter. The filter is lowercased
+    once per search instead of once per hit, leaving a lower() and a few
+    string compares in the per-hit call.
+    """
+    filter_lower = filter_text.lower()
+    word_start = f" {filter_lower}"
+    type_bonus = TYPE_BONUS.get
     
-    return additional_score
+    def score(term, type_id):
+        term_lower = term.lower()
+        
+        # Exact match, starts with, then word boundary match bonus
+        if term_lower == filter_lower:
+            additional_score = 50
+        elif term_lower.startswith(filter_lower):
+            additional_score = 30
+        elif word_start in term_lower:
+            additional_score = 20
+        else:
+            additional_score = 0
+        
+        additional_score += type_bonus(type_id, 0)
+        
+        # Length penalty for very long terms
+        if len(term) > 100:
+            additional_score -= 5
+        
+        return additional_score
+    
+    return score
 
 def build_expansion_response(expansion_contains, total_count, offset, display_language):
     """
     Build the final expansion response
     """
-    expansion_id = str(uuid.uuid4())
-    timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    # One uuid4 split into the resource and expansion ids
+    response_uuid = uuid.uuid4().hex
+    expansion_id = response_uuid[16:]
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
     
     response = {
         "resourceType": "ValueSet",
-        "id": str(uuid.uuid4()),
-        "copyright": "This value set includes content from SNOMED CT, which is copyright © 2002+ International Health Terminology Standards Development Organisation (SNOMED International), and distributed by agreement between SNOMED International and HL7. Implementer use of SNOMED CT is not covered by this agreement.",
+        "id": response_uuid[:16],
+        "copyright": SNOMED_COPYRIGHT,
         "expansion": {
             "id": expansion_id,
             "timestamp": timestamp,
             "total": total_count,
             "offset": offset,
             "parameter": [
-                {
-                    "name": "version",
-                    "valueUri": "http://snomed.info/sct|http://snomed.info/sct/900000000000207008/version/20240731"
-                },
+                SNOMED_VERSION_PARAMETER,
                 {
                     "name": "displayLanguage",
                     "valueString": display_language
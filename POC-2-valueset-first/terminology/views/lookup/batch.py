@@ -0,0 +1,144 @@
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from terminology_api.ES.es_client import es
+from .get import build_lookup_response, lookup_searches, msearch_complete, CONCEPT_SOURCE
+
+# Upper bound on codes per batch so a single msearch stays reasonably sized
+MAX_BATCH_CODES = 100
+
+@api_view(['POST'])
+def lookup_batch_view(request):
+    """
+    Batch FHIR CodeSystem $lookup for SNOMED CT concepts.
+    Resolves many codes with one mget for concepts and one msearch for their
+    descriptions and parent/child relationships, returning a batch-response Bundle.
+    """
+    data = request.data
+    system = data.get("system", "http://snomed.info/sct")
+    codes = data.get("codes", [])
+    properties = data.get("property", [])
+
+    if not isinstance(properties, list) or not all(isinstance(prop, str) for prop in properties):
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "error",
+                "code": "invalid",
+                "details": {"text": "Parameter property must be a list of property codes"}
+            }]
+        }, status=400)
+
+    # Optional FHIR "property" codes restrict which properties/designations are returned
+    requested_properties = set(properties)
+    include_designations = not requested_properties or "designation" in requested_properties
+    include_parents = not requested_properties or "parent" in requested_properties
+    include_children = not requested_properties or "child" in requested_properties
+
+    if not codes or not isinstance(codes, list):
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "error",
+                "code": "required",
+                "details": {"text": "Missing required parameter: codes"}
+            }]
+        }, status=400)
+
+    if not all(isinstance(code, str) for code in codes):
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "error",
+                "code": "invalid",
+                "details": {"text": "Parameter codes must be a list of code strings"}
+            }]
+        }, status=400)
+
+    if len(codes) > MAX_BATCH_CODES:
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "error",
+                "code": "too-costly",
+                "details": {"text": f"A batch may contain at most {MAX_BATCH_CODES} codes"}
+            }]
+        }, status=400)
+
+    if system != "http://snomed.info/sct":
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "error",
+                "code": "not-supported",
+                "details": {"text": f"System {system} is not supported"}
+            }]
+        }, status=400)
+
+    try:
+        concepts_resp = es.mget(index="concepts", body={"ids": codes}, _source=CONCEPT_SOURCE)
+        concepts = {
+            doc["_id"]: doc["_source"]
+            for doc in concepts_resp["docs"]
+            if doc.get("found", False)
+        }
+        found_codes = [code for code in codes if code in concepts]
+
+        # Only the searches the requested properties need, for every found code, all in one msearch;
+        # display-only lookups use the preferred term denormalized at index time when there is one
+        code_searches = [
+            lookup_searches(
+                code,
+                include_designations or not concepts[code].get("preferred_term"),
+                include_parents,
+                include_children
+            )
+            for code in found_codes
+        ]
+        hits = iter(msearch_complete([search for searches in code_searches for search in searches.values()]))
+
+        results = {}
+        for code, searches in zip(found_codes, code_searches):
+            code_hits = {name: next(hits) for name in searches}
+            descriptions = code_hits.get("descriptions", [])
+            parents = [r['fields']['destination_id.keyword'][0] for r in code_hits.get("parents", [])]
+            children = [r['fields']['source_id.keyword'][0] for r in code_hits.get("children", [])]
+            
+            results[code] = build_lookup_response(
+                code, system, concepts[code], descriptions, parents, children, requested_properties
+            )
+
+        entries = []
+        for code in codes:
+            if code in results:
+                entries.append({
+                    "resource": results[code],
+                    "response": {"status": "200"}
+                })
+            else:
+                entries.append({
+                    "resource": {
+                        "resourceType": "OperationOutcome",
+                        "issue": [{
+                            "severity": "error",
+                            "code": "not-found",
+                            "details": {"text": f"Code {code} not found in system {system}"}
+                        }]
+                    },
+                    "response": {"status": "404"}
+                })
+
+        return Response({
+            "resourceType": "Bundle",
+            "type": "batch-response",
+            "entry": entries
+        })
+
+    except Exception as e:
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "error",
+                "code": "exception",
+                "details": {"text": f"Internal server error: {str(e)}"}
+            }]
+        }, status=500)
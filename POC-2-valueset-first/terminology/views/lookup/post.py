@@ -1,6 +1,8 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from terminology_api.ES.es_client import es
+from terminology_api.ES.executor import search_executor
+from .get import msearch_complete, CONCEPT_SOURCE
 import json
 
 @api_view(['POST'])
@@ -69,8 +71,41 @@ def lookup_post_view(request):
                 }]
             }, status=400)
         
-        # Get concept
-        concept_resp = es.get(index="concepts", id=code, ignore=[404])
+        # The concept GET runs alongside one msearch for the descriptions, parents and children
+        searches = [
+            ("descriptions", {
+                "query": {"bool": {"filter": [
+                    {"term": {"concept_id": code}},
+                    {"term": {"active": True}}
+                ]}},
+                "_source": ["id", "description_id", "type_id", "term", "language_code"],
+                "size": 1000
+            }),
+            ("relationships", {
+                "query": {"bool": {"filter": [
+                    {"term": {"source_id": code}},
+                    {"term": {"type_id": "116680003"}},  # IS-A relationship
+                    {"term": {"active": True}}
+                ]}},
+                "_source": False,
+                "docvalue_fields": ["destination_id.keyword"],
+                "size": 1000
+            }),
+            ("relationships", {
+                "query": {"bool": {"filter": [
+                    {"term": {"destination_id": code}},
+                    {"term": {"type_id": "116680003"}},  # IS-A relationship
+                    {"term": {"active": True}}
+                ]}},
+                "_source": False,
+                "docvalue_fields": ["source_id.keyword"],
+                "size": 1000
+            })
+        ]
+        concept_future = search_executor.submit(es.get, index="concepts", id=code, _source=CONCEPT_SOURCE, ignore=[404])
+        descriptions, parent_hits, child_hits = msearch_complete(searches)
+        concept_resp = concept_future.result()
+        
         if not concept_resp.get("found", False):
             return Response({
                 "resourceType": "OperationOutcome",
@@ -82,17 +117,8 @@ def lookup_post_view(request):
             }, status=404)
         
         concept = concept_resp['_source']
-        
-        # Get descriptions
-        descriptions_resp = es.search(
-            index="descriptions", 
-            body={"query": {"bool": {"must": [
-                {"term": {"concept_id": code}},
-                {"term": {"active": True}}
-            ]}}}, 
-            size=1000
-        )
-        descriptions = descriptions_resp["hits"]["hits"]
+        parents = [r['fields']['destination_id.keyword'][0] for r in parent_hits]
+        children = [r['fields']['source_id.keyword'][0] for r in child_hits]
         
         # Get language reference set members for acceptability
         desc_ids = []
@@ -105,46 +131,22 @@ def lookup_post_view(request):
         lang_refset_members = {}
         if desc_ids:
             try:
-                lang_refset_resp = es.search(
-                    index="language_refset_members",
-                    body={"query": {"bool": {"must": [
+                lang_refset_hits, = msearch_complete([("language_refset_members", {
+                    "query": {"bool": {"filter": [
                         {"terms": {"referenced_component_id": desc_ids}},
                         {"term": {"active": True}}
-                    ]}}},
-                    size=1000,
-                    ignore=[404]
-                )
-                lang_refset_members = {m["_source"]["referenced_component_id"]: m["_source"] for m in lang_refset_resp.get("hits", {}).get("hits", [])}
+                    ]}},
+                    "_source": ["referenced_component_id", "acceptability_id"],
+                    "size": 1000
+                })])
+                lang_refset_members = {m["_source"]["referenced_component_id"]: m["_source"] for m in lang_refset_hits}
             except Exception:
                 # If language refset index doesn't exist, continue without it
                 pass
         
-        # Get relationships (parents)
-        relationships_resp = es.search(
-            index="relationships",
-            body={"query": {"bool": {"must": [
-                {"term": {"source_id": code}},
-                {"term": {"type_id": "116680003"}},  # IS-A relationship
-                {"term": {"active": True}}
-            ]}}},
-            size=1000
-        )
-        parents = [r['_source']['destination_id'] for r in relationships_resp["hits"]["hits"]]
-        
-        # Get children
-        children_resp = es.search(
-            index="relationships",
-            body={"query": {"bool": {"must": [
-                {"term": {"destination_id": code}},
-                {"term": {"type_id": "116680003"}},  # IS-A relationship
-                {"term": {"active": True}}
-            ]}}},
-            size=1000
-        )
-        children = [r['_source']['source_id'] for r in children_resp["hits"]["hits"]]
-        
-        # Process designations with extensions
-        designations = []
+        # Process designations with extensions (grouped by type as we go)
+        synonym_designations = []
+        fsn_designations = []
         display_term = ""
         
         for d in descriptions:
@@ -220,7 +222,10 @@ def lookup_post_view(request):
                     {"name": "value", "valueString": src["term"]}
                 ]
             }
-            designations.append(designation)
+            if src["type_id"] == "900000000000013009":
+                synonym_designations.append(designation)
+            elif src["type_id"] == "900000000000003001":
+                fsn_designations.append(designation)
         
         # Build response parameters - order matters!
         parameters = [
@@ -260,9 +265,6 @@ def lookup_post_view(request):
         parameters.extend(properties)
         
         # Add designations (order: synonym first, then FSN)
-        synonym_designations = [d for d in designations if d["part"][1]["valueCoding"]["code"] == "900000000000013009"]
-        fsn_designations = [d for d in designations if d["part"][1]["valueCoding"]["code"] == "900000000000003001"]
-        
         parameters.extend(synonym_designations)
         parameters.extend(fsn_designations)
         
@@ -0,0 +1,19 @@
+from elasticsearch.helpers import parallel_bulk
+from terminology_api.ES.es_client import es
+
+def parallel_index(actions, thread_count=4, chunk_size=1000, raise_on_error=True):
+    """
+    Send bulk actions over several connections at once, returning
+    (succeeded, failed) counts. Indexing a release is dominated by bulk round
+    trips, which parallel_bulk overlaps instead of waiting on each chunk.
+    With raise_on_error False failed actions are counted instead of raised.
+    """
+    succeeded = failed = 0
+    for ok, _ in parallel_bulk(
+        es, actions, thread_count=thread_count, chunk_size=chunk_size, raise_on_error=raise_on_error
+    ):
+        if ok:
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
@@ -10,5 +10,15 @@ es = Elasticsearch(
         os.getenv("ES_USERNAME"),
         os.getenv("ES_PASSWORD")
     ),
-    verify_certs=False
+    verify_certs=False,
+    # Kept-alive connections shared by every Django worker thread, each of which may have
+    # several msearch, prefetch and descendant requests in flight at once
+    connections_per_node=int(os.getenv("ES_CONNECTIONS_PER_NODE", "64")),
+    # gzip request and response bodies, large terms filters and description pages shrink well
+    http_compress=os.getenv("ES_HTTP_COMPRESS", "true").lower() == "true",
+    request_timeout=float(os.getenv("ES_REQUEST_TIMEOUT", "30")),
+    # Nearly every call is a search, a read or indexing under explicit ids, safe to send
+    # again when a node is slow or a pooled keep-alive connection went stale
+    retry_on_timeout=os.getenv("ES_RETRY_ON_TIMEOUT", "true").lower() == "true",
+    max_retries=int(os.getenv("ES_MAX_RETRIES", "2"))
 )
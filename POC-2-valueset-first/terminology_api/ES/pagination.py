@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+from terminology_api.ES.es_client import es
+import queue
+import threading
+
+# Hit pages each iter_hits_sliced slice may have fetched ahead of the consumer
+SLICED_PAGES_BUFFERED = 2
+
+def iter_hits(index, query, source=None, page_size=1000, prefetch=False, **extra_body):
+    """
+    Yield every hit matching `query` using search_after pagination.
+    Sorted on _doc, the cheapest order for ES to produce; the terminology
+    indices are single-shard so _doc is a stable cursor.
+    With prefetch, page N+1 is requested before page N's hits are yielded.
+    Extra keyword args (runtime_mappings, fields, ...) go into the search body.
+    """
+    body = {
+        "query": query,
+        "size": page_size,
+        "sort": [{"_doc": "asc"}],
+        # Paging stops on a short page, the total is never needed
+        "track_total_hits": False
+    }
+    if source is not None:
+        body["_source"] = source
+    body.update(extra_body)
+
+    if prefetch:
+        yield from _iter_hits_prefetched(index, body, page_size)
+        return
+
+    while True:
+        resp = es.search(index=index, body=body)
+        hits = resp["hits"]["hits"]
+        yield from hits
+
+        if len(hits) < page_size:
+            break
+        body["search_after"] = hits[-1]["sort"]
+
+def _iter_hits_prefetched(index, body, page_size):
+    """Overlap fetching the next page with the caller consuming the current one"""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(es.search, index=index, body=dict(body))
+
+        while future is not None:
+            hits = future.result()["hits"]["hits"]
+
+            # The cursor is known as soon as a page lands, fire the next request right away
+            future = None
+            if len(hits) == page_size:
+                body["search_after"] = hits[-1]["sort"]
+                future = executor.submit(es.search, index=index, body=dict(body))
+
+            yield from hits
+
+def iter_pages_pit(index, body, page_size=1000, keep_alive="1m"):
+    """
+    Yield pages of hits for a search body in its own sort order, e.g. by score,
+    paged with search_after over a point in time. A _shard_doc tiebreaker
+    keeps ties on the body's sort from being skipped or repeated. Aggregations
+    are dropped. Close the generator to stop early; the PIT is closed with it.
+    """
+    pit_id = es.open_point_in_time(index=index, keep_alive=keep_alive)["id"]
+    body = dict(body)
+    body.pop("aggs", None)
+    body.update({
+        "size": page_size,
+        "sort": list(body.get("sort", [])) + [{"_shard_doc": "asc"}],
+        "pit": {"id": pit_id, "keep_alive": keep_alive},
+        "track_total_hits": False
+    })
+    try:
+        while True:
+            resp = es.search(body=body)
+            hits = resp["hits"]["hits"]
+            if hits:
+                yield hits
+
+            if len(hits) < page_size:
+                break
+            body["search_after"] = hits[-1]["sort"]
+            body["pit"]["id"] = resp.get("pit_id", body["pit"]["id"])
+    finally:
+        es.close_point_in_time(id=body["pit"]["id"])
+
+def iter_hits_sliced(index, query, source=None, slices=4, page_size=1000, keep_alive="1m", **extra_body):
+    """
+    Yield every hit matching `query`, fetched by `slices` search_after cursors
+    running in parallel over one point in time. Pages are yielded as they land,
+    interleaved across slices, through a queue of at most SLICED_PAGES_BUFFERED
+    pages per slice, so memory stays bounded however many hits match. Opening
+    and closing the PIT costs two extra requests, so this only pays off for
+    large result sets. Extra keyword args go into every slice's search body, as
+    in iter_hits. Closing the generator early stops the slices.
+    """
+    pit_id = es.open_point_in_time(index=index, keep_alive=keep_alive)["id"]
+    pages = queue.Queue(maxsize=slices * SLICED_PAGES_BUFFERED)
+    stop = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            for slice_id in range(slices):
+                executor.submit(
+                    _feed_slice, pages, stop, pit_id, query, source, slice_id, slices, page_size, keep_alive, extra_body
+                )
+            try:
+                running = slices
+                while running:
+                    page = pages.get()
+                    if page is None:
+                        running -= 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        yield from page
+            finally:
+                # Unblock slices waiting on a full queue so the executor can shut down
+                stop.set()
+                while True:
+                    try:
+                        pages.get_nowait()
+                    except queue.Empty:
+                        break
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+def _feed_slice(pages, stop, pit_id, query, source, slice_id, slices, page_size, keep_alive, extra_body):
+    """
+    Put the hit pages of one slice of a point in time on `pages`, paged with
+    search_after, then None; an error is put in place of the remaining pages
+    """
+    body = {
+        "query": query,
+        "size": page_size,
+        "sort": [{"_shard_doc": "asc"}],
+        "pit": {"id": pit_id, "keep_alive": keep_alive},
+        "slice": {"id": slice_id, "max": slices},
+        "track_total_hits": False
+    }
+    if source is not None:
+        body["_source"] = source
+    body.update(extra_body)
+
+    try:
+        while not stop.is_set():
+            resp = es.search(body=body)
+            hits = resp["hits"]["hits"]
+            if hits and not _put_page(pages, stop, hits):
+                return
+
+            if len(hits) < page_size:
+                break
+            body["search_after"] = hits[-1]["sort"]
+            # ES may hand back a refreshed PIT id with each page
+            body["pit"]["id"] = resp.get("pit_id", body["pit"]["id"])
+    except Exception as e:
+        _put_page(pages, stop, e)
+        return
+    _put_page(pages, stop, None)
+
+def _put_page(pages, stop, item):
+    """Put item on the bounded queue, giving up once the consumer stopped; False if it gave up"""
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
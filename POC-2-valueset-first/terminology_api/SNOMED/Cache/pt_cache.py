@@ -6,11 +6,25 @@ and updates the descriptions index with pt=1 for preferred terms only (others re
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from terminology_api.ES.es_client import es
+from terminology_api.ES.mappings import index_has_field
+from terminology_api.ES.pagination import iter_hits, iter_hits_sliced
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Worker threads used to resolve several is-a roots concurrently
+MAX_DESCENDANT_WORKERS = 8
+
+# Parallel slices used for large descendant fetches, and the BFS level size that warrants them
+DESCENDANT_SLICES = 4
+SLICED_LEVEL_MIN = 1000
+
+# Hits per search_after page on the descendant hops
+DESCENDANT_PAGE_SIZE = 1000
+
 # Valueset compositions from the provided data
 VALUESETS = [
     {"exclude": [], "include": [{"filter": [{"op": "is-a", "value": "223366009", "property": "concept"}], "system": "http://snomed.info/sct"}, {"filter": [{"op": "is-a", "value": "224930009", "property": "concept"}], "system": "http://snomed.info/sct"}]},
@@ -25,73 +39,54 @@ VALUESETS = [
     {"exclude": [], "include": [{"filter": [{"op": "is-a", "value": "272394005", "property": "concept"}], "system": "http://snomed.info/sct"}, {"filter": [{"op": "is-a", "value": "129264002", "property": "concept"}], "system": "http://snomed.info/sct"}, {"filter": [{"op": "is-a", "value": "386053000", "property": "concept"}], "system": "http://snomed.info/sct"}]}
 ]
 
-def concept_exists(concept_id):
-    """Check if a concept exists in the concepts index"""
-    try:
-        result = es.get(index="concepts", id=concept_id, ignore=[404])
-        return result.get('found', False)
-    except Exception as e:
-        logger.error(f"Error checking concept existence for {concept_id}: {str(e)}")
-        return False
+def existing_concepts(concept_ids):
+    """Ids from concept_ids present in the concepts index, checked with a single mget"""
+    if not concept_ids:
+        return set()
+    resp = es.mget(index="concepts", body={"ids": list(concept_ids)}, _source=False)
+    return {doc["_id"] for doc in resp["docs"] if doc.get("found", False)}
 
 def find_descendants_batch(concept_id, max_depth=None):
-    """Find all descendants using optimized scroll queries per depth level"""
+    """Find all descendants using search_after pages per depth level"""
     all_descendants = set()
     current_level = {concept_id}
     depth = 0
 
     try:
+        # Unbounded walks are one paged term query on the denormalized ancestors field
+        if max_depth is None and index_has_field("concepts", "ancestors"):
+            return find_descendants_by_ancestors(concept_id)
+
         while current_level and (max_depth is None or depth < max_depth):
-            # Initialize scroll for the current level
             query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {"terms": {"destination_id": list(current_level)}},
-                            {"term": {"type_id": "116680003"}},  # IS-A relationship
-                            {"term": {"active": True}}
-                        ]
-                    }
-                },
-                "_source": ["source_id"],
-                "size": 5000
+                "bool": {
+                    "filter": [
+                        {"terms": {"destination_id": list(current_level)}},
+                        {"term": {"type_id": "116680003"}},  # IS-A relationship
+                        {"term": {"active": True}}
+                    ]
+                }
             }
 
-            # Start scroll
-            resp = es.search(
-                index="relationships",
-                body=query,
-                scroll="5m",
-                timeout="60s"
-            )
-
-            scroll_id = resp.get("_scroll_id")
-            next_level = set()
-            total_hits = resp.get("hits", {}).get("total", {}).get("value", 0)
-            logger.info(f"Depth {depth}: Query returned {total_hits} total hits")
-
-            # Process initial results
-            for hit in resp["hits"]["hits"]:
-                child_id = hit["_source"]["source_id"]
-                if child_id not in all_descendants and child_id != concept_id:
-                    all_descendants.add(child_id)
-                    next_level.add(child_id)
-
-            # Continue scrolling until no more results
-            while resp["hits"]["hits"]:
-                resp = es.scroll(scroll_id=scroll_id, scroll="5m")
-                for hit in resp["hits"]["hits"]:
-                    child_id = hit["_source"]["source_id"]
-                    if child_id not in all_descendants and child_id != concept_id:
-                        all_descendants.add(child_id)
-                        next_level.add(child_id)
+            # search_after over _doc keeps no scroll context open on the cluster per level
+            if len(current_level) >= SLICED_LEVEL_MIN:
+                hits = iter_hits_sliced(
+                    "relationships", query, source=False, slices=DESCENDANT_SLICES, page_size=DESCENDANT_PAGE_SIZE,
+                    docvalue_fields=["source_id.keyword"]
+                )
+            else:
+                hits = iter_hits(
+                    "relationships", query, source=False, page_size=DESCENDANT_PAGE_SIZE, prefetch=True,
+                    docvalue_fields=["source_id.keyword"]
+                )
+            child_ids = [hit["fields"]["source_id.keyword"][0] for hit in hits]
+            processed = len(child_ids)
+            next_level = set(child_ids)
+            next_level -= all_descendants
+            next_level.discard(concept_id)
+            all_descendants |= next_level
 
-            # Clear scroll context
-            if scroll_id:
-                try:
-                    es.clear_scroll(scroll_id=scroll_id)
-                except Exception as e:
-                    logger.warning(f"Error clearing scroll for concept {concept_id}: {str(e)}")
+            logger.info("Depth %s: Processed %s relationships, found %s new descendants", depth, processed, len(next_level))
 
             current_level = next_level
             depth += 1
@@ -99,15 +94,38 @@ def find_descendants_batch(concept_id, max_depth=None):
             if not next_level:
                 break
 
-        logger.info(f"Total descendants for {concept_id}: {len(all_descendants)}")
+        logger.info("Total descendants for %s: %s", concept_id, len(all_descendants))
         return all_descendants
 
     except Exception as e:
-        logger.error(f"Error finding descendants for {concept_id}: {str(e)}")
-        return all_descendants
+        # Raised rather than returning the levels walked so far, so cached_descendants
+        # never memoizes a truncated subtree for the rest of the run
+        logger.error("Error finding descendants for %s: %s", concept_id, e, exc_info=True)
+        raise
+
+@lru_cache(maxsize=4096)
+def cached_descendants(concept_id):
+    """
+    find_descendants_batch memoized per root, valuesets in one run share roots.
+    A failed walk raises, and lru_cache only stores walks that finished.
+    """
+    return frozenset(find_descendants_batch(concept_id))
+
+def find_descendants_by_ancestors(concept_id):
+    """Find all descendants as the concepts whose ancestors field contains the root"""
+    descendants = {
+        hit["_id"] for hit in iter_hits_sliced(
+            "concepts", {"term": {"ancestors": concept_id}}, source=False, slices=DESCENDANT_SLICES, page_size=DESCENDANT_PAGE_SIZE
+        )
+    }
+    logger.info("Total descendants for %s: %s", concept_id, len(descendants))
+    return descendants
 
 def get_preferred_terms_batch(concept_ids, display_language='en'):
-    """Get preferred terms from language_refsets index using scroll API for large datasets"""
+    """
+    Get preferred terms from language_refsets index using scroll API for large datasets.
+    ES errors, including failed msearch batches, are raised.
+    """
     if not concept_ids:
         return {}
     
@@ -125,7 +143,7 @@ def get_preferred_terms_batch(concept_ids, display_language='en'):
         descriptions_query = {
             "query": {
                 "bool": {
-                    "must": [
+                    "filter": [
                         {"terms": {"concept_id": concept_ids}},
                         {"term": {"active": True}},
                         {"term": {"language_code": display_language}},
@@ -166,13 +184,13 @@ def get_preferred_terms_batch(concept_ids, display_language='en'):
             try:
                 es.clear_scroll(scroll_id=scroll_id)
             except Exception as e:
-                logger.warning(f"Error clearing scroll for descriptions: {str(e)}")
+                logger.warning("Error clearing scroll for descriptions: %s", e)
         
         if not description_ids:
-            logger.warning(f"No descriptions found for concepts in language {display_language}")
+            logger.warning("No descriptions found for concepts in language %s", display_language)
             return {}
         
-        logger.info(f"Found {len(description_ids)} descriptions for processing")
+        logger.info("Found %s descriptions for processing", len(description_ids))
         
         # STEP 2: Check which descriptions are preferred in language_refsets
         # Process description IDs in batches to avoid the 10k limit
@@ -180,14 +198,16 @@ def get_preferred_terms_batch(concept_ids, display_language='en'):
         preferred_synonyms = {}
         preferred_fsns = {}
         
+        # All batches go out in one msearch round-trip and ES runs them in parallel
         desc_batch_size = 5000  # Process description IDs in batches
+        searches = []
         for i in range(0, len(description_ids), desc_batch_size):
             batch_desc_ids = description_ids[i:i + desc_batch_size]
             
             language_refsets_query = {
                 "query": {
                     "bool": {
-                        "must": [
+                        "filter": [
                             {"terms": {"referenced_component_id": batch_desc_ids}},
                             {"term": {"refset_id": refset_id}},
                             {"term": {"active": True}},
@@ -198,13 +218,14 @@ def get_preferred_terms_batch(concept_ids, display_language='en'):
                 "_source": ["referenced_component_id"],
                 "size": len(batch_desc_ids)  # This should be <= 5000
             }
-            
-            refsets_resp = es.search(
-                index="language_refsets",
-                body=language_refsets_query,
-                timeout='30s'
-            )
-            
+            searches.append({"index": "language_refsets"})
+            searches.append(language_refsets_query)
+        
+        msearch_resp = es.msearch(body=searches)
+        
+        for refsets_resp in msearch_resp['responses']:
+            if "error" in refsets_resp:
+                raise Exception(refsets_resp["error"])
             # Process this batch of refset results
             for hit in refsets_resp['hits']['hits']:
                 desc_id = hit['_source']['referenced_component_id']
@@ -229,16 +250,33 @@ def get_preferred_terms_batch(concept_ids, display_language='en'):
             elif concept_id in preferred_fsns:
                 preferred_terms[concept_id] = preferred_fsns[concept_id]
         
-        logger.info(f"Found {len(preferred_terms)} preferred terms from language_refsets")
+        logger.info("Found %s preferred terms from language_refsets", len(preferred_terms))
         return preferred_terms
         
     except Exception as e:
-        logger.error(f"Error getting preferred terms from language_refsets: {str(e)}")
+        # Raised so a failed batch stops the run instead of leaving its pt flags unset
+        logger.error("Error getting preferred terms from language_refsets: %s", e, exc_info=True)
+        raise
+    
+def find_descendants_for_roots(root_ids):
+    """Check and expand several is-a roots in parallel threads; None marks a missing root"""
+    root_ids = list(dict.fromkeys(root_ids))
+    if not root_ids:
         return {}
     
+    # The ES client is thread-safe; one mget validates every root while the
+    # other workers already run their BFS, a missing root just finds nothing
+    with ThreadPoolExecutor(max_workers=min(MAX_DESCENDANT_WORKERS, len(root_ids) + 1)) as executor:
+        found_future = executor.submit(existing_concepts, root_ids)
+        descendants = dict(zip(root_ids, executor.map(cached_descendants, root_ids)))
+        found = found_future.result()
+    
+    return {root_id: descendants[root_id] if root_id in found else None for root_id in root_ids}
+
 def expand_valueset(valueset_compose):
     """Expand a valueset to get all concept IDs"""
     all_concept_ids = set()
+    include_roots = []
     
     includes = valueset_compose.get('include', [])
     excludes = valueset_compose.get('exclude', [])
@@ -251,9 +289,7 @@ def expand_valueset(valueset_compose):
             
         # Handle direct concept codes
         if 'concept' in include:
-            codes = include['concept']
-            for code_entry in codes:
-                all_concept_ids.add(code_entry['code'])
+            all_concept_ids.update(code_entry['code'] for code_entry in include['concept'])
         
         # Handle filters
         filters = include.get('filter', [])
@@ -263,19 +299,21 @@ def expand_valueset(valueset_compose):
             value = filter_def.get('value')
             
             if property_name == 'concept' and op == 'is-a':
-                # Validate root concept exists
-                if not concept_exists(value):
-                    logger.warning(f"Root concept {value} not found")
-                    continue
-                
-                # Get descendants
-                descendants = find_descendants_batch(value)
-                all_concept_ids.update(descendants)
-                all_concept_ids.add(value)  # Include the concept itself
-                logger.info(f"Found {len(descendants)} descendants for {value}")
+                include_roots.append(value)
+    
+    # Resolve all is-a roots concurrently instead of one hierarchy walk after another
+    for value, descendants in find_descendants_for_roots(include_roots).items():
+        if descendants is None:
+            logger.warning("Root concept %s not found", value)
+            continue
+        
+        all_concept_ids.update(descendants)
+        all_concept_ids.add(value)  # Include the root concept itself
+        logger.info("Found %s descendants for %s", len(descendants), value)
     
     # Process excludes
     exclude_concept_ids = set()
+    exclude_roots = []
     for exclude in excludes:
         system = exclude.get('system')
         if system != 'http://snomed.info/sct':
@@ -283,9 +321,7 @@ def expand_valueset(valueset_compose):
             
         # Handle direct concept codes
         if 'concept' in exclude:
-            codes = exclude['concept']
-            for code_entry in codes:
-                exclude_concept_ids.add(code_entry['code'])
+            exclude_concept_ids.update(code_entry['code'] for code_entry in exclude['concept'])
         
         # Handle filters
         exclude_filters = exclude.get('filter', [])
@@ -295,20 +331,22 @@ def expand_valueset(valueset_compose):
             value = filter_def.get('value')
             
             if property_name == 'concept' and op == 'is-a':
-                if concept_exists(value):
-                    descendants = find_descendants_batch(value)
-                    exclude_concept_ids.update(descendants)
-                    exclude_concept_ids.add(value)
+                exclude_roots.append(value)
+    
+    for value, descendants in find_descendants_for_roots(exclude_roots).items():
+        if descendants is not None:
+            exclude_concept_ids.update(descendants)
+            exclude_concept_ids.add(value)
     
     # Remove excluded concepts
     all_concept_ids -= exclude_concept_ids
     
-    logger.info(f"Expanded valueset to {len(all_concept_ids)} concepts")
+    logger.info("Expanded valueset to %s concepts", len(all_concept_ids))
     return all_concept_ids
 
 def update_descriptions_with_pt_flag(preferred_description_ids, batch_size=1000):
     """Update descriptions index with pt flag - only set pt=1 for preferred descriptions"""
-    logger.info(f"Updating descriptions index with pt flag for {len(preferred_description_ids)} preferred descriptions")
+    logger.info("Updating descriptions index with pt flag for %s preferred descriptions", len(preferred_description_ids))
     
     # Only set preferred descriptions to pt=1, leave others blank (no pt field)
     if preferred_description_ids:
@@ -328,16 +366,16 @@ def update_descriptions_with_pt_flag(preferred_description_ids, batch_size=1000)
             }
             
             try:
-                logger.info(f"Setting batch {i//batch_size + 1} of preferred descriptions to pt=1...")
+                logger.info("Setting batch %s of preferred descriptions to pt=1...", i//batch_size + 1)
                 response = es.update_by_query(
                     index="descriptions",
                     body=update_preferred_query,
                     timeout='5m',
                     wait_for_completion=True
                 )
-                logger.info(f"Updated {response.get('updated', 0)} descriptions to pt=1 in batch {i//batch_size + 1}")
+                logger.info("Updated %s descriptions to pt=1 in batch %s", response.get('updated', 0), i//batch_size + 1)
             except Exception as e:
-                logger.error(f"Error updating batch {i//batch_size + 1} to pt=1: {str(e)}")
+                logger.error("Error updating batch %s to pt=1: %s", i//batch_size + 1, e, exc_info=True)
                 return False
     
     return True
@@ -350,11 +388,11 @@ def main():
     
     # Process all valuesets to get unique concept IDs
     for i, valueset in enumerate(VALUESETS):
-        logger.info(f"Processing valueset {i + 1}/{len(VALUESETS)}")
+        logger.info("Processing valueset %s/%s", i + 1, len(VALUESETS))
         concept_ids = expand_valueset(valueset)
         all_concept_ids.update(concept_ids)
     
-    logger.info(f"Total unique concepts across all valuesets: {len(all_concept_ids)}")
+    logger.info("Total unique concepts across all valuesets: %s", len(all_concept_ids))
     
     # Get preferred terms for all concepts
     all_preferred_description_ids = set()
@@ -364,12 +402,12 @@ def main():
     batch_size = 5000
     for i in range(0, len(concept_list), batch_size):
         batch = concept_list[i:i + batch_size]
-        logger.info(f"Getting preferred terms for batch {i//batch_size + 1}/{(len(concept_list) + batch_size - 1)//batch_size}")
+        logger.info("Getting preferred terms for batch %s/%s", i//batch_size + 1, (len(concept_list) + batch_size - 1)//batch_size)
         
         preferred_terms = get_preferred_terms_batch(batch)
         all_preferred_description_ids.update(preferred_terms.values())
     
-    logger.info(f"Total preferred description IDs found: {len(all_preferred_description_ids)}")
+    logger.info("Total preferred description IDs found: %s", len(all_preferred_description_ids))
     
     # Update descriptions index - only set pt=1 for preferred descriptions
     success = update_descriptions_with_pt_flag(all_preferred_description_ids)
@@ -392,10 +430,10 @@ def main():
         response = es.count(index="descriptions", body=count_query)
         pt_count = response.get('count', 0)
         
-        logger.info(f"Verification: {pt_count} descriptions now have pt=1")
+        logger.info("Verification: %s descriptions now have pt=1", pt_count)
         
     except Exception as e:
-        logger.error(f"Error verifying update: {str(e)}")
+        logger.error("Error verifying update: %s", e, exc_info=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,79 +1,70 @@
 import json
 from terminology_api.ES.es_client import es
+from terminology_api.ES.mappings import index_has_field
+from terminology_api.ES.pagination import iter_hits, iter_hits_sliced
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
 
-def concept_exists(concept_id):
-    """Check if a concept exists in the concepts index"""
-    try:
-        result = es.get(index="concepts", id=concept_id, ignore=[404])
-        return result.get('found', False)
-    except Exception as e:
-        print(f"Error checking concept existence for {concept_id}: {str(e)}")
-        return False
+# Worker threads used to resolve several is-a roots concurrently
+MAX_DESCENDANT_WORKERS = 8
+
+# Parallel slices used for large descendant fetches, and the BFS level size that warrants them
+DESCENDANT_SLICES = 4
+SLICED_LEVEL_MIN = 1000
+
+# Hits per search_after page on the descendant hops
+DESCENDANT_PAGE_SIZE = 1000
+
+def existing_concepts(concept_ids):
+    """Ids from concept_ids present in the concepts index, checked with a single mget"""
+    if not concept_ids:
+        return set()
+    resp = es.mget(index="concepts", body={"ids": list(concept_ids)}, _source=False)
+    return {doc["_id"] for doc in resp["docs"] if doc.get("found", False)}
 
 def find_descendants_batch(concept_id, max_depth=None):
-    """Find all descendants using optimized scroll queries per depth level"""
+    """Find all descendants using search_after pages per depth level"""
     all_descendants = set()
     current_level = {concept_id}
     depth = 0
 
     try:
+        # Unbounded walks are one paged term query on the denormalized ancestors field
+        if max_depth is None and index_has_field("concepts", "ancestors"):
+            return find_descendants_by_ancestors(concept_id)
+
         while current_level and (max_depth is None or depth < max_depth):
-            # Initialize scroll for the current level
             query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {"terms": {"destination_id": list(current_level)}},
-                            {"term": {"type_id": "116680003"}},  # IS-A relationship
-                            {"term": {"active": True}}
-                        ]
-                    }
-                },
-                "_source": ["source_id"],
-                "size": 5000  # Increased batch size
+                "bool": {
+                    "filter": [
+                        {"terms": {"destination_id": list(current_level)}},
+                        {"term": {"type_id": "116680003"}},  # IS-A relationship
+                        {"term": {"active": True}}
+                    ]
+                }
             }
 
-            # Start scroll
-            resp = es.search(
-                index="relationships",
-                body=query,
-                scroll="5m",  # Increased scroll context lifetime
-                timeout="60s"  # Increased timeout
-            )
-
-            scroll_id = resp.get("_scroll_id")
-            next_level = set()
-            total_hits = resp.get("hits", {}).get("total", {}).get("value", 0)
-            print(f"Depth {depth}: Query returned {total_hits} total hits")
-
-            # Process initial results
-            for hit in resp["hits"]["hits"]:
-                child_id = hit["_source"]["source_id"]
-                if child_id not in all_descendants and child_id != concept_id:
-                    all_descendants.add(child_id)
-                    next_level.add(child_id)
-
-            # Continue scrolling until no more results
-            scroll_count = len(resp["hits"]["hits"])
-            while resp["hits"]["hits"]:
-                resp = es.scroll(scroll_id=scroll_id, scroll="5m")
-                scroll_count += len(resp["hits"]["hits"])
-                for hit in resp["hits"]["hits"]:
-                    child_id = hit["_source"]["source_id"]
-                    if child_id not in all_descendants and child_id != concept_id:
-                        all_descendants.add(child_id)
-                        next_level.add(child_id)
-
-            print(f"Depth {depth}: Processed {scroll_count} relationships, found {len(next_level)} new descendants")
+            # search_after over _doc keeps no scroll context open on the cluster per level
+            if len(current_level) >= SLICED_LEVEL_MIN:
+                hits = iter_hits_sliced(
+                    "relationships", query, source=False, slices=DESCENDANT_SLICES, page_size=DESCENDANT_PAGE_SIZE,
+                    docvalue_fields=["source_id.keyword"]
+                )
+            else:
+                hits = iter_hits(
+                    "relationships", query, source=False, page_size=DESCENDANT_PAGE_SIZE, prefetch=True,
+                    docvalue_fields=["source_id.keyword"]
+                )
+            child_ids = [hit["fields"]["source_id.keyword"][0] for hit in hits]
+            processed = len(child_ids)
+            next_level = set(child_ids)
+            next_level -= all_descendants
+            next_level.discard(concept_id)
+            all_descendants |= next_level
 
-            # Clear scroll context
-            if scroll_id:
-                try:
-                    es.clear_scroll(scroll_id=scroll_id)
-                except Exception as e:
-                    print(f"Error clearing scroll for concept {concept_id}: {str(e)}")
+            print(f"Depth {depth}: Processed {processed} relationships, found {len(next_level)} new descendants")
 
             current_level = next_level
             depth += 1
@@ -85,8 +76,28 @@ def find_descendants_batch(concept_id, max_depth=None):
         return all_descendants
 
     except Exception as e:
-        print(f"Error finding descendants for {concept_id}: {str(e)}", exc_info=True)
-        return all_descendants
+        # Raised rather than returning the levels walked so far, so cached_descendants
+        # never memoizes a truncated subtree for the rest of the run
+        print(f"Error finding descendants for {concept_id}: {str(e)}")
+        raise
+
+@lru_cache(maxsize=4096)
+def cached_descendants(concept_id):
+    """
+    find_descendants_batch memoized per root, valuesets in one run share roots.
+    A failed walk raises, and lru_cache only stores walks that finished.
+    """
+    return frozenset(find_descendants_batch(concept_id))
+
+def find_descendants_by_ancestors(concept_id):
+    """Find all descendants as the concepts whose ancestors field contains the root"""
+    descendants = {
+        hit["_id"] for hit in iter_hits_sliced(
+            "concepts", {"term": {"ancestors": concept_id}}, source=False, slices=DESCENDANT_SLICES, page_size=DESCENDANT_PAGE_SIZE
+        )
+    }
+    print(f"Total descendants for {concept_id}: {len(descendants)}")
+    return descendants
 
 def parse_valuesets():
     """Parse the valuesets from the provided JSON strings"""
@@ -116,6 +127,21 @@ def parse_valuesets():
     
     return valuesets
 
+def find_descendants_for_roots(root_ids):
+    """Check and expand several is-a roots in parallel threads; None marks a missing root"""
+    root_ids = list(dict.fromkeys(root_ids))
+    if not root_ids:
+        return {}
+    
+    # The ES client is thread-safe; one mget validates every root while the
+    # other workers already run their BFS, a missing root just finds nothing
+    with ThreadPoolExecutor(max_workers=min(MAX_DESCENDANT_WORKERS, len(root_ids) + 1)) as executor:
+        found_future = executor.submit(existing_concepts, root_ids)
+        descendants = dict(zip(root_ids, executor.map(cached_descendants, root_ids)))
+        found = found_future.result()
+    
+    return {root_id: descendants[root_id] if root_id in found else None for root_id in root_ids}
+
 def expand_valueset(valueset_id, valueset_data):
     """Expand a single valueset and return the concept IDs"""
     print(f"Expanding valueset {valueset_id}")
@@ -125,6 +151,8 @@ def expand_valueset(valueset_id, valueset_data):
     excludes = compose.get('exclude', [])
     
     all_concept_ids = set()
+    include_codes = []
+    include_roots = []
     
     # Process includes
     for include in includes:
@@ -135,16 +163,9 @@ def expand_valueset(valueset_id, valueset_data):
             print(f"Skipping non-SNOMED system: {system}")
             continue
         
-        # Handle direct concept codes
+        # Handle direct concept codes, checked together once every include is read
         if 'concept' in include:
-            codes = include['concept']
-            for code_entry in codes:
-                concept_id = code_entry['code']
-                if concept_exists(concept_id):
-                    all_concept_ids.add(concept_id)
-                    print(f"Added direct concept: {concept_id}")
-                else:
-                    print(f"Direct concept {concept_id} not found in index")
+            include_codes.extend(code_entry['code'] for code_entry in include['concept'])
         
         # Handle filters
         filters = include.get('filter', [])
@@ -155,19 +176,30 @@ def expand_valueset(valueset_id, valueset_data):
             
             # Only process is-a filters
             if property_name == 'concept' and op == 'is-a':
-                # Validate root concept exists
-                if not concept_exists(value):
-                    print(f"Root concept {value} not found in index")
-                    continue
-                
-                # Get descendants using the provided function
-                descendants = find_descendants_batch(value)
-                all_concept_ids.update(descendants)
-                all_concept_ids.add(value)  # Include the root concept itself
-                print(f"Added {len(descendants)} descendants for root concept {value}")
+                include_roots.append(value)
+    
+    # One mget for the direct codes of all includes
+    found = existing_concepts(include_codes)
+    for concept_id in include_codes:
+        if concept_id in found:
+            all_concept_ids.add(concept_id)
+            print(f"Added direct concept: {concept_id}")
+        else:
+            print(f"Direct concept {concept_id} not found in index")
+    
+    # Resolve all is-a roots concurrently instead of one hierarchy walk after another
+    for value, descendants in find_descendants_for_roots(include_roots).items():
+        if descendants is None:
+            print(f"Root concept {value} not found in index")
+            continue
+        
+        all_concept_ids.update(descendants)
+        all_concept_ids.add(value)  # Include the root concept itself
+        print(f"Added {len(descendants)} descendants for root concept {value}")
     
     # Process excludes
     exclude_concept_ids = set()
+    exclude_roots = []
     for exclude in excludes:
         system = exclude.get('system')
         if system != 'http://snomed.info/sct':
@@ -175,9 +207,7 @@ def expand_valueset(valueset_id, valueset_data):
         
         # Handle direct concept codes
         if 'concept' in exclude:
-            codes = exclude['concept']
-            for code_entry in codes:
-                exclude_concept_ids.add(code_entry['code'])
+            exclude_concept_ids.update(code_entry['code'] for code_entry in exclude['concept'])
         
         # Handle filters
         exclude_filters = exclude.get('filter', [])
@@ -187,10 +217,12 @@ def expand_valueset(valueset_id, valueset_data):
             value = filter_def.get('value')
             
             if property_name == 'concept' and op == 'is-a':
-                if concept_exists(value):
-                    descendants = find_descendants_batch(value)
-                    exclude_concept_ids.update(descendants)
-                    exclude_concept_ids.add(value)
+                exclude_roots.append(value)
+    
+    for value, descendants in find_descendants_for_roots(exclude_roots).items():
+        if descendants is not None:
+            exclude_concept_ids.update(descendants)
+            exclude_concept_ids.add(value)
     
     # Remove excluded concepts
     all_concept_ids -= exclude_concept_ids
@@ -209,46 +241,15 @@ def get_descriptions_for_concepts(concept_ids):
     for i in range(0, len(concept_list), batch_size):
         batch = concept_list[i:i + batch_size]
         
-        # Query descriptions index for these concept IDs
-        query = {
-            "query": {
-                "terms": {"concept_id": batch}
-            },
-            "_source": ["concept_id"],
-            "size": 10000
-        }
-        
         try:
-            # Start scroll for large result sets
-            resp = es.search(
-                index="descriptions",
-                body=query,
-                scroll="5m",
-                timeout="60s"
-            )
-            
-            scroll_id = resp.get("_scroll_id")
-            
-            # Process initial results
-            for hit in resp["hits"]["hits"]:
+            # search_after over _doc keeps no scroll context open on the cluster
+            for hit in iter_hits(
+                "descriptions", {"terms": {"concept_id": batch}}, source=False, prefetch=True,
+                docvalue_fields=["concept_id.keyword"]
+            ):
                 description_id = hit["_id"]
-                concept_id = hit["_source"]["concept_id"]
+                concept_id = hit["fields"]["concept_id.keyword"][0]
                 concept_description_mapping[concept_id].add(description_id)
-            
-            # Continue scrolling until no more results
-            while resp["hits"]["hits"]:
-                resp = es.scroll(scroll_id=scroll_id, scroll="5m")
-                for hit in resp["hits"]["hits"]:
-                    description_id = hit["_id"]
-                    concept_id = hit["_source"]["concept_id"]
-                    concept_description_mapping[concept_id].add(description_id)
-            
-            # Clear scroll context
-            if scroll_id:
-                try:
-                    es.clear_scroll(scroll_id=scroll_id)
-                except Exception as e:
-                    print(f"Error clearing scroll: {str(e)}")
                     
         except Exception as e:
             print(f"Error querying descriptions for batch starting at {i}: {str(e)}")
@@ -0,0 +1,110 @@
+"""
+Backfill the denormalized `ancestors` field on existing concepts and
+descriptions indices from the relationships index, without re-reading the RF2
+release. Meant to run as a scheduled job after relationship updates; restart
+the API afterwards so it picks up the new mapping.
+"""
+from collections import defaultdict
+import itertools
+from terminology_api.ES.bulk import parallel_index
+from terminology_api.ES.es_client import es
+from terminology_api.ES.pagination import iter_hits, iter_hits_sliced
+import urllib3
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+def compute_ancestors(parents):
+    """Transitive closure of a concept_id -> set of direct parents map"""
+    ancestors = {}
+    for concept_id in parents:
+        if concept_id in ancestors:
+            continue
+        # Iterative post-order walk so deep hierarchies don't hit the recursion limit
+        stack = [concept_id]
+        while stack:
+            current = stack[-1]
+            pending = [p for p in parents.get(current, ()) if p not in ancestors]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            if current in ancestors:
+                continue
+            closure = set()
+            for parent in parents.get(current, ()):
+                closure.add(parent)
+                closure |= ancestors[parent]
+            ancestors[current] = closure
+    return ancestors
+
+def load_is_a_parents():
+    """Read active IS-A relationships from ES into a concept_id -> parents map"""
+    parents = defaultdict(set)
+    query = {"bool": {"filter": [
+        {"term": {"type_id": "116680003"}},
+        {"term": {"active": True}}
+    ]}}
+    # Ids are read from doc values, no _source is loaded per relationship
+    fields = ["source_id.keyword", "destination_id.keyword"]
+    for hit in iter_hits("relationships", query, source=False, page_size=10000, prefetch=True, docvalue_fields=fields):
+        parents[hit["fields"]["source_id.keyword"][0]].add(hit["fields"]["destination_id.keyword"][0])
+    return parents
+
+def stale_ancestor_concepts(ancestors):
+    """
+    Ids of concepts that still carry ancestors but are absent from the closure,
+    e.g. because all their IS-A relationships were inactivated. Left alone,
+    descendant queries on the ancestors field would keep returning them.
+    """
+    hits = iter_hits("concepts", {"exists": {"field": "ancestors"}}, source=False, page_size=10000, prefetch=True)
+    return [hit["_id"] for hit in hits if hit["_id"] not in ancestors]
+
+def backfill_ancestors():
+    parents = load_is_a_parents()
+    print(f"Loaded IS-A parents for {len(parents)} concepts")
+
+    ancestors = compute_ancestors(parents)
+    es.indices.put_mapping(index="concepts", properties={"ancestors": {"type": "keyword"}})
+
+    # Read before any update, so the concepts updated below never show up again as hits
+    stale = stale_ancestor_concepts(ancestors)
+    print(f"Clearing ancestors on {len(stale)} concepts without active IS-A parents")
+
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": "concepts",
+            "_id": concept_id,
+            "doc": {"ancestors": sorted(concept_ancestors)}
+        }
+        for concept_id, concept_ancestors in itertools.chain(
+            ancestors.items(), ((concept_id, ()) for concept_id in stale)
+        )
+    )
+    success, _ = parallel_index(actions, raise_on_error=False)
+    print(f"✅ Updated ancestors on {success} concepts")
+
+    backfill_description_ancestors(ancestors)
+
+def backfill_description_ancestors(ancestors):
+    """Copy each concept's ancestors onto its descriptions, for filtered is-a expansions"""
+    es.indices.put_mapping(index="descriptions", properties={"ancestors": {"type": "keyword"}})
+
+    # Read through a point in time so the updates below never show up as new hits
+    hits = iter_hits_sliced(
+        "descriptions", {"match_all": {}}, source=False, page_size=10000, docvalue_fields=["concept_id.keyword"]
+    )
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": "descriptions",
+            "_id": hit["_id"],
+            "doc": {"ancestors": sorted(ancestors.get(hit["fields"]["concept_id.keyword"][0], ()))}
+        }
+        for hit in hits
+    )
+    success, _ = parallel_index(actions, raise_on_error=False)
+    print(f"✅ Updated ancestors on {success} descriptions")
+
+if __name__ == "__main__":
+    backfill_ancestors()
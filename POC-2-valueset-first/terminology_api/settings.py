@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -125,3 +126,81 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# REST framework
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'terminology_api.renderers.ORJSONRenderer',
+        'terminology_api.renderers.FHIRJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Caches
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'terminology',
+        'OPTIONS': {
+            'MAX_ENTRIES': 512,
+        },
+    },
+    # Built $expand entries and $lookup responses per concept, apart from the default cache
+    # so they never push whole expansions out; point it at Redis to share it across workers
+    'concepts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'terminology-concepts',
+        'TIMEOUT': 86400,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("CONCEPT_CACHE_ENTRIES", "50000")),
+        },
+    },
+    # $expand page cursors and compose totals, tiny entries kept apart from the encoded
+    # expansions in the default cache so paging through a large compose never evicts them
+    'cursors': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'terminology-cursors',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("CURSOR_CACHE_ENTRIES", "10000")),
+        },
+    },
+    # Descendant sets of DESCENDANT_SHARED_CACHE, up to ~1 MB each, apart from the expansions.
+    # Only useful pointed at Redis (DESCENDANT_CACHE_URL, e.g. redis://redis:6379/1) or memcached:
+    # the LocMem fallback lives in one process, where the in-memory memo already holds the sets
+    'descendants': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("DESCENDANT_CACHE_URL"),
+    } if os.getenv("DESCENDANT_CACHE_URL") else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'terminology-descendants',
+        'OPTIONS': {
+            'MAX_ENTRIES': 256,
+        },
+    },
+}
+
+# Part of every expansion cache key; bump after reloading the ES indices
+TERMINOLOGY_INDEX_VERSION = os.getenv("TERMINOLOGY_INDEX_VERSION", "1")
+
+# Seconds a full $expand response stays cached
+EXPANSION_CACHE_TIMEOUT = 300
+
+# Compute top-level hierarchy descendants in a background thread when a server (WSGI/ASGI) process starts
+DESCENDANT_WARMUP = os.getenv("DESCENDANT_WARMUP", "true").lower() == "true"
+
+# Hierarchy levels warmed, 1 for the top-level hierarchies, 2 adds their children (a few hundred roots)
+DESCENDANT_WARMUP_DEPTH = int(os.getenv("DESCENDANT_WARMUP_DEPTH", "1"))
+
+# Also keep descendant sets in the 'descendants' cache, worth it once DESCENDANT_CACHE_URL shares it across workers
+DESCENDANT_SHARED_CACHE = os.getenv("DESCENDANT_SHARED_CACHE", "false").lower() == "true"
+
+# Directory for large descendant sets that outlive the process, e.g. /var/cache/terminology; empty disables it
+DESCENDANT_CACHE_DIR = os.getenv("DESCENDANT_CACHE_DIR", "")
+
+# Ids per terms query when long id lists are split into OR'd groups, 0 sends one terms query
+TERMS_GROUP_SIZE = int(os.getenv("TERMS_GROUP_SIZE", "1024"))
+
+# Threads sending batched expand searches and lookup concept GETs, one pool shared by every request; keep below ES_CONNECTIONS_PER_NODE
+ES_FANOUT_WORKERS = int(os.getenv("ES_FANOUT_WORKERS", "16"))
@@ -0,0 +1,20 @@
+import re
+import unicodedata
+
+# Runs of whitespace collapsed when normalizing search and display text
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class NonspacingMarkTable(dict):
+    """
+    str.translate table deleting nonspacing marks (category Mn), filled in as
+    code points are first met so each is classified only once per process
+    """
+
+    def __missing__(self, codepoint):
+        mapped = None if unicodedata.category(chr(codepoint)) == 'Mn' else codepoint
+        self[codepoint] = mapped
+        return mapped
+
+# Shared by every view that strips diacritics, so each code point is classified once
+STRIP_MARKS_TABLE = NonspacingMarkTable()